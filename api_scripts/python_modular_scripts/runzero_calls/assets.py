@@ -1,6 +1,11 @@
-import requests
+import json
+try:
+    from .client import session_for
+except ImportError:
+    #loaded as a plain module (import assets) from inside runzero_calls
+    from client import session_for
 
-def get_assets(url, token, filter=" ", fields=" "):
+def get_assets(url, token, filter=" ", fields=" ", client=None):
     '''
         Retrieve assets using supplied query filter from Console and restrict to fields supplied.
         
@@ -8,6 +13,7 @@ def get_assets(url, token, filter=" ", fields=" "):
         :param token: A string, Export API Key.
         :param filter: A string, query to filter returned assets(" " returns all).
         :param fields: A string, comma separated string of fields to return(" " returns all).
+        :param client: A RunZeroClient, optional pooled session to send the request through.
         :returns: a dict, JSON object of assets.
         :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
@@ -19,11 +25,44 @@ def get_assets(url, token, filter=" ", fields=" "):
     headers = {'Accept': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
-        response = requests.get(url, headers=headers, params=params, data=payload)
+        response = session_for(client).get(url, headers=headers, params=params, data=payload)
         if not response.ok:
             return ('Unable to retrieve assets' + str(response))
         content = response.json()
         return content
     except ConnectionError as error:
         content = "No Response"
-        raise error
\ No newline at end of file
+        raise error
+
+def stream_assets(url, token, filter=" ", fields=" ", chunk_size=65536, client=None):
+    '''
+        Stream assets using supplied query filter from Console and restrict to fields supplied.
+        Assets are requested from the JSONL export and yielded one at a time as each line
+        arrives, so memory use stays flat regardless of the number of assets returned.
+        
+        :param url: A string, URL of runZero console.
+        :param token: A string, Export API Key.
+        :param filter: A string, query to filter returned assets(" " returns all).
+        :param fields: A string, comma separated string of fields to return(" " returns all).
+        :param chunk_size: An integer, number of bytes to read from the socket at a time.
+        :param client: A RunZeroClient, optional pooled session to send the request through.
+        :yields: a dict, JSON object of a single asset.
+        :raises: HTTPError: if the console responds with an error status.
+        :raises: ConnectionError: if unable to successfully make GET request to console.
+    '''
+
+    url = f"{url}/api/v1.0/export/org/assets.jsonl"
+    params = {'search': filter,
+              'fields': fields}
+    payload = ''
+    headers = {'Accept': 'application/json',
+               'Authorization': f'Bearer {token}'}
+    try:
+        with session_for(client).get(url, headers=headers, params=params, data=payload, stream=True) as response:
+            #a generator cannot hand back an error value like get_assets, so raise and leave exiting to the caller
+            response.raise_for_status()
+            for line in response.iter_lines(chunk_size=chunk_size):
+                if line:
+                    yield json.loads(line)
+    except ConnectionError as error:
+        raise error
@@ -0,0 +1,73 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class RunZeroClient:
+    '''
+        Keep-alive HTTP session shared by the runzero_calls functions. Passing a client
+        to those functions reuses pooled connections to the console instead of paying a
+        new TCP and TLS handshake on every call.
+
+        :param url: A string, URL of runZero console.
+        :param pool_connections: An integer, number of per-host connection pools to cache.
+        :param pool_maxsize: An integer, maximum number of connections kept open per host.
+        :param retries: An integer, number of times to retry a failed request.
+        :param backoff_factor: A float, base of the exponential delay between retries (seconds).
+        :param status_forcelist: A tuple, HTTP status codes that trigger a retry.
+        :param allowed_methods: A tuple, HTTP methods that may be retried.
+    '''
+
+    def __init__(self, url, pool_connections=10, pool_maxsize=10, retries=3, backoff_factor=0.5,
+                 status_forcelist=(429, 500, 502, 503, 504), allowed_methods=('GET', 'HEAD', 'OPTIONS', 'PATCH')):
+        self.url = url
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.session = requests.Session()
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        self.mount(url, retries, backoff_factor, status_forcelist, allowed_methods)
+
+    def mount(self, url, retries=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+              allowed_methods=('GET', 'HEAD', 'OPTIONS', 'PATCH')):
+        '''
+            Attach a pooled adapter with its own retry and backoff policy for requests to
+            the supplied host. Call again with another console URL to tune retries per host.
+
+            :param url: A string, URL prefix (scheme and host) the policy applies to.
+            :param retries: An integer, number of times to retry a failed request.
+            :param backoff_factor: A float, base of the exponential delay between retries (seconds).
+            :param status_forcelist: A tuple, HTTP status codes that trigger a retry.
+            :param allowed_methods: A tuple, HTTP methods that may be retried.
+        '''
+
+        retry = Retry(total=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=status_forcelist,
+                      allowed_methods=frozenset(allowed_methods),
+                      respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=retry)
+        self.session.mount(url, adapter)
+
+    def close(self):
+        '''
+            Close all pooled connections.
+        '''
+
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def session_for(client):
+    '''
+        Return the object to issue HTTP requests through; the client's pooled session
+        if one was supplied, otherwise the requests module.
+
+        :param client: A RunZeroClient or None.
+        :returns: a requests.Session or the requests module.
+    '''
+
+    return client.session if client else requests
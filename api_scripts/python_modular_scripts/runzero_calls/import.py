@@ -1,6 +1,10 @@
-import requests
+try:
+    from .client import session_for
+except ImportError:
+    #loaded as a plain module (import assets) from inside runzero_calls
+    from client import session_for
 
-def nessus(url, token, siteID, scan, name, description=""):
+def nessus(url, token, siteID, scan, name, description="", client=None):
     '''
         Upload a .nessus scan file . 
     
@@ -10,6 +14,7 @@ def nessus(url, token, siteID, scan, name, description=""):
         :param scan: A .nessus file, Nessus scan file to upload (including path).
         :param name: A string, a name for the import task.
         :param description: A string, a description for the import task.
+        :param client: A RunZeroClient, optional pooled session to send the request through.
         :returns: Dict Object, JSON formatted.
         :raises: ConnectionError: if unable to successfully make PUT request to console.
     '''
@@ -22,7 +27,7 @@ def nessus(url, token, siteID, scan, name, description=""):
     headers = {'Accept': 'application/octet-stream',
                'Authorization': f'Bearer {token}'}
     try:
-        response = requests.put(url, headers=headers, params=params, data=payload, files=file)
+        response = session_for(client).put(url, headers=headers, params=params, data=payload, files=file)
         if not response.ok:
             return ('Unable to retrieve assets' + str(response))
         code = response.status_code
@@ -32,7 +37,7 @@ def nessus(url, token, siteID, scan, name, description=""):
         content = "No response"
         raise error
     
-def pcap(url, token, siteID, capture, name, description=""):
+def pcap(url, token, siteID, capture, name, description="", client=None):
     '''
         Upload a capture file . 
     
@@ -42,6 +47,7 @@ def pcap(url, token, siteID, capture, name, description=""):
         :param capture: A capture file, packet capture file to upload (including path).
         :param name: A string, a name for the import task.
         :param description: A string, a description for the import task.
+        :param client: A RunZeroClient, optional pooled session to send the request through.
         :returns: Dict Object, JSON formatted.
         :raises: ConnectionError: if unable to successfully make PUT request to console.
     '''
@@ -55,7 +61,7 @@ def pcap(url, token, siteID, capture, name, description=""):
                'Authorization': f'Bearer {token}'}
     try:
         with open(capture, 'rb') as file:
-            response = requests.put(url, headers=headers, params=params, data=file, stream=True)
+            response = session_for(client).put(url, headers=headers, params=params, data=file, stream=True)
         if not response.ok:
             return ('Unable to retrieve assets' + str(response))
         code = response.status_code
@@ -65,7 +71,7 @@ def pcap(url, token, siteID, capture, name, description=""):
         content = "No response"
         raise error
     
-def scan(url, token, site_id, scan, name, description=""):
+def scan(url, token, site_id, scan, name, description="", client=None):
     '''
         Upload task Data to console.
 
@@ -75,6 +81,7 @@ def scan(url, token, site_id, scan, name, description=""):
         :param scan: A string, filename of the scan data (json.gz) file.
         :param name: A string, a name for the import task.
         :param description: A string, a description for the import task.
+        :param client: A RunZeroClient, optional pooled session to send the request through.
         :raises: ConnectionError: if unable to successfully make PUT request to console.
     '''
     
@@ -86,7 +93,7 @@ def scan(url, token, site_id, scan, name, description=""):
                'Authorization': f'Bearer {token}'}
     try:
         with open(scan, 'rb') as file:
-            response = requests.put(url, params=params, headers=headers, data=file, stream=True)
+            response = session_for(client).put(url, params=params, headers=headers, data=file, stream=True)
         if not response.ok:
             return ('Unable to retrieve assets' + str(response))
         code = response.status_code
@@ -1,9 +1,13 @@
 import json
-import requests
+try:
+    from .client import session_for
+except ImportError:
+    #loaded as a plain module (import assets) from inside runzero_calls
+    from client import session_for
 from requests.exceptions import ConnectionError
 
 
-def oauth_auth(url, client_id, client_secret):
+def oauth_auth(url, client_id, client_secret, client=None):
     url = f'{url}/api/v1.0/account/api/token'
     headers = {'Accept': '*/*', 
                'Content-Type': 'application/x-www-form-urlencoded'}
@@ -11,7 +15,7 @@ def oauth_auth(url, client_id, client_secret):
                'client_id': client_id, 
                'client_secret': client_secret}
     try:
-        response = requests.post(url, headers=headers, data=payload)
+        response = session_for(client).post(url, headers=headers, data=payload)
         if response.status_code != 200:
             print('Unable to authenticate' + str(response))
             exit()
@@ -1,11 +1,17 @@
-import requests
+import json
+try:
+    from .client import session_for
+except ImportError:
+    #loaded as a plain module (import assets) from inside runzero_calls
+    from client import session_for
 
-def get_oids(url, token):
+def get_oids(url, token, client=None):
     '''
         Retrieve Organizational IDs from Console.
 
            :param url: A string, URL of runZero console.
            :param token: A string, Account API Key.
+           :param client: A RunZeroClient, optional pooled session to send the request through.
            :returns: A JSON object, runZero Org data.
            :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
@@ -15,7 +21,7 @@ def get_oids(url, token):
     headers = {'Accept': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
-        response = requests.get(url, headers=headers, data=payload)
+        response = session_for(client).get(url, headers=headers, data=payload)
         if not response.ok:
             print('Unable to retrieve Organization IDs' + str(response))
             exit()
@@ -25,10 +31,11 @@ def get_oids(url, token):
         content = "No Response"
         raise error
 
-def create_org(url, token):
+def create_org(url, token, client=None):
     """ Create an Organization or Project.
 
            :param token: A string, Account API Key.
+           :param client: A RunZeroClient, optional pooled session to send the request through.
            :returns: A JSON object, Successful creation or error.
            :raises: ConnectionError: if unable to successfully make PUT request to console. """
 
@@ -46,7 +53,7 @@ def create_org(url, token):
                'Authorization': f'Bearer {token}'}
 
     try:
-        response = requests.put(url, headers=headers, data=payload)
+        response = session_for(client).put(url, headers=headers, data=payload)
         if not response.ok:
             print('Unable to retrieve Organization IDs' + str(response))
             exit()
@@ -1,5 +1,25 @@
+import csv
 import json
+import os
 import pandas as pd
+import tempfile
+from itertools import chain, islice
+
+#pyarrow is optional and only needed for parquet output
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+#openpyxl is only needed for excel output
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+#Excel's maximum number of rows per worksheet, including the header row
+EXCEL_MAX_ROWS = 1048576
 
 def output_format(format, filename, data):
     '''
@@ -7,13 +27,15 @@ def output_format(format, filename, data):
         
         :param format: A String, the desired output format.
         :param filename: A String, the filename, minus extension.
-        :para data: json data, file contents
+        :para data: json data, file contents. csv, jsonl, json and parquet also accept
+            an iterable of dicts (e.g. stream_assets) and write rows as they arrive.
         :returns None: Calls another function to write the file or prints the output.
     '''
     
     if format == 'json':
-        filename = f'{filename}.json'
-        write_file(filename, json.dumps(data))
+        write_json(f'{filename}.json', data)
+    elif format == 'jsonl':
+        write_jsonl(f'{filename}.jsonl', data)
     elif format == 'txt':
         filename = f'{filename}.txt'
         string_list = []
@@ -21,8 +43,14 @@ def output_format(format, filename, data):
             string_list.append(str(line).replace('{', '').replace('}', '').replace(': ', '='))
         text_file = '\n'.join(string_list)
         write_file(filename, text_file)
-    elif format in ('csv', 'excel', 'html'):
-        write_df(format, filename, data)  
+    elif format == 'csv':
+        write_csv(f'{filename}.csv', data)
+    elif format == 'parquet':
+        write_parquet(f'{filename}.parquet', data)
+    elif format == 'excel':
+        write_xlsx(f'{filename}.xlsx', data)
+    elif format == 'html':
+        write_df(format, filename, data)
     else:
         for line in data:
             print(json.dumps(line, indent=4))
@@ -37,17 +65,277 @@ def write_df(format, filename, data):
         :raises: IOError: if unable to write to file.
     '''
     
-    df = pd.DataFrame(data)
     try:
         if format == "excel":
-            df.to_excel(f'{filename}.xlsx', freeze_panes=(1,0), na_rep='NA')
+            write_xlsx(f'{filename}.xlsx', data)
         elif format == 'csv':
-            df.to_csv(f'{filename}.csv', na_rep='NA')
+            pd.DataFrame(data).to_csv(f'{filename}.csv', na_rep='NA')
         else:
-            df.to_html(f'{filename}.html', render_links=True, na_rep='NA')
+            pd.DataFrame(data).to_html(f'{filename}.html', render_links=True, na_rep='NA')
     except IOError as error:
         raise error
     
+def write_json(filename, data):
+    '''
+        Write rows to a JSON array one row at a time rather than serializing everything at once.
+
+        :param filename: a string, name for file including file extension.
+        :param data: an iterable of dicts, file contents.
+        :raises: IOError: if unable to write to file.
+    '''
+
+    try:
+        with open(filename, 'w') as o:
+            o.write('[')
+            for index, row in enumerate(data):
+                if index:
+                    o.write(', ')
+                o.write(json.dumps(row))
+            o.write(']')
+    except IOError as error:
+        raise error
+
+def write_jsonl(filename, data):
+    '''
+        Write rows as JSON lines, one row per line, as they arrive.
+
+        :param filename: a string, name for file including file extension.
+        :param data: an iterable of dicts, file contents.
+        :raises: IOError: if unable to write to file.
+    '''
+
+    try:
+        with open(filename, 'w') as o:
+            for row in data:
+                o.write(json.dumps(row))
+                o.write('\n')
+    except IOError as error:
+        raise error
+
+def row_fields(data, head):
+    '''
+        Column names for rows, in first seen order. A list is already in memory, so every row is
+        read; for any other iterable only the sampled leading rows are, and keys first seen after
+        them are not written.
+
+        :param data: an iterable of dicts, file contents.
+        :param head: a list, the leading rows already taken from data.
+        :returns: a list, column names.
+    '''
+
+    return list(dict.fromkeys(key for row in (data if isinstance(data, list) else head) for key in row))
+
+def write_csv(filename, data, fields=None, sample=1000):
+    '''
+        Write rows to CSV as they arrive. Columns are given by fields or, if omitted, by the keys of
+        every row of a list or the first sample rows of any other iterable (see row_fields).
+
+        :param filename: a string, name for file including file extension.
+        :param data: an iterable of dicts, file contents.
+        :param fields: a list, column names (optional).
+        :param sample: an integer, number of leading rows used to determine the columns.
+        :raises: IOError: if unable to write to file.
+    '''
+
+    rows = iter(data)
+    head = list(islice(rows, sample))
+    if fields is None:
+        fields = row_fields(data, head)
+    try:
+        with open(filename, 'w', newline='') as o:
+            writer = csv.DictWriter(o, fieldnames=fields, restval='NA', extrasaction='ignore')
+            writer.writeheader()
+            for row in chain(head, rows):
+                writer.writerow({key: 'NA' if value is None else value for key, value in row.items()})
+    except IOError as error:
+        raise error
+
+def excel_value(value):
+    '''
+        Convert a value to something openpyxl can write to a cell.
+
+        :param value: anything, a row value.
+        :returns: 'NA' for None, the value itself for strings, numbers and booleans, otherwise its string form.
+    '''
+
+    if value is None:
+        return 'NA'
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def write_xlsx(filename, data, fields=None, sample=1000, max_rows=EXCEL_MAX_ROWS):
+    '''
+        Write rows to an xlsx workbook in write-only mode, so rows are streamed to disk and memory
+        stays flat however large the report is. When a sheet reaches max_rows a new sheet is started;
+        every sheet repeats the header row and freezes it. The first column numbers the rows from 0,
+        like the index column pandas wrote. Columns are given by fields or, if omitted, by the keys of
+        every row of a list or the first sample rows of any other iterable (see row_fields).
+
+        :param filename: a string, name for file including file extension.
+        :param data: an iterable of dicts, file contents.
+        :param fields: a list, column names (optional).
+        :param sample: an integer, number of leading rows used to determine the columns.
+        :param max_rows: an integer, maximum rows per sheet including the header row.
+        :raises: ImportError: if openpyxl is not installed.
+        :raises: IOError: if unable to write to file.
+    '''
+
+    if Workbook is None:
+        raise ImportError('excel output requires openpyxl (pip install openpyxl)')
+    rows = iter(data)
+    head = list(islice(rows, sample))
+    if fields is None:
+        fields = row_fields(data, head)
+    workbook = Workbook(write_only=True)
+    sheet = None
+    written = 0
+    try:
+        for index, row in enumerate(chain(head, rows)):
+            if sheet is None or written >= max_rows:
+                sheet = workbook.create_sheet(f'Sheet{len(workbook.worksheets) + 1}')
+                sheet.freeze_panes = 'A2'
+                sheet.append([None] + fields)
+                written = 1
+            sheet.append([index] + [excel_value(row.get(field)) for field in fields])
+            written += 1
+        if sheet is None:
+            sheet = workbook.create_sheet('Sheet1')
+            sheet.freeze_panes = 'A2'
+            sheet.append([None] + fields)
+        workbook.save(filename)
+    except IOError as error:
+        raise error
+
+def string_column(values):
+    '''
+        Build a dictionary encoded string Arrow array, converting non string values with str().
+
+        :param values: a list, column values.
+        :returns: a pyarrow DictionaryArray.
+    '''
+
+    values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+    return pa.array(values, type=pa.string()).dictionary_encode()
+
+def arrow_column(values, type=None):
+    '''
+        Build an Arrow array for one column. Nested values (lists, dicts) are stored as JSON strings
+        and string columns are dictionary encoded. Columns whose values have no common Arrow type
+        (e.g. ints mixed with strings, or ints beyond 64 bits) are stored as strings.
+
+        :param values: a list, column values.
+        :param type: a pyarrow DataType, column type of the file (inferred when None).
+        :returns: a pyarrow Array.
+        :raises: ArrowException, OverflowError: if values do not fit the given type.
+    '''
+
+    if any(isinstance(value, (dict, list)) for value in values):
+        values = [json.dumps(value) if isinstance(value, (dict, list)) else value for value in values]
+    if type is None:
+        try:
+            array = pa.array(values)
+        except (pa.ArrowException, OverflowError):
+            return string_column(values)
+        if pa.types.is_null(array.type) or pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+            return string_column(values)
+        return array
+    if pa.types.is_dictionary(type):
+        return string_column(values).cast(type)
+    return pa.array(values, type=type)
+
+def widen_parquet(filename, writer, schema, field):
+    '''
+        Close a Parquet file and copy its row groups to a new temporary file in which one column is
+        stored as dictionary encoded strings. Used when a later batch no longer fits the column type
+        taken from the first batch.
+
+        :param filename: a string, path of the file being written.
+        :param writer: a pyarrow ParquetWriter, open writer for filename (closed here).
+        :param schema: a pyarrow Schema, schema of filename.
+        :param field: a string, name of the column to widen.
+        :returns: a tuple, path, open ParquetWriter and Schema of the new file.
+    '''
+
+    writer.close()
+    index = schema.get_field_index(field)
+    widened = schema.set(index, pa.field(field, pa.dictionary(pa.int32(), pa.string())))
+    fd, path = tempfile.mkstemp(suffix='.parquet', dir=os.path.dirname(os.path.abspath(filename)))
+    os.close(fd)
+    copy = pq.ParquetWriter(path, widened)
+    try:
+        source = pq.ParquetFile(filename)
+        for group in range(source.num_row_groups):
+            table = source.read_row_group(group)
+            column = arrow_column(table.column(index).to_pylist(), widened.field(index).type)
+            copy.write_table(table.set_column(index, widened.field(index), column))
+    except BaseException:
+        copy.close()
+        os.remove(path)
+        raise
+    os.remove(filename)
+    return path, copy, widened
+
+def write_parquet(filename, data, fields=None, batch_size=65536):
+    '''
+        Write rows to a Parquet file in batches as they arrive. String columns are dictionary encoded
+        so repeated values are stored once and readers can load only the columns they need. Columns
+        and their types are given by fields or, if omitted, by the first batch; a column that a later
+        batch no longer fits is rewritten as strings. Rows are written to a temporary file that
+        replaces filename only once every row is written, so a failure leaves no partial file.
+
+        :param filename: a string, name for file including file extension.
+        :param data: an iterable of dicts, file contents.
+        :param fields: a list, column names (optional).
+        :param batch_size: an integer, number of rows per row group.
+        :raises: ImportError: if pyarrow is not installed.
+        :raises: IOError: if unable to write to file.
+    '''
+
+    if pa is None:
+        raise ImportError('parquet output requires pyarrow (pip install pyarrow)')
+    rows = iter(data)
+    writer = None
+    schema = None
+    fd, path = tempfile.mkstemp(suffix='.parquet', dir=os.path.dirname(os.path.abspath(filename)))
+    os.close(fd)
+    try:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            if fields is None:
+                fields = list(dict.fromkeys(key for row in batch for key in row))
+            columns = []
+            for field in fields:
+                values = [row.get(field) for row in batch]
+                if schema is None:
+                    columns.append(arrow_column(values))
+                    continue
+                try:
+                    columns.append(arrow_column(values, schema.field(field).type))
+                except (pa.ArrowException, OverflowError):
+                    path, writer, schema = widen_parquet(path, writer, schema, field)
+                    columns.append(arrow_column(values, schema.field(field).type))
+            if schema is None:
+                table = pa.Table.from_arrays(columns, names=fields)
+                schema = table.schema
+                writer = pq.ParquetWriter(path, schema)
+            else:
+                table = pa.Table.from_arrays(columns, schema=schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(path, filename)
+    except IOError as error:
+        raise error
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(path):
+            os.remove(path)
+
 def write_file(filename, contents):
     '''
         Write contents to output file. 
@@ -1,6 +1,21 @@
+import json
+import os
 import requests
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, RequestException
+from urllib3.util.retry import Retry
+try:
+    from .client import session_for
+except ImportError:
+    #loaded as a plain module (import assets) from inside runzero_calls
+    from client import session_for
 
-def assign_owner(url, token, id, owner, owner_type):
+def assign_owner(url, token, id, owner, owner_type, client=None):
     '''
         Assign supplied owner name to asset ID under given owner_type.
         
@@ -9,6 +24,7 @@ def assign_owner(url, token, id, owner, owner_type):
         :param id: A string, UUID of asset.
         :param owner: A string, name of asset owner.
         :param owner_type: A string, UUID of ownership type.
+        :param client: A RunZeroClient, optional pooled session to send the request through.
         :returns: a dict, JSON object of assets.
         :raises: ConnectionError: if unable to successfully make PATCH request to console.
     '''
@@ -18,7 +34,7 @@ def assign_owner(url, token, id, owner, owner_type):
     headers = {'Content-Type': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
-        response = requests.patch(url, headers=headers, data=payload)
+        response = session_for(client).patch(url, headers=headers, data=payload)
         if not response.ok:
             print('Unable to add owner' + str(response))
             exit()
@@ -26,4 +42,185 @@ def assign_owner(url, token, id, owner, owner_type):
         return content
     except ConnectionError as error:
         content = "No Response"
-        raise error
\ No newline at end of file
+        raise error
+
+class AdaptiveLimit:
+    '''
+        Concurrency limit that halves when the console throttles (HTTP 429) and grows
+        back by one slot after a full window of successful requests (AIMD).
+
+        :param maximum: An integer, the most requests allowed in flight at once.
+    '''
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = maximum
+        self.active = 0
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+def read_ledger(ledger):
+    '''
+        Read a result ledger written by a previous run.
+
+        :param ledger: A string, path to the JSONL result ledger.
+        :returns: a set, asset IDs that were successfully assigned an owner.
+    '''
+
+    done = set()
+    if not os.path.exists(ledger):
+        return done
+    with open(ledger) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                #a line cut short by a crash; the asset will be retried
+                continue
+            if entry.get('status') == 'assigned':
+                done.add(entry['id'])
+    return done
+
+def retry_after(response, default):
+    '''
+        Seconds to wait before retrying a throttled request, taken from the Retry-After
+        header, which holds either a number of seconds or an HTTP-date.
+
+        :param response: A requests.Response, the throttled response.
+        :param default: A float, seconds to wait if the header is missing or invalid.
+        :returns: a float, seconds to wait.
+    '''
+
+    value = response.headers.get('Retry-After', '').strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+def assign_worker(session, limit, url, token, id, owner, owner_type, attempts=5):
+    '''
+        Assign supplied owner name to asset ID under given owner_type, retrying with
+        backoff when the console responds with HTTP 429.
+        
+        :param session: A requests.Session, pooled session shared by all workers.
+        :param limit: An AdaptiveLimit, shared concurrency limit.
+        :param url: A string, URL of runZero console.
+        :param token: A string, Organization API Key.
+        :param id: A string, UUID of asset.
+        :param owner: A string, name of asset owner.
+        :param owner_type: A string, UUID of ownership type.
+        :param attempts: An integer, number of attempts before giving up on the asset.
+        :returns: a dict, result ledger entry for the asset; request errors are recorded with status 'error'.
+    '''
+    
+    url = f"{url}/api/v1.0/org/assets/{id}/owners"
+    payload = json.dumps({"ownerships": [{"ownership_type_id": owner_type, "owner": owner}]})
+    headers = {'Content-Type': 'application/json',
+               'Authorization': f'Bearer {token}'}
+    entry = {'id': id, 'owner': owner}
+    for attempt in range(attempts):
+        limit.acquire()
+        throttled = False
+        try:
+            response = session.patch(url, headers=headers, data=payload)
+            throttled = response.status_code == 429
+        except RequestException as error:
+            #timeouts and other request failures are recorded like any failed assignment so the run carries on
+            entry.update({'status': 'error', 'code': None, 'message': str(error)})
+            return entry
+        finally:
+            limit.release(throttled)
+        if throttled:
+            time.sleep(retry_after(response, 2 ** attempt))
+            continue
+        if response.ok:
+            entry.update({'status': 'assigned', 'code': response.status_code})
+        else:
+            entry.update({'status': 'failed', 'code': response.status_code, 'message': response.text[:200]})
+        return entry
+    entry.update({'status': 'throttled', 'code': 429})
+    return entry
+
+def bulk_assign_owners(url, token, owners, owner_type, ledger, workers=8, client=None):
+    '''
+        Assign owners to assets through a bounded worker pool. Every result is appended
+        to the ledger as it completes, and assets already assigned in the ledger are
+        skipped so an interrupted run can be resumed.
+
+        :param url: A string, URL of runZero console.
+        :param token: A string, Organization API Key.
+        :param owners: An iterable, tuples of asset ID and owner name.
+        :param owner_type: A string, UUID of ownership type.
+        :param ledger: A string, path to the JSONL result ledger.
+        :param workers: An integer, maximum number of concurrent PATCH requests.
+        :param client: A RunZeroClient, optional; its default headers are sent with every request.
+        :returns: a dict, count of ledger entries by status for this run.
+        :raises: IOError: if unable to write to the ledger.
+    '''
+
+    done = read_ledger(ledger)
+    limit = AdaptiveLimit(workers)
+    #a session of our own rather than the client's: its retry policy retries 429 inside urllib3,
+    #so the adaptive limit would never see the console throttling and never back off. urllib3 also
+    #retries any 429 or 503 carrying Retry-After unless respect_retry_after_header is off
+    session = requests.Session()
+    if client:
+        session.headers.update(client.session.headers)
+    retry = Retry(total=3,
+                  backoff_factor=0.5,
+                  status_forcelist=(500, 502, 504),
+                  allowed_methods=frozenset(['PATCH']),
+                  respect_retry_after_header=False,
+                  raise_on_status=False)
+    session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry))
+    summary = {'skipped': 0}
+    pending = set()
+
+    def record(futures):
+        for future in futures:
+            entry = future.result()
+            log.write(json.dumps(entry) + '\n')
+            log.flush()
+            summary[entry['status']] = summary.get(entry['status'], 0) + 1
+
+    try:
+        with open(ledger, 'a') as log, ThreadPoolExecutor(max_workers=workers) as executor:
+            for id, owner in owners:
+                if id in done:
+                    summary['skipped'] += 1
+                    continue
+                #keep the queue of submitted assets bounded
+                if len(pending) >= workers * 4:
+                    completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    record(completed)
+                pending.add(executor.submit(assign_worker, session, limit, url, token, id, owner, owner_type))
+            record(as_completed(pending))
+    except IOError as error:
+        raise error
+    finally:
+        session.close()
+    return summary
\ No newline at end of file
@@ -1,12 +1,21 @@
-import requests
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import ChunkedEncodingError, ConnectionError
+try:
+    from .client import session_for
+except ImportError:
+    #loaded as a plain module (import assets) from inside runzero_calls
+    from client import session_for
     
-def tasks(url, token, type=None, status=None): 
+def tasks(url, token, type=None, status=None, client=None): 
     '''
         Retrieve Tasks from Organization corresponding to supplied token.
 
         :param url: A string, URL of the runZero console.
         :param type: A string, the type of scan task(s) to download.
         :param token: A string, Account API Key.
+        :param client: A RunZeroClient, optional pooled session to send the request through.
         :returns: A JSON object, runZero task data.
         :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
@@ -20,7 +29,7 @@ def tasks(url, token, type=None, status=None):
     headers = {'Accept': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = session_for(client).get(url, headers=headers, params=params)
         if not response.ok:
             print('Unable to retrieve tasks' + str(response))
             exit()
@@ -29,38 +38,107 @@ def tasks(url, token, type=None, status=None):
     except ConnectionError as error:
         raise error
     
-def data(url, token, task_id, path):
+def archive_size(session, url, headers, response):
     '''
-        Download and write task data (.json.gz) for each task ID provided.
+        Full size of the task data archive, read from the Content-Range header of a
+        416 response (bytes */total) or, failing that, the Content-Length of a HEAD request.
+
+        :param session: A requests.Session or the requests module.
+        :param url: A string, URL of the task data.
+        :param headers: A dict, request headers without Range.
+        :param response: A requests.Response, the 416 response.
+        :returns: An integer, size in bytes, or None if the console does not report it.
+    '''
+
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    if total.isdigit():
+        return int(total)
+    head = session.head(url, headers=headers)
+    length = head.headers.get('Content-Length', '')
+    return int(length) if head.ok and length.isdigit() else None
+
+def data(url, token, task_id, path, chunk_size=1048576, attempts=3, client=None):
+    '''
+        Download and write task data (.json.gz) for a task ID. Data is written to a
+        temporary .part file and renamed into place once complete. Interrupted transfers,
+        including .part files left by an earlier run, resume via an HTTP Range request
+        when the console supports it.
 
         :param url: A string, URL of the runZero console.
         :param token: A string, Organization API key.
         :param taskID: A string, UUID of scan task to download.
         :param path: A string, path to write files to.
-        :returns: None, this function returns no data but writes files to disk.
+        :param chunk_size: An integer, number of bytes to read and write at a time.
+        :param attempts: An integer, number of times to try the transfer before giving up.
+        :param client: A RunZeroClient, optional pooled session to send the request through.
+        :returns: An integer, number of bytes transferred.
         :raises: ConnectionError: if unable to successfully make GET request to console.
+        :raises: HTTPError: if the console responds with an error status.
         :raises: IOError: if unable to write file.
     '''
 
     url = f"{url}/api/v1.0/org/tasks/{task_id}/data"
-    payload = ""
-    headers = {'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
-    try:
-        response = requests.get(url, headers=headers, data=payload, stream=True)
-        if not response.ok:
-            print('Unable to retrieve task data' + str(response))
-            exit()
-        with open( f'{path}scan_{task_id}.json.gz', 'wb') as f:
-            for chunk in response.iter_content(chunk_size=128):
-                f.write(chunk)
-    except ConnectionError as error:
-        raise error
-    except IOError as error:
-        raise error
+    filename = f'{path}scan_{task_id}.json.gz'
+    partial = f'{filename}.part'
+    transferred = 0
+    for attempt in range(attempts):
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        headers = {'Accept': 'application/json',
+                   'Accept-Encoding': 'identity',
+                   'Authorization': f'Bearer {token}'}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+        try:
+            with session_for(client).get(url, headers=headers, stream=True) as response:
+                if response.status_code == 416:
+                    headers.pop('Range')
+                    if archive_size(session_for(client), url, headers, response) == offset:
+                        #the .part file already holds the whole archive
+                        break
+                    #the .part file does not match the archive; start over
+                    os.remove(partial)
+                    continue
+                #raised rather than exiting, as this runs in download_data's worker threads
+                response.raise_for_status()
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                with open(partial, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        transferred += len(chunk)
+            break
+        except (ConnectionError, ChunkedEncodingError) as error:
+            if attempt == attempts - 1:
+                raise error
+        except IOError as error:
+            raise error
+    else:
+        raise IOError(f'Unable to download a complete copy of task data for {task_id} in {attempts} attempts')
+    os.replace(partial, filename)
+    return transferred
+
+def download_data(url, token, task_ids, path, workers=4, chunk_size=1048576, client=None):
+    '''
+        Download task data for each task ID provided through a pool of concurrent transfers.
+
+        :param url: A string, URL of the runZero console.
+        :param token: A string, Organization API key.
+        :param task_ids: A list, UUIDs of scan tasks to download.
+        :param path: A string, path to write files to.
+        :param workers: An integer, number of concurrent transfers.
+        :param chunk_size: An integer, number of bytes to read and write at a time.
+        :param client: A RunZeroClient, optional pooled session to send the requests through.
+        :returns: An integer, total number of bytes transferred.
+        :raises: ConnectionError: if unable to successfully make GET request to console.
+        :raises: HTTPError: if the console responds with an error status for any task.
+        :raises: IOError: if unable to write file.
+    '''
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(data, url, token, task_id, path, chunk_size, client=client) for task_id in task_ids]
+        return sum(future.result() for future in futures)
 
 # replace so arg is a dict of scan configuraion
-def new_scan(url, token, site_id, explorer, target_list, name, description, rate): 
+def new_scan(url, token, site_id, explorer, target_list, name, description, rate, client=None): 
     '''
         Create new scan task.
            
@@ -72,6 +150,7 @@ def new_scan(url, token, site_id, explorer, target_list, name, description, rate
         :param name: A string, name for scan task.
         :param description: A string, description for scan task.
         :param rate: A string, scan rate (packets per second).
+        :param client: A RunZeroClient, optional pooled session to send the request through.
         :returns: A JSON object, scan creation results.
         :raises: ConnectionError: if unable to successfully make PUT request to console.
     '''
@@ -106,7 +185,7 @@ def new_scan(url, token, site_id, explorer, target_list, name, description, rate
                'Content-Type': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
-        response = requests.put(url, headers=headers, data=payload)
+        response = session_for(client).put(url, headers=headers, data=payload)
         if not response.ok:
             print('Unable to create task' + str(response))
             exit()
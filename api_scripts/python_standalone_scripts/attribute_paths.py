@@ -0,0 +1,56 @@
+""" attribute_paths.py
+    Compiled flatten_json style attribute path extraction shared by hwProfile.py, serialNumbers.py and lastUser2Owner.py.
+    Keep this file alongside those scripts; they import it from their own directory."""
+
+class AttributePaths:
+    '''
+        Extract a fixed set of flatten_json style attribute paths (e.g. attributes_hw.serialNumber,
+        foreign_attributes_@sentinelone.dev_0_cpuID) from assets without flattening them. Each
+        path is compiled once into the candidate dictionary keys at every position, so
+        extraction is a handful of direct nested lookups per path.
+
+        :param paths: A dict, output field name mapped to attribute path.
+        :param default: anything, value returned for paths missing from an asset.
+    '''
+
+    MISSING = object()
+
+    def __init__(self, paths, default=''):
+        self.default = default
+        self.compiled = []
+        for name, path in paths.items():
+            tokens = path.split('_')
+            #keys[start] lists every key that tokens[start:] could begin with, longest first
+            keys = [[(end, '_'.join(tokens[start:end])) for end in range(len(tokens), start, -1)] for start in range(len(tokens))]
+            indexes = [int(token) if token.isdigit() else None for token in tokens]
+            self.compiled.append((name, len(tokens), keys, indexes))
+
+    def resolve(self, node, length, keys, indexes, start=0):
+        if start == length:
+            #flatten only produces leaf keys, so a path ending at a container has no value
+            return self.MISSING if isinstance(node, (dict, list)) else node
+        if isinstance(node, dict):
+            for end, key in keys[start]:
+                if key in node:
+                    value = self.resolve(node[key], length, keys, indexes, end)
+                    if value is not self.MISSING:
+                        return value
+        elif isinstance(node, list):
+            index = indexes[start]
+            if index is not None and index < len(node):
+                return self.resolve(node[index], length, keys, indexes, start + 1)
+        return self.MISSING
+
+    def extract(self, item):
+        '''
+            Read every compiled path from an asset.
+
+            :param item: A dict, runZero asset.
+            :returns: A dict, output field name mapped to the value found or the default.
+        '''
+
+        values = {}
+        for name, length, keys, indexes in self.compiled:
+            value = self.resolve(item, length, keys, indexes)
+            values[name] = self.default if value is self.MISSING else value
+        return values
@@ -1,5 +1,5 @@
 """ EXAMPLE PYTHON SCRIPT! NOT INTENDED FOR PRODUCTION USE! 
-    dlTasks.py, version 3.0
+    dlTasks.py, version 3.1
     This script will download the scan data from the last 'n' processed tasks in an organization, 
     as specified by the user."""
 
@@ -8,8 +8,14 @@ import json
 import logging
 import os
 import requests
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from getpass import getpass
-from requests.exceptions import ConnectionError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError, ConnectionError
 
 logger = logging.getLogger(__name__)
     
@@ -17,7 +23,7 @@ def parseArgs():
     parser = argparse.ArgumentParser(description="Download task data from the last 'N' processed tasks.")
     parser.add_argument('-t', '--tasks', dest='taskNo', help='Number of tasks, from most recent to oldest to download. This argument will override the .env file', 
                         type=int, required=False, default=os.environ["TASK_NO"])
-    parser.add_argument('-s', '--search', dest='type', help='Type of task to download ( scan | sample | import )', required=True, choices=['scan', 'sample', 'import'])
+    parser.add_argument('-s', '--search', dest='type', help='Type of task to download ( scan | sample | import ), required unless --benchmark is given', required=False, choices=['scan', 'sample', 'import'])
     parser.add_argument('-u', '--url', dest='consoleURL', help='URL of console. This argument will override the .env file', 
                         required=False, default=os.environ["RUNZERO_BASE_URL"])
     parser.add_argument('-k', '--key', dest='token', help='Prompt for Organization API key (do not enter at command line). This argument will override the .env file', 
@@ -26,8 +32,14 @@ def parseArgs():
                         required=False, default=os.environ["SAVE_PATH"])
     parser.add_argument('-l', '--log', help='Path to write log file. This argument will take priority over the .env file', 
                         required=False, default=os.environ["LOG_PATH"])
-    parser.add_argument('--version', action='version', version='%(prog)s 3.0')
-    return parser.parse_args()
+    parser.add_argument('-w', '--workers', help='Number of concurrent downloads', type=int, required=False, default=4)
+    parser.add_argument('-c', '--chunk-size', dest='chunkSize', help='Bytes to read and write at a time', type=int, required=False, default=1048576)
+    parser.add_argument('--benchmark', action='store_true', help='Measure download throughput against a local stand-in server and exit')
+    parser.add_argument('--version', action='version', version='%(prog)s 3.1')
+    args = parser.parse_args()
+    if args.type is None and not args.benchmark:
+        parser.error('the following arguments are required: -s/--search')
+    return args
     
 def get_tasks(url, type, token): 
     '''
@@ -77,52 +89,193 @@ def parse_ids(data, task_number=1000):
         logger.exception('Exiting...')
         exit()
 
-def get_data(url, token, task_id, path):
+def archive_size(session, url, headers, response):
     '''
-        Download and write scan data (.json.gz) for each task ID provided.
+        Full size of the task data archive, read from the Content-Range header of a
+        416 response (bytes */total) or, failing that, the Content-Length of a HEAD request.
 
+        :param session: A requests.Session, pooled session shared by all downloads.
+        :param url: A string, URL of the task data.
+        :param headers: A dict, request headers without Range.
+        :param response: A requests.Response, the 416 response.
+        :returns: An integer, size in bytes, or None if the console does not report it.
+    '''
+
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    if total.isdigit():
+        return int(total)
+    head = session.head(url, headers=headers)
+    length = head.headers.get('Content-Length', '')
+    return int(length) if head.ok and length.isdigit() else None
+
+def get_data(session, url, token, task_id, path, chunk_size=1048576, attempts=3):
+    '''
+        Download and write scan data (.json.gz) for a task ID. Data is written to a
+        temporary .part file that is renamed into place once complete. If the transfer
+        drops, or a .part file is left over from an earlier run, the download resumes
+        from the last byte written via an HTTP Range request when the console supports it.
+
+        :param session: A requests.Session, pooled session shared by all downloads.
         :param url: A string, URL of the runZero console.
         :param token: A string, Organization API key.
-        :param taskID: A string, ID of scan task to download.
+        :param task_id: A string, ID of scan task to download.
         :param path: A string, path to write files to.
-        :returns: None, this function returns no data but writes files to disk.
-        :raises: ConnectionError: if unable to successfully make GET request to console.
-        :raises: IOError: if unable to write file.
+        :param chunk_size: An integer, number of bytes to read and write at a time.
+        :param attempts: An integer, number of times to try the transfer before giving up.
+        :returns: An integer, number of bytes transferred, or None if the download failed.
+        :raises: IOError: if unable to write the .part file or move it into place.
     '''
     
     url = f"{url}/api/v1.0/org/tasks/{task_id}/data"
-    payload = ""
-    headers = {'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
-    try:
-        response = requests.get(url, headers=headers, data=payload, stream=True)
-        logger.info(f"Making GET request to {url}")
-        if not response.ok:
-            logger.critical('Unable to retrieve task data' + str(response), 'exiting...')
-            exit()
-        logger.info('Received response. Writing Task Data to disk.')
-        with open( f"{path}scan_{task_id}.json.gz", 'wb') as f:
-            for chunk in response.iter_content(chunk_size=128):
-                f.write(chunk)
-        logger.info(f"{path}scan_{task_id}.json.gz successfully written to disk.")
-    except ConnectionError:
-        logger.exception('Could not establish connection to console URL, exiting...')
-        exit()
-    except IOError:
-        logger.exception('Could not write task data file, exiting...')
-        exit()
+    filename = f"{path}scan_{task_id}.json.gz"
+    partial = f"{filename}.part"
+    if os.path.exists(filename):
+        logger.info(f"{filename} already exists, skipping.")
+        return 0
+    transferred = 0
+    for attempt in range(attempts):
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        #identity encoding keeps byte offsets on disk aligned with the Range header
+        headers = {'Accept': 'application/json',
+                   'Accept-Encoding': 'identity',
+                   'Authorization': f'Bearer {token}'}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+        try:
+            logger.info(f"Making GET request to {url}")
+            with session.get(url, headers=headers, stream=True) as response:
+                if response.status_code == 416:
+                    headers.pop('Range')
+                    if archive_size(session, url, headers, response) == offset:
+                        #the .part file already holds the whole archive
+                        break
+                    logger.warning(f"Partial data for {task_id} does not match the archive size, restarting from zero.")
+                    os.remove(partial)
+                    continue
+                if not response.ok:
+                    logger.error(f'Unable to retrieve task data for {task_id} {response}')
+                    return None
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                if offset and mode == 'wb':
+                    logger.info(f"Console does not support Range requests, restarting {task_id} from zero.")
+                with open(partial, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        transferred += len(chunk)
+            break
+        except (ConnectionError, ChunkedEncodingError):
+            logger.warning(f"Transfer of {task_id} interrupted (attempt {attempt + 1} of {attempts}).")
+    else:
+        kept = f", partial data kept in {partial}" if os.path.exists(partial) else ""
+        logger.error(f"Unable to download task data for {task_id}{kept}.")
+        return None
+    os.replace(partial, filename)
+    logger.info(f"{filename} successfully written to disk.")
+    return transferred
+
+def download_all(url, token, task_ids, path, workers=4, chunk_size=1048576):
+    '''
+        Download task data for each task ID provided through a pool of concurrent transfers.
+
+        :param url: A string, URL of the runZero console.
+        :param token: A string, Organization API key.
+        :param task_ids: A list, IDs of tasks to download.
+        :param path: A string, path to write files to.
+        :param workers: An integer, number of concurrent transfers.
+        :param chunk_size: An integer, number of bytes to read and write at a time.
+        :returns: A tuple, total bytes transferred and list of task IDs that failed to download or write.
+    '''
+
+    session = requests.Session()
+    session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+    total = 0
+    failed = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(get_data, session, url, token, task_id, path, chunk_size): task_id for task_id in task_ids}
+        for future in as_completed(futures):
+            try:
+                transferred = future.result()
+            except IOError:
+                #a write error in one worker fails that task only; the rest of the downloads carry on
+                logger.exception(f"Could not write task data for {futures[future]}.")
+                transferred = None
+            if transferred is None:
+                failed.append(futures[future])
+            else:
+                total += transferred
+    session.close()
+    elapsed = time.perf_counter() - start
+    logger.info(f"Downloaded {total / 1048576:.1f} MB in {elapsed:.1f}s ({total / 1048576 / max(elapsed, 1e-9):.1f} MB/s), {len(failed)} failed.")
+    return total, failed
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''
+        Local stand-in for the console task data endpoint, serving a fixed block of
+        random bytes with Range support. Used by the throughput benchmark.
+    '''
+
+    body = b''
+
+    def do_GET(self):
+        start = 0
+        status = 200
+        if 'Range' in self.headers:
+            start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            status = 206
+        data = self.body[start:]
+        self.send_response(status)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        view = memoryview(data)
+        for i in range(0, len(view), 1048576):
+            self.wfile.write(view[i:i + 1048576])
+
+    def log_message(self, *args):
+        pass
+
+def benchmark(path, tasks=8, size=33554432):
+    '''
+        Measure download throughput against a local stand-in server for the old serial
+        128 byte chunk download and for concurrent transfers with large chunks.
+
+        :param path: A string, scratch directory to write downloads to.
+        :param tasks: An integer, number of task archives to download per run.
+        :param size: An integer, size in bytes of each archive.
+    '''
+
+    StandInHandler.body = os.urandom(size)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    with tempfile.TemporaryDirectory(dir=path or None) as scratch:
+        for label, workers, chunk_size in (('serial, 128 B chunks', 1, 128), 
+                                           ('serial, 1 MB chunks', 1, 1048576), 
+                                           ('4 workers, 1 MB chunks', 4, 1048576)):
+            for name in os.listdir(scratch):
+                os.remove(os.path.join(scratch, name))
+            start = time.perf_counter()
+            total, _ = download_all(url, 'benchmark', [f'bench-{i}' for i in range(tasks)], f'{scratch}/', workers, chunk_size)
+            elapsed = time.perf_counter() - start
+            print(f'{label:<24} {total / 1048576 / elapsed:8.1f} MB/s')
+    server.shutdown()
 
 def main():
     args = parseArgs()
     logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%a, %d %b %Y %H:%M:%S', filename=f'{args.log}/dlTasks.log', level=logging.INFO)
     logger.info('Started')
+    if args.benchmark:
+        benchmark(args.path)
+        return
     token = args.token
     if token == None:
         token = getpass(prompt="Enter your Organization API Key: ")
     task_info = get_tasks(args.consoleURL, args.type, token)
     id_list = parse_ids(task_info, args.taskNo)
-    for id in id_list:
-        get_data(args.consoleURL, token, id, args.path)
+    total, failed = download_all(args.consoleURL, token, id_list, args.path, args.workers, args.chunkSize)
+    if failed:
+        logger.error(f"Task data could not be downloaded for: {', '.join(failed)}")
     logger.info('Finished')
 
 
@@ -1,11 +1,14 @@
 """ EXAMPLE PYTHON SCRIPT! NOT INTENDED FOR PRODUCTION USE! 
-    extract_asset.py, version 0.2
-    Extract an asset from runZero scan data provided one or more IP addresses."""
+    extract_asset.py, version 0.3
+    Extract an asset from runZero scan data provided one or more IP addresses or CIDR ranges."""
 
 import argparse
+import bisect
 import gzip
+import ipaddress
 import logging
 import os
+import re
 
 logger = logging.getLogger(__name__)
 
@@ -13,58 +16,121 @@ def parseArgs():
     parser = argparse.ArgumentParser(description="Extract asset from runZero scan data.")
     parser.add_argument('-f', '--file', help='filename of runZero scan data (gzip), including path, to extract asset from.', 
                         required=True)
-    parser.add_argument('-a', '--addresses', help='Comma separated list of IP address(es) (no spaces) of lines to extract.', required=True)
+    parser.add_argument('-a', '--addresses', help='Comma separated list of IP address(es) and/or CIDR ranges (no spaces) of lines to extract.', required=True)
     parser.add_argument('-o', '--output', help='filename, including path, of output file.', required=True)
+    parser.add_argument('--field', help='Name of the record field holding the address. Default is host.', required=False, default='host')
     parser.add_argument('-l', '--log', help='Path to write log file. This argument will take priority over the .env file', 
                         required=False, default=os.environ["LOG_PATH"])
-    parser.add_argument('--version', action='version', version='%(prog)s 0.2')
+    parser.add_argument('--version', action='version', version='%(prog)s 0.3')
     return parser.parse_args()
 
-def open_file(filename):
-    logger.info(f"Opening {filename}.")
-    try:
-        with gzip.open( filename, 'rt') as input:
-            data = input.readlines()
-            return data
-    except IOError:
-        logger.exception(f"Could not read input file: {filename}, exiting...")
-        exit()
-    
+class AddressMatcher:
+    '''
+        Match addresses against the requested IPs and CIDR ranges. Single IPs are held in
+        a hash set; ranges are merged into sorted, non-overlapping intervals searched with
+        bisect.
+
+        :param ip_list: A string, comma separated IP addresses and/or CIDR ranges.
+        :raises: ValueError: if an entry is not a valid IP address or network.
+    '''
+
+    def __init__(self, ip_list):
+        self.addresses = set()
+        ranges = {4: [], 6: []}
+        for entry in ip_list.split(','):
+            entry = entry.strip()
+            if not entry:
+                continue
+            if '/' in entry:
+                network = ipaddress.ip_network(entry, strict=False)
+                ranges[network.version].append((int(network.network_address), int(network.broadcast_address)))
+            else:
+                self.addresses.add(str(ipaddress.ip_address(entry)))
+        self.starts = {}
+        self.ends = {}
+        for version, intervals in ranges.items():
+            merged = []
+            for start, end in sorted(intervals):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self.starts[version] = [start for start, _ in merged]
+            self.ends[version] = [end for _, end in merged]
+
+    def __contains__(self, address):
+        if address in self.addresses:
+            return True
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        #the set holds normalized addresses; uncompressed or uppercase IPv6 text only matches once parsed
+        if str(ip) in self.addresses:
+            return True
+        starts = self.starts[ip.version]
+        if not starts:
+            return False
+        position = bisect.bisect_right(starts, int(ip)) - 1
+        return position >= 0 and int(ip) <= self.ends[ip.version][position]
 
-def extract_asset(ip_list, data):
-    addresses = ip_list.split(',')
-    print(addresses)
-    asset = []
-    for ip in addresses:
-        logger.info(f"Extracting {ip} from data.")
-        for line in data:
-            if ip in line:
-                asset.append(line)
-    return asset
+#JSON string literals, including escaped quotes
+STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
 
-def write_file(filename, contents):
+def top_level_value(pattern, line):
     '''
-        Write contents to output file. 
-    
-        :param fileName: a string, name for file including (optionally) file extension.
-        :param contents: anything, file contents.
-        :raises: IOError: if unable to write to file.
+        Find the value of a field in the outermost object of a JSON line. Each regex match
+        is only accepted if the text before it, with string literals removed, leaves exactly
+        one object open, so a nested field of the same name is skipped.
+
+        :param pattern: A compiled regex, matching the field and capturing its value.
+        :param line: A bytes object, one JSON record.
+        :returns: A bytes object, the field value, or None if the record has no such top level field.
+    '''
+
+    for match in pattern.finditer(line):
+        prefix = STRING.sub(b'', line[:match.start()])
+        if prefix.count(b'{') - prefix.count(b'}') == 1 and prefix.count(b'[') == prefix.count(b']'):
+            return match.group(1)
+    return None
+
+def extract_asset(filename, output, matcher, field='host'):
     '''
+        Stream scan data in one pass, read only the top level address field of each record
+        and write records whose address matches to the output file as they are found.
 
+        :param filename: A string, runZero scan data file (gzip), including path.
+        :param output: A string, output filename, including path.
+        :param matcher: An AddressMatcher, requested IPs and ranges.
+        :param field: A string, name of the record field holding the address.
+        :returns: An integer, number of records written.
+        :raises: IOError: if unable to read the input file or write to the output file.
+    '''
+
+    pattern = re.compile(rb'"' + re.escape(field.encode()) + rb'"\s*:\s*"([^"]+)"')
+    matched = 0
     try:
-        logger.info(f"Writing {filename} to disk.")
-        with open( filename, 'w') as o:
-                    o.writelines(contents)
-        logger.info(f"{filename} successfully written to disk.")
+        logger.info(f"Extracting records from {filename} to {output}.")
+        with gzip.open(filename, 'rb') as input, open(output, 'wb') as o:
+            for line in input:
+                address = top_level_value(pattern, line)
+                if address and address.decode() in matcher:
+                    o.write(line)
+                    matched += 1
+        logger.info(f"{matched} records written to {output}.")
+        return matched
     except IOError:
-        logger.exception("Could not write output file, exiting...")
+        logger.exception(f"Could not extract records from {filename}, exiting...")
         exit()
     
 if __name__ == "__main__":
     args = parseArgs()
     logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%a, %d %b %Y %H:%M:%S', filename=f'{args.log}/extract_asset.log', level=logging.INFO)
     logger.info('Started')
-    data = open_file(args.file)
-    results = extract_asset(args.addresses, data)
-    write_file(args.output, results)
+    try:
+        matcher = AddressMatcher(args.addresses)
+    except ValueError:
+        logger.exception('Invalid IP address or CIDR range supplied, exiting...')
+        exit()
+    extract_asset(args.file, args.output, matcher, args.field)
     logger.info('Finished.')
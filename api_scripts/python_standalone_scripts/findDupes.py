@@ -1,5 +1,5 @@
 """ EXAMPLE PYTHON SCRIPT! NOT INTENDED FOR PRODUCTION USE! 
-    findDupes.py, version 4.0
+    findDupes.py, version 4.1
     Query runZero API for all assets found within an Organization (tied to Export API key provided) and sort out assets with
     same MAC, Hostname, and IP but different asset ID. Optionally, an output file format can be specified to write to.
     
@@ -11,11 +11,23 @@ import json
 import logging
 import os
 import pandas as pd
+import random
 import requests
+import time
 from datetime import datetime, timezone
 from getpass import getpass
+from itertools import chain, islice
 from requests.exceptions import ConnectionError
 
+#openpyxl is only needed for excel output
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+#Excel's maximum number of rows per worksheet, including the header row
+EXCEL_MAX_ROWS = 1048576
+
 logger = logging.getLogger(__name__)
     
 def parseArgs():
@@ -31,108 +43,178 @@ def parseArgs():
     parser.add_argument('-l', '--log', help='Path to write log file. This argument will take priority over the .env file', 
                         required=False, default=os.environ["LOG_PATH"])
     parser.add_argument('-o', '--output', dest='output', help='output file format', choices=['txt', 'json', 'csv', 'excel', 'html'], required=False)
-    parser.add_argument('--version', action='version', version='%(prog)s 4.0')
+    parser.add_argument('--max-shared', dest='maxShared', help='Ignore MACs, IPs and hostnames shared by more than this many assets (e.g. virtual MACs, localhost)', 
+                        type=int, required=False, default=50)
+    parser.add_argument('--benchmark', action='store_true', help='Time duplicate detection against synthetic exports of 10k, 100k and 1M assets and exit')
+    parser.add_argument('--version', action='version', version='%(prog)s 4.1')
     return parser.parse_args()
     
-def get_assets(url, token, filter='', fields=''):
+def stream_assets(url, token, filter='', fields='', chunk_size=65536):
     '''
-        Retrieve assets using supplied query filter from Console and restrict to fields supplied.
+        Stream assets using supplied query filter from Console and restrict to fields supplied.
+        Assets are read from the JSONL export and yielded one at a time, so memory use stays
+        flat regardless of Organization size.
         
         :param url: A string, URL of runZero console.
         :param token: A string, Export API Key.
         :param filter: A string, query to filter returned assets(" " returns all).
         :param fields: A string, comma separated string of fields to return(" " returns all).
-        :returns: a dict, JSON object of assets.
+        :param chunk_size: An integer, number of bytes to read from the socket at a time.
+        :yields: a dict, JSON object of a single asset.
         :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
 
-    url = f"{url}/api/v1.0/export/org/assets.json"
+    url = f"{url}/api/v1.0/export/org/assets.jsonl"
     params = {'search': filter,
               'fields': fields}
     payload = ''
     headers = {'Accept': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
-        logger.info(f"Making GET request to {url}")
-        response = requests.get(url, headers=headers, params=params, data=payload)
-        if not response.ok:
-            logger.critical('Unable to retrieve assets' + str(response), 'exiting...')
-            exit()
-        logger.info("Received response.")
-        content = response.json()
-        return content
+        logger.info(f"Making streaming GET request to {url}")
+        with requests.get(url, headers=headers, params=params, data=payload, stream=True) as response:
+            if not response.ok:
+                logger.critical(f'Unable to retrieve assets {response}, exiting...')
+                exit()
+            logger.info("Receiving response.")
+            for line in response.iter_lines(chunk_size=chunk_size):
+                if line:
+                    yield json.loads(line)
+        logger.info("Response stream complete.")
     except ConnectionError:
         logger.exception('Could not establish connection to console URL, exiting...')
         exit()
     
-def find_dupes(data):
+def find_dupes(data, max_shared=50):
     '''
         Parse runZero asset data (JSON) to find potential duplicates. 
+        Assets are indexed by MAC, address and hostname in a single pass, then any assets
+        sharing a value are merged into the same duplicate group (union-find), so run time
+        grows linearly with the number of assets. Values held by more than max_shared assets
+        (e.g. a virtual MAC or the hostname localhost) say nothing about duplication and would
+        chain unrelated assets into one huge group, so they are ignored.
     
-        :param data: a dict, JSON formatted runZero asset data.
+        :param data: an iterable, JSON formatted runZero asset data (list or generator).
+        :param max_shared: an integer, most assets a value may be shared by and still count as a match.
+        :returns: a list, one dict per asset that belongs to a duplicate group, labelled with the group.
         :raises: KeyError: if key:value pair not present in asset data.
     '''
 
-    #Create list of assets(dicts) with unique IDs
-    uniqIDs = []
+    fields = (('macs', 'MAC', 'matched_MACs'),
+              ('addresses', 'IP address', 'matched_Addresses'),
+              ('names', 'Hostname', 'matched_Hostnames'))
+    #Inverted indexes of field value -> positions of assets holding that value
+    indexes = {field: {} for field, _, _ in fields}
+    assets = []
+    seen = {}
+
     try:
         logger.info('Parsing asset data for duplicates.')
         for item in data:
-            count = 0
-            for asset in uniqIDs:
-                if item['id'] == asset['id']:
-                    count += 1
-            if count == 0: 
-                uniqIDs.append(item)
+            #Keep the first record seen for each asset ID
+            if item['id'] in seen:
+                continue
+            position = len(assets)
+            seen[item['id']] = position
+            assets.append(item)
+            for field, _, _ in fields:
+                index = indexes[field]
+                for value in set(item.get(field) or []):
+                    index.setdefault(value, []).append(position)
     except KeyError:
         logger.exception('Key "id" does not exist in data. Exiting...')
         exit()
-    #Loop through unique IDs and identify assets with identical MACs, Hostnames, and/or IPs
-    #Add these assets with duplicate fields to list
+    parent = list(range(len(assets)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    common = 0
+    for field, _, _ in fields:
+        for holders in indexes[field].values():
+            if len(holders) > max_shared:
+                common += 1
+                continue
+            for position in holders[1:]:
+                root_a, root_b = find(holders[0]), find(position)
+                if root_a != root_b:
+                    parent[root_b] = root_a
+    if common:
+        logger.info(f'{common} values shared by more than {max_shared} assets ignored.')
+    groups = {}
+    for position in range(len(assets)):
+        groups.setdefault(find(position), []).append(position)
     possblDups = []
-    for asset in uniqIDs:
-        uid = asset.get('id')
-        macs = asset.get('macs')
-        addresses = asset.get('addresses')
-        hostnames = asset.get('names')
-        for others in uniqIDs:
-            #So asset doesn't match itself as a duplicate
-            if uid == others['id']:
-                pass
-            else:
-                macMatch = False
-                addrMatch = False
-                nameMatch = False
-                matchedMACs = []
-                matchedAddresses = []
-                matchedHostnames = []  
-                for mac in others['macs']:
-                    if mac in macs:
-                        macMatch = True
-                        matchedMACs.append(mac)
-                for addr in others['addresses']:
-                    if addr in addresses:
-                        addrMatch = True
-                        matchedAddresses.append(addr)
-                for name in others['names']:
-                    if name in hostnames:
-                        nameMatch = True
-                        matchedHostnames.append(name)
-                if macMatch or addrMatch or nameMatch:
-                    asset['possible_dupe'] = {'id': others['id'], 'os': others['os'], 'hw': others['hw']}
-                    asset['shared_fields'] = {'MAC': macMatch,
-                                                'matched_MACs': matchedMACs,  
-                                                'IP address': addrMatch, 
-                                                'matched_Addresses': matchedAddresses, 
-                                                'Hostname': nameMatch, 
-                                                'matched_Hostnames': matchedHostnames, 
-                                                'site': others['site_id']}
-                    possblDups.append(asset)
-    logger.info('Data assessed for duplicate asset records.')
+    group_no = 0
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        group_no += 1
+        for position in members:
+            asset = assets[position]
+            shared_fields = {}
+            for field, label, matched in fields:
+                values = [value for value in set(asset.get(field) or []) if 1 < len(indexes[field][value]) <= max_shared]
+                shared_fields[label] = len(values) > 0
+                shared_fields[matched] = values
+            asset['dupe_group'] = group_no
+            asset['dupe_group_size'] = len(members)
+            asset['shared_fields'] = shared_fields
+            possblDups.append(asset)
+    logger.info(f'Data assessed for duplicate asset records; {group_no} duplicate groups found.')
     if len(possblDups) > 0:
         return possblDups
     else:
         return([{"Msg": "No potential duplicate assets found."}])
+
+def synthetic_assets(count, dupe_ratio=0.05, seed=0):
+    '''
+        Generate synthetic runZero asset records for benchmarking. A portion of the assets 
+        reuse a MAC, address or hostname of an earlier asset so that duplicate groups form.
+
+        :param count: An integer, number of assets to generate.
+        :param dupe_ratio: A float, fraction of assets that share a field with another asset.
+        :param seed: An integer, seed for the random number generator.
+        :yields: a dict, synthetic asset record.
+    '''
+
+    rng = random.Random(seed)
+    for i in range(count):
+        asset = {'id': f'00000000-0000-0000-0000-{i:012x}',
+                 'os': 'Linux',
+                 'hw': 'Generic',
+                 'site_id': 'synthetic',
+                 'alive': True,
+                 'macs': [':'.join(f'{(i >> shift) & 0xff:02x}' for shift in (40, 32, 24, 16, 8, 0))],
+                 'addresses': [f'10.{(i >> 16) & 0xff}.{(i >> 8) & 0xff}.{i & 0xff}'],
+                 'names': [f'host-{i}']}
+        if i > 0 and rng.random() < dupe_ratio:
+            other = rng.randrange(i)
+            field = rng.choice(('macs', 'addresses', 'names'))
+            if field == 'macs':
+                asset['macs'].append(':'.join(f'{(other >> shift) & 0xff:02x}' for shift in (40, 32, 24, 16, 8, 0)))
+            elif field == 'addresses':
+                asset['addresses'].append(f'10.{(other >> 16) & 0xff}.{(other >> 8) & 0xff}.{other & 0xff}')
+            else:
+                asset['names'].append(f'host-{other}')
+        yield asset
+
+def benchmark(sizes=(10000, 100000, 1000000)):
+    '''
+        Time find_dupes against synthetic exports of increasing size and print the results.
+
+        :param sizes: A tuple, number of assets to generate for each run.
+    '''
+
+    for size in sizes:
+        assets = list(synthetic_assets(size))
+        start = time.perf_counter()
+        dupes = find_dupes(assets)
+        elapsed = time.perf_counter() - start
+        print(f'{size:>9} assets: {elapsed:8.2f}s, {len(dupes)} assets in duplicate groups')
     
 def output_format(format, filename, data):
     '''
@@ -160,6 +242,63 @@ def output_format(format, filename, data):
         for line in data:
             print(json.dumps(line, indent=4))
     
+#excel_value and write_xlsx are copies of excel_value and write_xlsx in python_modular_scripts/runzero_calls/output.py,
+#as standalone scripts do not import runzero_calls; change them together
+def excel_value(value):
+    '''
+        Convert a value to something openpyxl can write to a cell.
+
+        :param value: anything, a row value.
+        :returns: 'NA' for None, the value itself for strings, numbers and booleans, otherwise its string form.
+    '''
+
+    if value is None:
+        return 'NA'
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def write_xlsx(filename, data, fields=None, sample=1000, max_rows=EXCEL_MAX_ROWS):
+    '''
+        Write rows to an xlsx workbook in write-only mode, so rows are streamed to disk and memory
+        stays flat however large the report is. When a sheet reaches max_rows a new sheet is started;
+        every sheet repeats the header row and freezes it. The first column numbers the rows from 0,
+        like the index column pandas wrote. Columns are given by fields or, if omitted, by the keys of
+        every row of a list or the first sample rows of any other iterable, in first seen order.
+
+        :param filename: a string, name for file including file extension.
+        :param data: an iterable of dicts, file contents.
+        :param fields: a list, column names (optional).
+        :param sample: an integer, number of leading rows used to determine the columns.
+        :param max_rows: an integer, maximum rows per sheet including the header row.
+        :raises: ImportError: if openpyxl is not installed.
+        :raises: IOError: if unable to write to file.
+    '''
+
+    if Workbook is None:
+        raise ImportError('excel output requires openpyxl (pip install openpyxl)')
+    rows = iter(data)
+    head = list(islice(rows, sample))
+    if fields is None:
+        #a list is already in memory, so every row is read; for any other iterable keys first seen after the sample are not written
+        fields = list(dict.fromkeys(key for row in (data if isinstance(data, list) else head) for key in row))
+    workbook = Workbook(write_only=True)
+    sheet = None
+    written = 0
+    for index, row in enumerate(chain(head, rows)):
+        if sheet is None or written >= max_rows:
+            sheet = workbook.create_sheet(f'Sheet{len(workbook.worksheets) + 1}')
+            sheet.freeze_panes = 'A2'
+            sheet.append([None] + fields)
+            written = 1
+        sheet.append([index] + [excel_value(row.get(field)) for field in fields])
+        written += 1
+    if sheet is None:
+        sheet = workbook.create_sheet('Sheet1')
+        sheet.freeze_panes = 'A2'
+        sheet.append([None] + fields)
+    workbook.save(filename)
+
 def write_df(format, filename, data):
     '''
         Write contents to output file. 
@@ -170,15 +309,14 @@ def write_df(format, filename, data):
         :raises: IOError: if unable to write to file.
     '''
     
-    df = pd.DataFrame(data)
     try:
         logger.info(f"Writing {filename} in {format} to disk.")
         if format == "excel":
-            df.to_excel(f'{filename}.xlsx', freeze_panes=(1,0), na_rep='NA')
+            write_xlsx(f'{filename}.xlsx', data)
         elif format == 'csv':
-            df.to_csv(f'{filename}.csv', na_rep='NA')
+            pd.DataFrame(data).to_csv(f'{filename}.csv', na_rep='NA')
         else:
-            df.to_html(f'{filename}.html', render_links=True, na_rep='NA')
+            pd.DataFrame(data).to_html(f'{filename}.html', render_links=True, na_rep='NA')
     except IOError:
         logger.exception(f"Could not write output file: {filename}, exiting...")
         exit()
@@ -205,6 +343,9 @@ def main():
     args = parseArgs()
     logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%a, %d %b %Y %H:%M:%S', filename=f'{args.log}/findDupes.log', level=logging.INFO)
     logger.info('Started')
+    if args.benchmark:
+        benchmark()
+        return
     #Output report name; default uses UTC time
     timestamp = str(datetime.now(timezone.utc).strftime('%y-%m-%d%Z_%H-%M-%S'))
     filename = f'{args.path}Duplicate_Asset_Report_{timestamp}'
@@ -213,8 +354,8 @@ def main():
         token = getpass(prompt="Enter your Export API Key: ")
     #fields to return in API call; modify for more or less
     fields = "id, os, hw, addresses, macs, names, alive, site_id"
-    assets = get_assets(args.consoleURL, token, f"first_seen:<{args.timeRange}", fields)
-    dupes = find_dupes(assets)
+    assets = stream_assets(args.consoleURL, token, f"first_seen:<{args.timeRange}", fields)
+    dupes = find_dupes(assets, args.maxShared)
     output_format(args.output, filename, dupes)
     logger.info('Finished.')
 
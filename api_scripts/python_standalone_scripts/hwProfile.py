@@ -1,5 +1,5 @@
 """ EXAMPLE PYTHON SCRIPT! NOT INTENDED FOR PRODUCTION USE! 
-    hwProfile.py, version 4.0
+    hwProfile.py, version 4.1
     Query runZero API for physical assets found within an Organization (tied to Export API key provided) and generate JSON
     output of all attributes describing the physical hardware of the asset."""
 
@@ -9,10 +9,22 @@ import logging
 import os
 import pandas as pd
 import requests
+import time
 from datetime import datetime, timezone
 from flatten_json import flatten
 from getpass import getpass
+from itertools import chain, islice
 from requests.exceptions import ConnectionError
+from attribute_paths import AttributePaths
+
+#openpyxl is only needed for excel output
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+#Excel's maximum number of rows per worksheet, including the header row
+EXCEL_MAX_ROWS = 1048576
 
 logger = logging.getLogger(__name__)
     
@@ -27,40 +39,61 @@ def parseArgs():
     parser.add_argument('-l', '--log', help='Path to write log file. This argument will take priority over the .env file', 
                         required=False, default=os.environ["LOG_PATH"])
     parser.add_argument('-o', '--output', dest='output', help='output file format', choices=['txt', 'json', 'csv', 'excel', 'html'], required=False)
-    parser.add_argument('--version', action='version', version='%(prog)s 4.0')
+    parser.add_argument('--benchmark', action='store_true', help='Compare attribute extraction against flattening on synthetic assets and exit')
+    parser.add_argument('--version', action='version', version='%(prog)s 4.1')
     return parser.parse_args()
 
-def get_assets(url, token, filter='', fields=''):
+def stream_assets(url, token, filter='', fields='', chunk_size=65536):
     '''
-        Retrieve assets using supplied query filter from Console and restrict to fields supplied.
+        Stream assets using supplied query filter from Console and restrict to fields supplied.
+        Assets are read from the JSONL export and yielded one at a time, so memory use stays
+        flat regardless of Organization size.
         
         :param url: A string, URL of runZero console.
         :param token: A string, Export API Key.
         :param filter: A string, query to filter returned assets(" " returns all).
         :param fields: A string, comma separated string of fields to return(" " returns all).
-        :returns: a dict, JSON object of assets.
+        :param chunk_size: An integer, number of bytes to read from the socket at a time.
+        :yields: a dict, JSON object of a single asset.
         :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
 
-    url = f"{url}/api/v1.0/export/org/assets.json"
+    url = f"{url}/api/v1.0/export/org/assets.jsonl"
     params = {'search': filter,
               'fields': fields}
     payload = ''
     headers = {'Accept': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
-        logger.info(f"Making GET request to {url}")
-        response = requests.get(url, headers=headers, params=params, data=payload)
-        if not response.ok:
-            logger.critical('Unable to retrieve assets' + str(response), 'exiting...')
-            exit()
-        logger.info("Received response.")
-        content = response.json()
-        return content
-    except ConnectionError as error:
+        logger.info(f"Making streaming GET request to {url}")
+        with requests.get(url, headers=headers, params=params, data=payload, stream=True) as response:
+            if not response.ok:
+                logger.critical(f'Unable to retrieve assets {response}, exiting...')
+                exit()
+            logger.info("Receiving response.")
+            for line in response.iter_lines(chunk_size=chunk_size):
+                if line:
+                    yield json.loads(line)
+        logger.info("Response stream complete.")
+    except ConnectionError:
         logger.exception('Could not establish connection to console URL, exiting...')
         exit()
     
+#Hardware attributes to report; output field name mapped to attribute path
+HW_PATH_LIST = {'hw.product': 'attributes_hw.product',
+                'hw.device': 'attributes_hw.device',
+                'hw.vendor': 'attributes_hw.vendor',
+                'snmp.sysDesc': 'attributes_snmp.sysDesc',
+                'hw.serialNumber': 'attributes_hw.serialNumber',
+                'snmp.serialNumbers': 'attributes_snmp.serialNumbers',
+                'ilo.serialNumber': 'attributes_ilo.serialNumber',
+                'cpuID': 'foreign_attributes_@sentinelone.dev_0_cpuID',
+                'modelName': 'foreign_attributes_@sentinelone.dev_0_modelName',
+                'device.model': 'foreign_attributes_@miradore.dev_0_device.model',
+                'device.serialnumber': 'foreign_attributes_@miradore.dev_0_device.serialNumber',
+                'systemProductName': 'foreign_attributes_@crowdstrike.dev_0_systemProductName'}
+HW_PATHS = AttributePaths(HW_PATH_LIST)
+
 def parse_hw(data):
     '''
         Search assets "attributes" and "foreign_attributes"
@@ -80,23 +113,7 @@ def parse_hw(data):
                 if not isinstance(value, dict):
                     asset[key] = item.get(key)
 
-            root_keys_to_ignore = []
-            for key, value in item.items():
-                if not isinstance(value, dict):
-                    root_keys_to_ignore.append(key)
-                flattened_items = flatten(nested_dict=item, root_keys_to_ignore=root_keys_to_ignore)
-                asset['hw.product'] = flattened_items.get('attributes_hw.product', '')
-                asset['hw.device'] = flattened_items.get('attributes_hw.device', '')
-                asset['hw.vendor'] = flattened_items.get('attributes_hw.vendor', '')
-                asset['snmp.sysDesc'] = flattened_items.get('attributes_snmp.sysDesc', '')
-                asset['hw.serialNumber'] = flattened_items.get('attributes_hw.serialNumber', '')
-                asset['snmp.serialNumbers'] = flattened_items.get('attributes_snmp.serialNumbers', '') 
-                asset['ilo.serialNumber'] = flattened_items.get('attributes_ilo.serialNumber', '')
-                asset['cpuID'] = flattened_items.get('foreign_attributes_@sentinelone.dev_0_cpuID', '')
-                asset['modelName'] = flattened_items.get('foreign_attributes_@sentinelone.dev-0-modelName', '')
-                asset['device.model'] = flattened_items.get('foreign_attributes_@miradore.dev_0_device.model', '')
-                asset['device.serialnumber'] = flattened_items.get('foreign_attributes_@miradore.dev_0_device.serialNumber', '')
-                asset['systemProductName'] = flattened_items.get('foreign_attributes_@crowdstrike.dev_0_systemProductName', '')
+            asset.update(HW_PATHS.extract(item))
             asset_list.append(asset)
         logger.info('Hardware parsing complete.')
         return(asset_list)
@@ -104,6 +121,56 @@ def parse_hw(data):
         logger.exception('Data provided was not a dictionary. Exiting...')
         exit()
     
+def synthetic_asset(i):
+    '''
+        Build a synthetic asset with runZero style attributes and foreign attributes for benchmarking.
+
+        :param i: An integer, asset number.
+        :returns: A dict, synthetic asset.
+    '''
+
+    attributes = {f'attr.{n}': f'value {n}' for n in range(60)}
+    attributes.update({'hw.product': 'PowerEdge R740', 'hw.vendor': 'Dell', 'hw.serialNumber': f'SN{i:08d}',
+                       'snmp.sysDesc': 'Linux', 'ilo.serialNumber': f'ILO{i:08d}'})
+    #list valued attribute on a reported path; flatten only yields its elements, so the path itself has no value
+    if i % 2:
+        attributes['snmp.serialNumbers'] = [f'SN{i:08d}', f'PSU{i:08d}']
+    source = {f'field{n}': f'value {n}' for n in range(30)}
+    return {'id': f'asset-{i}', 'os': 'Linux', 'os_vendor': 'Ubuntu', 'hw': 'Dell PowerEdge', 'addresses': [f'10.0.{i // 256 % 256}.{i % 256}'],
+            'attributes': attributes,
+            'foreign_attributes': {'@sentinelone.dev': [dict(source, cpuID=f'cpu{i}', modelName='R740')],
+                                   '@crowdstrike.dev': [dict(source, systemProductName='PowerEdge R740')],
+                                   '@miradore.dev': [dict(source, **{'device.model': 'R740', 'device.serialNumber': f'SN{i:08d}'})]}}
+
+def benchmark(count=2000):
+    '''
+        Compare reading the hardware paths by flattening each asset once per top level key
+        (the previous approach) against the compiled AttributePaths extractor, and print timings.
+
+        :param count: An integer, number of synthetic assets.
+    '''
+
+    assets = [synthetic_asset(i) for i in range(count)]
+    flattened = []
+    extracted = []
+    start = time.perf_counter()
+    for item in assets:
+        root_keys_to_ignore = []
+        for key, value in item.items():
+            if not isinstance(value, dict):
+                root_keys_to_ignore.append(key)
+            flattened_items = flatten(nested_dict=item, root_keys_to_ignore=root_keys_to_ignore)
+            values = {name: flattened_items.get(path, '') for name, path in HW_PATH_LIST.items()}
+        flattened.append(values)
+    flatten_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for item in assets:
+        extracted.append(HW_PATHS.extract(item))
+    extract_time = time.perf_counter() - start
+    print(f'flatten per key:  {flatten_time:8.3f}s for {count} assets')
+    print(f'AttributePaths:   {extract_time:8.3f}s for {count} assets ({flatten_time / extract_time:.0f}x faster)')
+    print(f'results match: {flattened == extracted}')
+    
 def output_format(format, filename, data):
     '''
         Determine output format and call function to write appropriate file.
@@ -130,6 +197,63 @@ def output_format(format, filename, data):
         for line in data:
             print(json.dumps(line, indent=4))
     
+#excel_value and write_xlsx are copies of excel_value and write_xlsx in python_modular_scripts/runzero_calls/output.py,
+#as standalone scripts do not import runzero_calls; change them together
+def excel_value(value):
+    '''
+        Convert a value to something openpyxl can write to a cell.
+
+        :param value: anything, a row value.
+        :returns: 'NA' for None, the value itself for strings, numbers and booleans, otherwise its string form.
+    '''
+
+    if value is None:
+        return 'NA'
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def write_xlsx(filename, data, fields=None, sample=1000, max_rows=EXCEL_MAX_ROWS):
+    '''
+        Write rows to an xlsx workbook in write-only mode, so rows are streamed to disk and memory
+        stays flat however large the report is. When a sheet reaches max_rows a new sheet is started;
+        every sheet repeats the header row and freezes it. The first column numbers the rows from 0,
+        like the index column pandas wrote. Columns are given by fields or, if omitted, by the keys of
+        every row of a list or the first sample rows of any other iterable, in first seen order.
+
+        :param filename: a string, name for file including file extension.
+        :param data: an iterable of dicts, file contents.
+        :param fields: a list, column names (optional).
+        :param sample: an integer, number of leading rows used to determine the columns.
+        :param max_rows: an integer, maximum rows per sheet including the header row.
+        :raises: ImportError: if openpyxl is not installed.
+        :raises: IOError: if unable to write to file.
+    '''
+
+    if Workbook is None:
+        raise ImportError('excel output requires openpyxl (pip install openpyxl)')
+    rows = iter(data)
+    head = list(islice(rows, sample))
+    if fields is None:
+        #a list is already in memory, so every row is read; for any other iterable keys first seen after the sample are not written
+        fields = list(dict.fromkeys(key for row in (data if isinstance(data, list) else head) for key in row))
+    workbook = Workbook(write_only=True)
+    sheet = None
+    written = 0
+    for index, row in enumerate(chain(head, rows)):
+        if sheet is None or written >= max_rows:
+            sheet = workbook.create_sheet(f'Sheet{len(workbook.worksheets) + 1}')
+            sheet.freeze_panes = 'A2'
+            sheet.append([None] + fields)
+            written = 1
+        sheet.append([index] + [excel_value(row.get(field)) for field in fields])
+        written += 1
+    if sheet is None:
+        sheet = workbook.create_sheet('Sheet1')
+        sheet.freeze_panes = 'A2'
+        sheet.append([None] + fields)
+    workbook.save(filename)
+
 def write_df(format, filename, data):
     '''
         Write contents to output file. 
@@ -140,15 +264,14 @@ def write_df(format, filename, data):
         :raises: IOError: if unable to write to file.
     '''
     
-    df = pd.DataFrame(data)
     try:
         logger.info(f"Writing {filename} in {format} to disk.")
         if format == "excel":
-            df.to_excel(f'{filename}.xlsx', freeze_panes=(1,0), na_rep='NA')
+            write_xlsx(f'{filename}.xlsx', data)
         elif format == 'csv':
-            df.to_csv(f'{filename}.csv', na_rep='NA')
+            pd.DataFrame(data).to_csv(f'{filename}.csv', na_rep='NA')
         else:
-            df.to_html(f'{filename}.html', render_links=True, na_rep='NA')
+            pd.DataFrame(data).to_html(f'{filename}.html', render_links=True, na_rep='NA')
         logger.info(f"output file written to {filename} in {format}")
     except IOError:
        logger.exception(f"Could not write output file: {filename}, exiting...")
@@ -176,6 +299,9 @@ def main():
     args = parseArgs()
     logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%a, %d %b %Y %H:%M:%S', filename=f'{args.log}/hwProfile.log', level=logging.INFO)
     logger.info('Started')
+    if args.benchmark:
+        benchmark()
+        return
     #Output report name; default uses UTC time
     timestamp = str(datetime.now(timezone.utc).strftime('%y-%m-%d%Z_%H-%M-%S'))
     filename = f'{args.path}Physical_Hardware_Types_{timestamp}'
@@ -186,7 +312,7 @@ def main():
     query = "not attribute:=virtual and not (source:=vmware or source:=aws or source:=gcp or source:=azure)"
     #fields to return in API call; modify for more or less
     fields = "os, os_vendor, hw, addresses, attributes, foreign_attributes"
-    results = get_assets(args.consoleURL, token, query, fields)
+    results = stream_assets(args.consoleURL, token, query, fields)
     parsed = parse_hw(results)
     output_format(args.output, filename, parsed)
     logger.info('Finished.')
@@ -1,5 +1,5 @@
 """ EXAMPLE PYTHON SCRIPT! NOT INTENDED FOR PRODUCTION USE! 
-    lastUser2Owner.py, version 1.2
+    lastUser2Owner.py, version 1.3
     This script will search asset foreign attributes (EDR, MDM, etc.) for last logon user information
     and apply last logged on user as an asset owner type defined in the provided argument (e.g. Primary User)"""
 
@@ -7,9 +7,16 @@ import argparse
 import json
 import os
 import requests
-from flatten_json import flatten
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from getpass import getpass
-from requests.exceptions import ConnectionError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, RequestException
+from urllib3.util.retry import Retry
+from attribute_paths import AttributePaths
     
 def parseArgs():
     parser = argparse.ArgumentParser(description="Search assets for last user field and assign last user as asset owner.")
@@ -18,38 +25,50 @@ def parseArgs():
     parser.add_argument('-k', '--key', dest='token', help='Prompt for Organization API key (do not enter at command line). This argument will override the .env file', 
                         nargs='?', const=None, required=False, default=os.environ["RUNZERO_ORG_TOKEN"])
     parser.add_argument('-t', '--type', help='Ownership type UUID that reported last users should be assigned to', required=True)
-    parser.add_argument('--version', action='version', version='%(prog)s 1.2')
+    parser.add_argument('-w', '--workers', help='Maximum number of concurrent ownership requests', type=int, required=False, default=8)
+    parser.add_argument('--ledger', help='Path to the result ledger; assets already assigned in the ledger are skipped on the next run', 
+                        required=False, default='lastUser2Owner_ledger.jsonl')
+    parser.add_argument('--version', action='version', version='%(prog)s 1.3')
     return parser.parse_args()
     
-def get_assets(url, token, filter=" ", fields=" "):
+def stream_assets(url, token, filter=" ", fields=" ", chunk_size=65536):
     '''
-        Retrieve assets using supplied query filter from Console and restrict to fields supplied.
+        Stream assets using supplied query filter from Console and restrict to fields supplied.
+        Assets are read from the JSONL export and yielded one at a time, so memory use stays
+        flat regardless of Organization size.
         
         :param url: A string, URL of runZero console.
         :param token: A string, Organization API Key.
         :param filter: A string, query to filter returned assets(" " returns all).
         :param fields: A string, comma separated string of fields to return(" " returns all).
-        :returns: a dict, JSON object of assets.
+        :param chunk_size: An integer, number of bytes to read from the socket at a time.
+        :yields: a dict, JSON object of a single asset.
         :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
 
-    url = f"{url}/api/v1.0/export/org/assets.json"
+    url = f"{url}/api/v1.0/export/org/assets.jsonl"
     params = {'search': filter,
               'fields': fields}
     payload = ''
     headers = {'Accept': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
-        response = requests.get(url, headers=headers, params=params, data=payload)
-        if not response.ok:
-            print('Unable to retrieve assets' + str(response))
-            exit()
-        content = response.json()
-        return content
+        with requests.get(url, headers=headers, params=params, data=payload, stream=True) as response:
+            if not response.ok:
+                print('Unable to retrieve assets' + str(response))
+                exit()
+            for line in response.iter_lines(chunk_size=chunk_size):
+                if line:
+                    yield json.loads(line)
     except ConnectionError as error:
-        content = "No Response"
         raise error
     
+#Last user attributes per source; output field name mapped to attribute path
+USER_PATHS = AttributePaths({'s1_user': 'foreign_attributes_@sentinelone.dev_0_lastLoggedInUserName',
+                             'mir_user': 'foreign_attributes_@miradore.dev_0_user.name',
+                             'goog_user': 'foreign_attributes_@googleworkspace.chromeos_0_recentUsers',
+                             'cs_user': 'foreign_attributes_@crowdstrike.dev_0_lastLoginUser'}, default=None)
+
 def get_users(data):
     '''
         Search asset "foreign_attributes" and extract last user where available, discard the rest.
@@ -67,30 +86,18 @@ def get_users(data):
                 if not isinstance(value, dict) and key == 'id':
                     asset[key] = item.get(key)
 
-            root_keys_to_ignore = []
-            for key, value in item.items():
-                if not isinstance(value, dict):
-                    root_keys_to_ignore.append(key)
-                flattened_items = flatten(nested_dict=item, root_keys_to_ignore=root_keys_to_ignore)
-                asset['s1_user'] = flattened_items.get('foreign_attributes_@sentinelone.dev_0_lastLoggedInUserName', None)
-                asset['mir_user'] = flattened_items.get('foreign_attributes_@miradore.dev_0_user.name', None)
-                asset['goog_user'] = flattened_items.get('foreign_attributes_@googleworkspace.chromeos_0_recentUsers', None)
-                asset['cs_user'] = flattened_items.get('foreign_attributes_@crowdstrike.dev_0_lastLoginUser', None)
+            asset.update(USER_PATHS.extract(item))
             assetList.append(asset)
         return(assetList)
     except TypeError as error:
         raise error
     
-def parse_owners(url, token, ownerList, owner_type):
+def parse_owners(ownerList):
     '''
         Parse supplied ownership sources for most detailed owner info.
-        Pass owner to assign function to assign owner info. 
 
-        :param url: A string, URL of runZero console.
-        :param token: A string, Organization API Key.
-        :param ownerList: A list, list of dictionaries containing asset ID and last user info.
-        :param owner_type: A string, UUID of ownership type.
-        :raises: ConnectionError: if unable to successfully make PATCH request to console.
+        :param ownerList: An iterable, dictionaries containing asset ID and last user info.
+        :yields: a tuple, asset ID and best owner name for each asset with a usable owner.
     '''
     
     #to do: improve method of filtering out system accounts
@@ -104,36 +111,187 @@ def parse_owners(url, token, ownerList, owner_type):
             else:
                 best_owner = v
         if best_owner != '':
-            assignment = assign_owner(url, token, owner['id'], best_owner, owner_type)
-            return assignment
+            yield owner['id'], best_owner
+
+#AdaptiveLimit, read_ledger and retry_after are identical copies of those in python_modular_scripts/runzero_calls/ownership.py,
+#and assign_owner and bulk_assign of its assign_worker and bulk_assign_owners (less the client argument), as standalone
+#scripts do not import runzero_calls; change both copies together
+class AdaptiveLimit:
+    '''
+        Concurrency limit that halves when the console throttles (HTTP 429) and grows
+        back by one slot after a full window of successful requests (AIMD).
+
+        :param maximum: An integer, the most requests allowed in flight at once.
+    '''
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = maximum
+        self.active = 0
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+def read_ledger(ledger):
+    '''
+        Read a result ledger written by a previous run.
+
+        :param ledger: A string, path to the JSONL result ledger.
+        :returns: a set, asset IDs that were successfully assigned an owner.
+    '''
+
+    done = set()
+    if not os.path.exists(ledger):
+        return done
+    with open(ledger) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                #a line cut short by a crash; the asset will be retried
+                continue
+            if entry.get('status') == 'assigned':
+                done.add(entry['id'])
+    return done
 
-def assign_owner(url, token, id, owner, owner_type):
+def retry_after(response, default):
     '''
-        Assign supplied owner name to asset ID under given owner_type.
+        Seconds to wait before retrying a throttled request, taken from the Retry-After
+        header, which holds either a number of seconds or an HTTP-date.
+
+        :param response: A requests.Response, the throttled response.
+        :param default: A float, seconds to wait if the header is missing or invalid.
+        :returns: a float, seconds to wait.
+    '''
+
+    value = response.headers.get('Retry-After', '').strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+def assign_owner(session, limit, url, token, id, owner, owner_type, attempts=5):
+    '''
+        Assign supplied owner name to asset ID under given owner_type, retrying with
+        backoff when the console responds with HTTP 429.
         
+        :param session: A requests.Session, pooled session shared by all workers.
+        :param limit: An AdaptiveLimit, shared concurrency limit.
         :param url: A string, URL of runZero console.
         :param token: A string, Organization API Key.
         :param id: A string, UUID of asset.
         :param owner: A string, name of asset owner.
         :param owner_type: A string, UUID of ownership type.
-        :returns: a dict, JSON object of assets.
-        :raises: ConnectionError: if unable to successfully make PATCH request to console.
+        :param attempts: An integer, number of attempts before giving up on the asset.
+        :returns: a dict, result ledger entry for the asset; request errors are recorded with status 'error'.
     '''
     
     url = f"{url}/api/v1.0/org/assets/{id}/owners"
     payload = json.dumps({"ownerships": [{"ownership_type_id": owner_type, "owner": owner}]})
     headers = {'Content-Type': 'application/json',
                'Authorization': f'Bearer {token}'}
+    entry = {'id': id, 'owner': owner}
+    for attempt in range(attempts):
+        limit.acquire()
+        throttled = False
+        try:
+            response = session.patch(url, headers=headers, data=payload)
+            throttled = response.status_code == 429
+        except RequestException as error:
+            #timeouts and other request failures are recorded like any failed assignment so the run carries on
+            entry.update({'status': 'error', 'code': None, 'message': str(error)})
+            return entry
+        finally:
+            limit.release(throttled)
+        if throttled:
+            time.sleep(retry_after(response, 2 ** attempt))
+            continue
+        if response.ok:
+            entry.update({'status': 'assigned', 'code': response.status_code})
+        else:
+            entry.update({'status': 'failed', 'code': response.status_code, 'message': response.text[:200]})
+        return entry
+    entry.update({'status': 'throttled', 'code': 429})
+    return entry
+
+def bulk_assign(url, token, owners, owner_type, ledger, workers=8):
+    '''
+        Assign owners to assets through a bounded worker pool. Every result is appended
+        to the ledger as it completes, and assets already assigned in the ledger are
+        skipped so an interrupted run can be resumed.
+
+        :param url: A string, URL of runZero console.
+        :param token: A string, Organization API Key.
+        :param owners: An iterable, tuples of asset ID and owner name.
+        :param owner_type: A string, UUID of ownership type.
+        :param ledger: A string, path to the JSONL result ledger.
+        :param workers: An integer, maximum number of concurrent PATCH requests.
+        :returns: a dict, count of ledger entries by status for this run.
+        :raises: IOError: if unable to write to the ledger.
+    '''
+
+    done = read_ledger(ledger)
+    limit = AdaptiveLimit(workers)
+    #urllib3 must not retry 429 itself, or the adaptive limit would never see the console throttling and
+    #never back off; it also retries any 429 or 503 carrying Retry-After unless respect_retry_after_header is off
+    session = requests.Session()
+    retry = Retry(total=3,
+                  backoff_factor=0.5,
+                  status_forcelist=(500, 502, 504),
+                  allowed_methods=frozenset(['PATCH']),
+                  respect_retry_after_header=False,
+                  raise_on_status=False)
+    session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry))
+    summary = {'skipped': 0}
+    pending = set()
+
+    def record(futures):
+        for future in futures:
+            entry = future.result()
+            log.write(json.dumps(entry) + '\n')
+            log.flush()
+            summary[entry['status']] = summary.get(entry['status'], 0) + 1
+
     try:
-        response = requests.patch(url, headers=headers, data=payload)
-        if not response.ok:
-            print('Unable to add owner' + str(response))
-            exit()
-        content = response.json()
-        return content
-    except ConnectionError as error:
-        content = "No Response"
+        with open(ledger, 'a') as log, ThreadPoolExecutor(max_workers=workers) as executor:
+            for id, owner in owners:
+                if id in done:
+                    summary['skipped'] += 1
+                    continue
+                #keep the queue of submitted assets bounded
+                if len(pending) >= workers * 4:
+                    completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    record(completed)
+                pending.add(executor.submit(assign_owner, session, limit, url, token, id, owner, owner_type))
+            record(as_completed(pending))
+    except IOError as error:
         raise error
+    finally:
+        session.close()
+    return summary
 
 if __name__ == "__main__":
     args = parseArgs()
@@ -144,7 +302,8 @@ if __name__ == "__main__":
     query = "source:sentinelone or source:crowdstrike or source:googleworkspace"
     #fields to return in API call
     fields = "id, foreign_attributes"
-    assets = get_assets(args.consoleURL, token, query, fields)
+    assets = stream_assets(args.consoleURL, token, query, fields)
     results = get_users(assets)
-    assignment = parse_owners(args.consoleURL, token, results, args.type)
-    print(assignment)
\ No newline at end of file
+    owners = parse_owners(results)
+    summary = bulk_assign(args.consoleURL, token, owners, args.type, args.ledger, args.workers)
+    print(summary)
\ No newline at end of file
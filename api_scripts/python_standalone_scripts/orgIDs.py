@@ -9,7 +9,17 @@ import pandas as pd
 import requests
 from datetime import datetime, timezone
 from getpass import getpass
+from itertools import chain, islice
 from requests.exceptions import ConnectionError
+
+#openpyxl is only needed for excel output
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+#Excel's maximum number of rows per worksheet, including the header row
+EXCEL_MAX_ROWS = 1048576
     
 def parseArgs():
     parser = argparse.ArgumentParser(description="Retrieve all Organization IDs and 'friendly' names for a given account.")
@@ -102,6 +112,63 @@ def outputFormat(format, fileName, data):
         for line in data:
             print(json.dumps(line, indent=4))
     
+#excelValue and writeXLSX are copies of excel_value and write_xlsx in python_modular_scripts/runzero_calls/output.py,
+#as standalone scripts do not import runzero_calls; change them together
+def excelValue(value):
+    '''
+        Convert a value to something openpyxl can write to a cell.
+
+        :param value: anything, a row value.
+        :returns: 'NA' for None, the value itself for strings, numbers and booleans, otherwise its string form.
+    '''
+
+    if value is None:
+        return 'NA'
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def writeXLSX(fileName, data, fields=None, sample=1000, max_rows=EXCEL_MAX_ROWS):
+    '''
+        Write rows to an xlsx workbook in write-only mode, so rows are streamed to disk and memory
+        stays flat however large the report is. When a sheet reaches max_rows a new sheet is started;
+        every sheet repeats the header row and freezes it. The first column numbers the rows from 0,
+        like the index column pandas wrote. Columns are given by fields or, if omitted, by the keys of
+        every row of a list or the first sample rows of any other iterable, in first seen order.
+
+        :param fileName: a string, name for file including file extension.
+        :param data: an iterable of dicts, file contents.
+        :param fields: a list, column names (optional).
+        :param sample: an integer, number of leading rows used to determine the columns.
+        :param max_rows: an integer, maximum rows per sheet including the header row.
+        :raises: ImportError: if openpyxl is not installed.
+        :raises: IOError: if unable to write to file.
+    '''
+
+    if Workbook is None:
+        raise ImportError('excel output requires openpyxl (pip install openpyxl)')
+    rows = iter(data)
+    head = list(islice(rows, sample))
+    if fields is None:
+        #a list is already in memory, so every row is read; for any other iterable keys first seen after the sample are not written
+        fields = list(dict.fromkeys(key for row in (data if isinstance(data, list) else head) for key in row))
+    workbook = Workbook(write_only=True)
+    sheet = None
+    written = 0
+    for index, row in enumerate(chain(head, rows)):
+        if sheet is None or written >= max_rows:
+            sheet = workbook.create_sheet(f'Sheet{len(workbook.worksheets) + 1}')
+            sheet.freeze_panes = 'A2'
+            sheet.append([None] + fields)
+            written = 1
+        sheet.append([index] + [excelValue(row.get(field)) for field in fields])
+        written += 1
+    if sheet is None:
+        sheet = workbook.create_sheet('Sheet1')
+        sheet.freeze_panes = 'A2'
+        sheet.append([None] + fields)
+    workbook.save(fileName)
+
 def writeDF(format, fileName, data):
     '''
         Write contents to output file. 
@@ -112,14 +179,13 @@ def writeDF(format, fileName, data):
         :raises: IOError: if unable to write to file.
     '''
     
-    df = pd.DataFrame(data)
     try:
         if format == "excel":
-            df.to_excel(f'{fileName}.xlsx', freeze_panes=(1,0), na_rep='NA')
+            writeXLSX(f'{fileName}.xlsx', data)
         elif format == 'csv':
-            df.to_csv(f'{fileName}.csv', na_rep='NA')
+            pd.DataFrame(data).to_csv(f'{fileName}.csv', na_rep='NA')
         else:
-            df.to_html(f'{fileName}.html', render_links=True, na_rep='NA')
+            pd.DataFrame(data).to_html(f'{fileName}.html', render_links=True, na_rep='NA')
     except IOError as error:
         raise error
 
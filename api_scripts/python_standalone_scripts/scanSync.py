@@ -1,16 +1,21 @@
 """ EXAMPLE PYTHON SCRIPT! NOT INTENDED FOR PRODUCTION USE! 
-    scanSync.py, version 2.5
+    scanSync.py, version 2.7
     This script is designed to sync task data from one console to another by downloading the last 'n' successful tasks
     from one console and uploading them to another. Example use case, download external scan tasks from a SaaS console
     and import them into a self-hosted instance. The script will attempt to automatically delete local files it creates."""
 
 import argparse
 import json
+import hashlib
 import os
-import re
+import queue
 import requests
-import subprocess
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError
     
 def parseArgs():
@@ -31,15 +36,31 @@ def parseArgs():
                         required=False, default=os.environ["RUNZERO_SITE_ID"])
     parser.add_argument('-p', '--path', help='Path to save scan data to. This argument will override the .env file', 
                         required=False, default=os.environ["SAVE_PATH"])
-    parser.add_argument('--version', action='version', version='%(prog)s 2.5')
-    return parser.parse_args()
+    parser.add_argument('--pipeline', action='store_true', help='Download and upload concurrently through a bounded queue of scan files')
+    parser.add_argument('--stream', action='store_true', help='Relay task data straight from the source to the destination without temporary files (implies --pipeline)')
+    parser.add_argument('--download-workers', dest='downloadWorkers', help='Number of concurrent downloads (or relays with --stream) in pipeline mode', 
+                        type=int, required=False, default=4)
+    parser.add_argument('--upload-workers', dest='uploadWorkers', help='Number of concurrent uploads in pipeline mode', type=int, required=False, default=2)
+    parser.add_argument('--queue-size', dest='queueSize', help='Maximum number of scan files on disk (downloading, waiting or uploading) in pipeline mode', 
+                        type=int, required=False, default=8)
+    parser.add_argument('--ledger', help='Path to the SQLite ledger of synced tasks; tasks recorded there are not synced again', 
+                        required=False, default='scanSync_ledger.db')
+    parser.add_argument('--since', help='Only query source tasks created after this point e.g. 1week, 2024-06-01', required=False)
+    parser.add_argument('--version', action='version', version='%(prog)s 2.7')
+    args = parser.parse_args()
+    #relaying is a pipeline mode
+    if args.stream:
+        args.pipeline = True
+    return args
     
-def get_tasks(url, token, search): 
+def get_tasks(url, token, search, since=None): 
     '''
         Retrieve Tasks from Organization corresponding to supplied token.
 
         :param url: A string, URL of the runZero console.
         :param token: A string, Account API Key.
+        :param search: A string, task type to retrieve.
+        :param since: A string, optional watermark; only tasks created after it are returned (e.g. 1week, 2024-06-01).
         :returns: A JSON object, runZero task data.
         :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
@@ -47,6 +68,8 @@ def get_tasks(url, token, search):
     url = f"{url}/api/v1.0/org/tasks"
     payload = {'search':f'type:{search}',
                'status':'processed'}
+    if since:
+        payload['search'] += f' and created_at:>{since}'
     headers = {'Accept': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
@@ -59,23 +82,25 @@ def get_tasks(url, token, search):
     except ConnectionError as error:
         raise error
 
-def parse_ids(data, taskNo=1000):
+def parse_ids(data, taskNo=1000, synced=()):
     '''
-        Extract task IDs from supplied task data. 
+        Extract task IDs from supplied task data, skipping tasks already synced. 
     
         :param data: JSON object, runZero task data.
         :param taskNo: an Integer, number of tasks to process.
+        :param synced: A set, UUIDs of tasks already synced to the destination.
         :returns: A List, list of task IDs.
         :raises: TypeError: if data variable passed is not JSON format.
     '''
     
     try:
-        taskIDs = [item.get('id') for counter, item in enumerate(data) if counter <= taskNo - 1]
+        unsynced = [item.get('id') for item in data if item.get('id') not in synced]
+        taskIDs = unsynced[:taskNo]
         return taskIDs
     except TypeError as error:
         raise error
 
-def get_data(url, token, taskID, path):
+def get_data(url, token, taskID, path, session=requests, chunk_size=1048576):
     '''
         Download and write scan data (.json.gz) for each task ID provided.
 
@@ -83,29 +108,36 @@ def get_data(url, token, taskID, path):
         :param token: A string, Organization API key.
         :param taskID: A string, UUID of scan task to download.
         :param path: A string, path to write files to.
-        :returns: None, this function returns no data but writes files to disk.
+        :param session: A requests.Session, optional pooled session to send the request through.
+        :param chunk_size: An integer, number of bytes to read and write at a time.
+        :returns: A tuple, number of bytes written and SHA-256 of the data, or None if the task could not be downloaded.
         :raises: ConnectionError: if unable to successfully make GET request to console.
         :raises: IOError: if unable to write file.
     '''
 
     url = f"{url}/api/v1.0/org/tasks/{taskID}/data"
-    payload = ""
     headers = {'Accept': 'application/json',
+               'Accept-Encoding': 'identity',
                'Authorization': f'Bearer {token}'}
     try:
-        response = requests.get(url, headers=headers, data=payload, stream=True)
-        if not response.ok:
-            print('Unable to retrieve task data' + str(response))
-            exit()
-        with open( f'{path}scan_{taskID}.json.gz', 'wb') as f:
-            for chunk in response.iter_content(chunk_size=128):
-                f.write(chunk)
+        with session.get(url, headers=headers, stream=True) as response:
+            if not response.ok:
+                print('Unable to retrieve task data' + str(response))
+                return None
+            written = 0
+            digest = hashlib.sha256()
+            with open( f'{path}scan_{taskID}.json.gz', 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+        return written, digest.hexdigest()
     except ConnectionError as error:
         raise error
     except IOError as error:
         raise error
         
-def upload_data(url, token, site_id, path, taskData):
+def upload_data(url, token, site_id, path, taskData, session=requests):
     '''
         Upload task Data to console.
 
@@ -114,6 +146,8 @@ def upload_data(url, token, site_id, path, taskData):
         :param site_id: A string, UUID of site to upload scan to.
         :param path: A string, directory path to scan data file.
         :param taskData: A string, filename of the scan data (json.gz) file.
+        :param session: A requests.Session, optional pooled session to send the request through.
+        :returns: A dict, JSON response from the console, or None if the upload failed.
         :raises: ConnectionError: if unable to successfully make PUT request to console.
     '''
     
@@ -125,15 +159,64 @@ def upload_data(url, token, site_id, path, taskData):
                'Authorization': f'Bearer {token}'}
     try:
         with open(path + taskData, 'rb') as file:
-            response = requests.put(url, headers=headers, params=params, data=file, stream=True)
+            response = session.put(url, headers=headers, params=params, data=file, stream=True)
             if not response.ok:
                 print('Unable to upload task data' + str(response))
-                exit()
+                return None
             content = response.json()
         return content
     except ConnectionError as error:
         content = "No Response"
         raise error
+
+def stream_data(src_url, src_token, dst_url, dst_token, site_id, taskID, session=requests, chunk_size=1048576):
+    '''
+        Stream task data from the source console straight into an import on the 
+        destination console without writing a temporary file.
+
+        :param src_url: A string, URL of the source runZero console.
+        :param src_token: A string, source Organization API key.
+        :param dst_url: A string, URL of the destination runZero console.
+        :param dst_token: A string, destination Organization API key.
+        :param site_id: A string, UUID of site to upload scan to.
+        :param taskID: A string, UUID of scan task to sync.
+        :param session: A requests.Session, optional pooled session to send the requests through.
+        :param chunk_size: An integer, number of bytes to relay at a time.
+        :returns: A tuple, number of bytes relayed and SHA-256 of the data, or None if the task could not be synced.
+        :raises: ConnectionError: if unable to successfully make requests to either console.
+    '''
+
+    src = f"{src_url}/api/v1.0/org/tasks/{taskID}/data"
+    src_headers = {'Accept': 'application/json',
+                   'Accept-Encoding': 'identity',
+                   'Authorization': f'Bearer {src_token}'}
+    dst = f"{dst_url}/api/v1.0/org/sites/{site_id}/import"
+    params = {'name': f"scan_{taskID}.json.gz",
+              'description': ""}
+    dst_headers = {'Content-Type': 'application/octet-stream',
+                   'Content-Encoding': 'gzip',
+                   'Authorization': f'Bearer {dst_token}'}
+    relayed = [0]
+    digest = hashlib.sha256()
+
+    def body(response):
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            relayed[0] += len(chunk)
+            digest.update(chunk)
+            yield chunk
+
+    try:
+        with session.get(src, headers=src_headers, stream=True) as response:
+            if not response.ok:
+                print('Unable to retrieve task data' + str(response))
+                return None
+            upload = session.put(dst, headers=dst_headers, params=params, data=body(response))
+            if not upload.ok:
+                print('Unable to upload task data' + str(upload))
+                return None
+        return relayed[0], digest.hexdigest()
+    except ConnectionError as error:
+        raise error
         
 def clean_up(taskID, path):
     '''
@@ -145,17 +228,167 @@ def clean_up(taskID, path):
         :raises: IOerror, if unable to delete file.
     '''
 
-    handle = f"scan_{taskID}.json.gz"
+    handle = f"{path}scan_{taskID}.json.gz"
     try:
-        dir_contents = subprocess.check_output(['ls', path]).splitlines()
-        for item in dir_contents:
-            fileName = re.match("b'((scan_.*)\.(json\.gz))", str(item))
-            if fileName is not None and fileName.group(1) == handle:
-                    os.remove(path + handle)
-            else:
-                pass
+        if os.path.exists(handle):
+            os.remove(handle)
     except IOError as error:
         raise error
+
+class SyncLedger:
+    '''
+        SQLite record of source tasks already synced to the destination, with the size 
+        and SHA-256 of the data transferred for each.
+
+        :param filename: A string, path to the SQLite database file.
+    '''
+
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS synced (
+                               task_id TEXT PRIMARY KEY,
+                               size INTEGER,
+                               sha256 TEXT,
+                               synced_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+        self.db.commit()
+
+    def synced_ids(self):
+        with self.lock:
+            return {row[0] for row in self.db.execute('SELECT task_id FROM synced')}
+
+    def record(self, task_id, size, checksum):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO synced (task_id, size, sha256) VALUES (?, ?, ?)', (task_id, size, checksum))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+class StageStats:
+    '''
+        Byte and wall clock totals for one stage of the pipelined sync.
+
+        :param name: A string, name of the stage for reporting.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes = 0
+        self.tasks = 0
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def add(self, nbytes, started, finished):
+        with self.lock:
+            self.bytes += nbytes
+            self.tasks += 1
+            self.started = started if self.started is None else min(self.started, started)
+            self.finished = finished if self.finished is None else max(self.finished, finished)
+
+    def report(self):
+        elapsed = (self.finished - self.started) if self.tasks else 0
+        rate = self.bytes / 1048576 / elapsed if elapsed else 0
+        print(f'{self.name}: {self.tasks} tasks, {self.bytes / 1048576:.1f} MB in {elapsed:.1f}s, {rate:.1f} MB/s')
+
+def pipeline_sync(args, srcTok, dstTok, idList, ledger):
+    '''
+        Sync tasks with a pool of downloaders feeding a pool of uploaders. A downloader
+        reserves one of queue_size slots before it starts and the slot is only freed once
+        the file is uploaded and removed, so at most queue_size scan files sit on disk and
+        downloads pause while uploads catch up. With args.stream each worker relays the
+        source response straight into the destination import instead.
+
+        :param args: A Namespace, parsed command line arguments.
+        :param srcTok: A string, source Organization API key.
+        :param dstTok: A string, destination Organization API key.
+        :param idList: A list, UUIDs of tasks to sync.
+        :param ledger: A SyncLedger, store that successfully synced tasks are recorded in.
+        :returns: A list, StageStats for each stage that ran.
+    '''
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=args.downloadWorkers + args.uploadWorkers)
+    session.mount(args.srcURL, adapter)
+    session.mount(args.dstURL, adapter)
+    if args.stream:
+        relay = StageStats('relay')
+
+        def relay_task(id):
+            started = time.perf_counter()
+            try:
+                relayed = stream_data(args.srcURL, srcTok, args.dstURL, dstTok, args.site, id, session)
+            except OSError as error:
+                print(error)
+                return
+            if relayed is not None:
+                relay.add(relayed[0], started, time.perf_counter())
+                ledger.record(id, *relayed)
+
+        with ThreadPoolExecutor(max_workers=args.downloadWorkers) as executor:
+            list(executor.map(relay_task, idList))
+        session.close()
+        return [relay]
+    download = StageStats('download')
+    upload = StageStats('upload')
+    todo = queue.Queue()
+    for id in idList:
+        todo.put(id)
+    ready = queue.Queue()
+    slots = threading.BoundedSemaphore(max(1, args.queueSize))
+    done = object()
+
+    def producer():
+        while True:
+            try:
+                id = todo.get_nowait()
+            except queue.Empty:
+                return
+            #reserve room on disk before the file is written
+            slots.acquire()
+            started = time.perf_counter()
+            try:
+                written = get_data(args.srcURL, srcTok, id, args.path, session)
+            except OSError as error:
+                print(error)
+                written = None
+            if written is None:
+                clean_up(id, args.path)
+                slots.release()
+                continue
+            download.add(written[0], started, time.perf_counter())
+            ready.put((id, *written))
+
+    def consumer():
+        while True:
+            item = ready.get()
+            if item is done:
+                return
+            id, size, checksum = item
+            started = time.perf_counter()
+            try:
+                if upload_data(args.dstURL, dstTok, args.site, args.path, f"scan_{id}.json.gz", session) is not None:
+                    upload.add(size, started, time.perf_counter())
+                    ledger.record(id, size, checksum)
+            except OSError as error:
+                print(error)
+            finally:
+                clean_up(id, args.path)
+                slots.release()
+
+    producers = [threading.Thread(target=producer) for _ in range(args.downloadWorkers)]
+    consumers = [threading.Thread(target=consumer) for _ in range(args.uploadWorkers)]
+    for thread in producers + consumers:
+        thread.start()
+    for thread in producers:
+        thread.join()
+    for _ in consumers:
+        ready.put(done)
+    for thread in consumers:
+        thread.join()
+    session.close()
+    return [download, upload]
     
 if __name__ == "__main__":
     args = parseArgs()
@@ -165,12 +398,24 @@ if __name__ == "__main__":
     dstTok = args.dstTok
     if dstTok == None:
         dstTok = getpass(prompt="Enter the Organization API Key for the destination console: ")
-    taskInfo = get_tasks(args.srcURL, srcTok, args.search)
-    idList = parse_ids(taskInfo, args.taskNo)
-    for id in idList:
-        get_data(args.srcURL, srcTok, id, args.path)
-        try:
-            upload_data(args.dstURL, dstTok, args.site, args.path, f"scan_{id}.json.gz")
-            clean_up(id, args.path)
-        except OSError as error:
-            print(error)
\ No newline at end of file
+    taskInfo = get_tasks(args.srcURL, srcTok, args.search, args.since)
+    ledger = SyncLedger(args.ledger)
+    idList = parse_ids(taskInfo, args.taskNo, ledger.synced_ids())
+    print(f'{len(idList)} new tasks to sync.')
+    if args.pipeline:
+        for stage in pipeline_sync(args, srcTok, dstTok, idList, ledger):
+            stage.report()
+    else:
+        for id in idList:
+            written = get_data(args.srcURL, srcTok, id, args.path)
+            if written is None:
+                continue
+            try:
+                if upload_data(args.dstURL, dstTok, args.site, args.path, f"scan_{id}.json.gz") is not None:
+                    ledger.record(id, *written)
+            except OSError as error:
+                print(error)
+            finally:
+                #remove the downloaded file even if the upload fails, as the pipeline consumer does
+                clean_up(id, args.path)
+    ledger.close()
\ No newline at end of file
@@ -11,9 +11,19 @@ import os
 import pandas as pd
 import requests
 from datetime import datetime, timezone
-from flatten_json import flatten
 from getpass import getpass
+from itertools import chain, islice
 from requests.exceptions import ConnectionError
+from attribute_paths import AttributePaths
+
+#openpyxl is only needed for excel output
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+#Excel's maximum number of rows per worksheet, including the header row
+EXCEL_MAX_ROWS = 1048576
 
 logger = logging.getLogger(__name__)
     
@@ -31,37 +41,47 @@ def parseArgs():
     parser.add_argument('--version', action='version', version='%(prog)s 4.0')
     return parser.parse_args()
     
-def get_assets(url, token, filter='', fields=''):
+def stream_assets(url, token, filter='', fields='', chunk_size=65536):
     '''
-        Retrieve assets using supplied query filter from Console and restrict to fields supplied.
+        Stream assets using supplied query filter from Console and restrict to fields supplied.
+        Assets are read from the JSONL export and yielded one at a time, so memory use stays
+        flat regardless of Organization size.
         
         :param url: A string, URL of runZero console.
         :param token: A string, Export API Key.
         :param filter: A string, query to filter returned assets(" " returns all).
         :param fields: A string, comma separated string of fields to return(" " returns all).
-        :returns: a dict, JSON object of assets.
+        :param chunk_size: An integer, number of bytes to read from the socket at a time.
+        :yields: a dict, JSON object of a single asset.
         :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
 
-    url = f"{url}/api/v1.0/export/org/assets.json"
+    url = f"{url}/api/v1.0/export/org/assets.jsonl"
     params = {'search': filter,
               'fields': fields}
     payload = ''
     headers = {'Accept': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
-        logger.info(f"Making GET request to {url}")
-        response = requests.get(url, headers=headers, params=params, data=payload)
-        if not response.ok:
-            logger.critical('Unable to retrieve assets' + str(response), 'exiting...')
-            exit()
-        logger.info("Received response.")
-        content = response.json()
-        return content
+        logger.info(f"Making streaming GET request to {url}")
+        with requests.get(url, headers=headers, params=params, data=payload, stream=True) as response:
+            if not response.ok:
+                logger.critical(f'Unable to retrieve assets {response}, exiting...')
+                exit()
+            logger.info("Receiving response.")
+            for line in response.iter_lines(chunk_size=chunk_size):
+                if line:
+                    yield json.loads(line)
+        logger.info("Response stream complete.")
     except ConnectionError:
         logger.exception('Could not establish connection to console URL, exiting...')
         exit()
     
+#Serial number attributes to report; output field name mapped to attribute path
+SN_PATHS = AttributePaths({'hw.serialNumber': 'attributes_hw.serialNumber',
+                           'snmp.serialNumbers': 'attributes_snmp.serialNumbers',
+                           'ilo.serialNumber': 'attributes_ilo.serialNumber'})
+
 def parse_sns(data):
     '''
         Search assets "attributes" and extract SNs, discard the rest.
@@ -79,14 +99,10 @@ def parse_sns(data):
                 if not isinstance(value, dict):
                     asset[key] = item.get(key)
 
-            root_keys_to_ignore = []
-            for key, value in item.items():
-                if not isinstance(value, dict):
-                    root_keys_to_ignore.append(key)
-                flattened_items = flatten(nested_dict=item, root_keys_to_ignore=root_keys_to_ignore)
-                asset['hw.serialNumber'] = flattened_items.get('attributes_hw.serialNumber', '')
-                asset['snmp.serialNumbers'] = flattened_items.get('attributes_snmp.serialNumbers', '').split('\t')
-                asset['ilo.serialNumber'] = flattened_items.get('attributes_ilo.serialNumber', '').split('\t')
+            serials = SN_PATHS.extract(item)
+            asset['hw.serialNumber'] = serials['hw.serialNumber']
+            asset['snmp.serialNumbers'] = serials['snmp.serialNumbers'].split('\t')
+            asset['ilo.serialNumber'] = serials['ilo.serialNumber'].split('\t')
             asset_list.append(asset)
         logger.info("Response data parsed")
         return(asset_list)
@@ -124,6 +140,63 @@ def output_format(format, filename, data):
         for line in data:
             print(json.dumps(line, indent=4))
 
+#excel_value and write_xlsx are copies of excel_value and write_xlsx in python_modular_scripts/runzero_calls/output.py,
+#as standalone scripts do not import runzero_calls; change them together
+def excel_value(value):
+    '''
+        Convert a value to something openpyxl can write to a cell.
+
+        :param value: anything, a row value.
+        :returns: 'NA' for None, the value itself for strings, numbers and booleans, otherwise its string form.
+    '''
+
+    if value is None:
+        return 'NA'
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def write_xlsx(filename, data, fields=None, sample=1000, max_rows=EXCEL_MAX_ROWS):
+    '''
+        Write rows to an xlsx workbook in write-only mode, so rows are streamed to disk and memory
+        stays flat however large the report is. When a sheet reaches max_rows a new sheet is started;
+        every sheet repeats the header row and freezes it. The first column numbers the rows from 0,
+        like the index column pandas wrote. Columns are given by fields or, if omitted, by the keys of
+        every row of a list or the first sample rows of any other iterable, in first seen order.
+
+        :param filename: a string, name for file including file extension.
+        :param data: an iterable of dicts, file contents.
+        :param fields: a list, column names (optional).
+        :param sample: an integer, number of leading rows used to determine the columns.
+        :param max_rows: an integer, maximum rows per sheet including the header row.
+        :raises: ImportError: if openpyxl is not installed.
+        :raises: IOError: if unable to write to file.
+    '''
+
+    if Workbook is None:
+        raise ImportError('excel output requires openpyxl (pip install openpyxl)')
+    rows = iter(data)
+    head = list(islice(rows, sample))
+    if fields is None:
+        #a list is already in memory, so every row is read; for any other iterable keys first seen after the sample are not written
+        fields = list(dict.fromkeys(key for row in (data if isinstance(data, list) else head) for key in row))
+    workbook = Workbook(write_only=True)
+    sheet = None
+    written = 0
+    for index, row in enumerate(chain(head, rows)):
+        if sheet is None or written >= max_rows:
+            sheet = workbook.create_sheet(f'Sheet{len(workbook.worksheets) + 1}')
+            sheet.freeze_panes = 'A2'
+            sheet.append([None] + fields)
+            written = 1
+        sheet.append([index] + [excel_value(row.get(field)) for field in fields])
+        written += 1
+    if sheet is None:
+        sheet = workbook.create_sheet('Sheet1')
+        sheet.freeze_panes = 'A2'
+        sheet.append([None] + fields)
+    workbook.save(filename)
+
 def write_df(format, filename, data):
     '''
         Write contents to output file. 
@@ -134,15 +207,14 @@ def write_df(format, filename, data):
         :raises: IOError: if unable to write to file.
     '''
     
-    df = pd.DataFrame(data)
     try:
         logger.info(f"Writing {filename} in {format} to disk.")
         if format == "excel":
-            df.to_excel(f'{filename}.xlsx', freeze_panes=(1,0), na_rep='NA')
+            write_xlsx(f'{filename}.xlsx', data)
         elif format == 'csv':
-            df.to_csv(f'{filename}.csv', na_rep='NA')
+            pd.DataFrame(data).to_csv(f'{filename}.csv', na_rep='NA')
         else:
-            df.to_html(f'{filename}.html', render_links=True, na_rep='NA')
+            pd.DataFrame(data).to_html(f'{filename}.html', render_links=True, na_rep='NA')
         logger.info(f"output file written to {filename} in {format}")
     except IOError:
         logger.exception("Could not write output file, exiting...")
@@ -180,7 +252,7 @@ def main():
     query = "protocol:snmp or has:snmp.serialNumbers or hw.serialNumber:'%' or ilo.serialNumber:'%'"
     #fields to return in API call; modify for more or less
     fields = "id, hw, macs, attributes"
-    assets = get_assets(args.consoleURL, token, query, fields)
+    assets = stream_assets(args.consoleURL, token, query, fields)
     results = parse_sns(assets)
     output_format(args.output, filename, results)
     logger.info('Finished')
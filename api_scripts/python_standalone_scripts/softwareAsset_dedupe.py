@@ -1,5 +1,5 @@
 """ EXAMPLE PYTHON SCRIPT! NOT INTENDED FOR PRODUCTION USE! 
-    softwareAsset_dedupe.py, version 2.2
+    softwareAsset_dedupe.py, version 2.3
     This script is created with the intention of deduplicating assets by UUID after running a query
     in the software portion of the runZero asset inventory. Specifically, this script is intended 
     assist when a user wants to find all assets that do NOT have a specific application installed.
@@ -11,15 +11,32 @@
     query and deduplicate assets by UUID to provide a list solely of the assets in question. """
 
 import argparse
+import heapq
 import json
 import re
+import tempfile
     
 def parseArgs():
     parser = argparse.ArgumentParser(description="Deduplicate assets from runZero software inventory JSONl export.")
     parser.add_argument('-f', '--file', metavar='<path>filename', dest='fileName', help='jsonl file exported from console, including absolute path', required=True)
-    parser.add_argument('--version', action='version', version='%(prog)s 2.2')
+    parser.add_argument('-s', '--stream', help='Read the export line by line and write deduplicated assets incrementally as JSONL.', 
+                        action='store_true', required=False)
+    parser.add_argument('-x', '--external-sort', dest='external', help='Deduplicate exports larger than memory with an on-disk external sort; writes JSONL sorted by asset ID.', 
+                        action='store_true', required=False)
+    parser.add_argument('--chunk', help='Number of lines per sorted run for --external-sort.', type=int, required=False, default=100000)
+    parser.add_argument('--version', action='version', version='%(prog)s 2.3')
     return parser.parse_args()
 
+def strip_software(record):
+    '''
+        Remove software fields from a software inventory record, leaving the asset fields.
+
+        :param record: A dict, a single line of the software inventory export.
+        :returns: A dict, asset fields of the record.
+    '''
+
+    return {key: value for key, value in record.items() if 'software' not in key}
+
 def parse_file(inputFile):
     '''
         Read input file, parse contents and return list of JSON formatted
@@ -32,19 +49,12 @@ def parse_file(inputFile):
 
     try:
         assetList = []
+        seen = set()
         with open (inputFile, 'r') as input:
-            content = input.readlines()
-            for line in content:
-                line = json.loads(line)
-                asset = {}
-                for key, value in line.items():
-                    if 'software' not in key:
-                        asset[key] = line.get(key)
-                count = 0
-                for item in assetList:
-                    if asset["id"] == item["id"]:
-                        count += 1
-                if count == 0: 
+            for line in input:
+                asset = strip_software(json.loads(line))
+                if asset["id"] not in seen:
+                    seen.add(asset["id"])
                     assetList.append(asset)        
         return assetList
     except FileNotFoundError as error:
@@ -52,6 +62,101 @@ def parse_file(inputFile):
     except json.JSONDecodeError as error:
         raise error
 
+def stream_dedupe(inputFile, outputFile):
+    '''
+        Read input file line by line and write each asset the first time its ID is seen
+        to the output file as JSONL. Only the set of seen IDs is held in memory.
+
+        :param inputFile: JSONl formatted file.
+        :param outputFile: A string, name of the JSONL file to write.
+        :returns: An integer, number of unique assets written.
+        :raises: FileNotFoundError: if provided filename not found.
+        :raises: JSONDecodeError: if content is not JSON formatted.
+        :raises: IOError: if unable to write to file.
+    '''
+
+    seen = set()
+    try:
+        with open(inputFile, 'r') as input, open(outputFile, 'w') as output:
+            for line in input:
+                if not line.strip():
+                    continue
+                asset = strip_software(json.loads(line))
+                if asset["id"] not in seen:
+                    seen.add(asset["id"])
+                    output.write(json.dumps(asset) + '\n')
+        return len(seen)
+    except FileNotFoundError as error:
+        raise error
+    except json.JSONDecodeError as error:
+        raise error
+    except IOError as error:
+        raise error
+
+def external_dedupe(inputFile, outputFile, chunkLines=100000, tempDir=None):
+    '''
+        Deduplicate exports larger than memory with an on-disk external sort. The input
+        is split into sorted runs of chunkLines assets keyed by ID, the runs are merged
+        and the first asset for each ID is written to the output file as JSONL, in ID order.
+
+        :param inputFile: JSONl formatted file.
+        :param outputFile: A string, name of the JSONL file to write.
+        :param chunkLines: An integer, number of lines held in memory per sorted run.
+        :param tempDir: A string, directory for temporary run files (system default if None).
+        :returns: An integer, number of unique assets written.
+        :raises: FileNotFoundError: if provided filename not found.
+        :raises: JSONDecodeError: if content is not JSON formatted.
+        :raises: IOError: if unable to write to file.
+    '''
+
+    def write_run(chunk):
+        #Sort is stable, so the first occurrence of an ID stays first within a run
+        chunk.sort(key=lambda entry: entry[0])
+        run = tempfile.TemporaryFile('w+', dir=tempDir)
+        for asset_id, asset in chunk:
+            run.write(f'{asset_id}\t{asset}\n')
+        run.seek(0)
+        return run
+
+    def read_run(index, run):
+        for line in run:
+            asset_id, asset = line.rstrip('\n').split('\t', 1)
+            yield asset_id, index, asset
+
+    runs = []
+    try:
+        with open(inputFile, 'r') as input:
+            chunk = []
+            for line in input:
+                if not line.strip():
+                    continue
+                asset = strip_software(json.loads(line))
+                chunk.append((asset["id"], json.dumps(asset)))
+                if len(chunk) >= chunkLines:
+                    runs.append(write_run(chunk))
+                    chunk = []
+            if chunk:
+                runs.append(write_run(chunk))
+        written = 0
+        last_id = None
+        with open(outputFile, 'w') as output:
+            #Ties on ID are broken by run number, so the earliest occurrence wins
+            for asset_id, _, asset in heapq.merge(*(read_run(index, run) for index, run in enumerate(runs))):
+                if asset_id != last_id:
+                    output.write(asset + '\n')
+                    written += 1
+                    last_id = asset_id
+        return written
+    except FileNotFoundError as error:
+        raise error
+    except json.JSONDecodeError as error:
+        raise error
+    except IOError as error:
+        raise error
+    finally:
+        for run in runs:
+            run.close()
+
 def write_file(fileName, contents):
     '''
         Write contents to output file. 
@@ -70,6 +175,11 @@ def write_file(fileName, contents):
 if __name__ == "__main__":
     args = parseArgs()
     delFileExt = re.match("[^.]*", args.fileName)
-    outputName = f"{delFileExt[0]}_deduped.json"
-    parsed = parse_file(args.fileName)
-    write_file(outputName, json.dumps(parsed))
\ No newline at end of file
+    if args.external:
+        external_dedupe(args.fileName, f"{delFileExt[0]}_deduped.jsonl", args.chunk)
+    elif args.stream:
+        stream_dedupe(args.fileName, f"{delFileExt[0]}_deduped.jsonl")
+    else:
+        outputName = f"{delFileExt[0]}_deduped.json"
+        parsed = parse_file(args.fileName)
+        write_file(outputName, json.dumps(parsed))
\ No newline at end of file
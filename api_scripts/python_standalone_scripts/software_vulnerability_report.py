@@ -1,5 +1,5 @@
 """ EXAMPLE PYTHON SCRIPT! NOT INTENDED FOR PRODUCTION USE! 
-    software_vulnerability_report.py, version 1.0
+    software_vulnerability_report.py, version 1.1
     Generates a CSV report of software impacted by vulnerabilities sorted by production envrionment as defined by an "Environment=" tag."""
 
 import argparse
@@ -20,110 +20,128 @@ def parseArgs():
     parser.add_argument('-p', '--path', help='Path to write file. This argument will override the .env file', 
                         required=False, default=os.environ["SAVE_PATH"])
     parser.add_argument('-o', '--output', dest='output', help='output file format', choices=['txt', 'json', 'csv', 'excel', 'html'], required=False)
-    parser.add_argument('--version', action='version', version='%(prog)s 1.0')
+    parser.add_argument('--version', action='version', version='%(prog)s 1.1')
     return parser.parse_args()
 
-def get_assets(url, token, filter=" ", fields="id,tags"):
+def stream_export(url, token, export, filter=" ", fields=" "):
     '''
-        Retrieve assets using supplied query filter from console and restrict to fields supplied.
+        Stream records from a JSONL export endpoint one at a time using supplied query filter
+        and restrict to fields supplied.
         
         :param url: A string, URL of runZero console.
         :param token: A string, Export API Key.
-        :param filter: A string, query to filter returned assets(" " returns all).
+        :param export: A string, export to read ( assets | software | vulnerabilities ).
+        :param filter: A string, query to filter returned records(" " returns all).
         :param fields: A string, comma separated string of fields to return(" " returns all).
-        :returns: a dict, JSON object of assets.
+        :yields: a dict, JSON object of a single record.
         :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
 
-    url = f"{url}/api/v1.0/export/org/assets.json"
+    url = f"{url}/api/v1.0/export/org/{export}.jsonl"
     params = {'search': filter,
               'fields': fields}
-    payload = ''
     headers = {'Accept': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
-        response = requests.get(url, headers=headers, params=params, data=payload)
-        if response.status_code != 200:
-            print('Unable to retrieve assets' + str(response))
-            exit()
-        content = response.content
-        data = json.loads(content)
-        return data
+        with requests.get(url, headers=headers, params=params, stream=True) as response:
+            if response.status_code != 200:
+                print(f'Unable to retrieve {export}' + str(response))
+                exit()
+            for line in response.iter_lines(chunk_size=65536):
+                if line:
+                    yield json.loads(line)
     except ConnectionError as error:
-        content = "No Response"
         raise error
 
-def get_software(url, token, filter=" ", fields="software_id,software_asset_id,software_vendor,software_product,software_version"):
+def product_key(vendor, product):
     '''
-        Retrieve all software entries in an Organization.
-        
-        :param url: A string, URL of runZero console.
-        :param token: A string, Export API Key.
-        :param filter: A string, query to filter returned software(" " returns all).
-        :param fields: A string, comma separated string of fields to return(" " returns all).
-        :returns: a dict, JSON object of assets.
-        :raises: ConnectionError: if unable to successfully make GET request to console.
+        Normalise a vendor and product name the way CPE names them, so software rows and
+        vulnerability CPEs for the same product compare equal.
+
+        :param vendor: A string, vendor name.
+        :param product: A string, product name.
+        :returns: A tuple, normalised vendor and product.
     '''
 
-    url = f"{url}/api/v1.0/export/org/software.json"
-    headers = {'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            print('Unable to retrieve users' + str(response))
-            exit()
-        content = response.content
-        data = json.loads(content)
-        return data
-    except ConnectionError as error:
-        content = "No Response"
-        raise error
+    return ((vendor or '').strip().lower().replace(' ', '_'), (product or '').strip().lower().replace(' ', '_'))
 
-def get_vulns(url, token, filter=" ", fields=" "):
+def cpe_product_key(cpe23):
     '''
-        Retrieve all vulnerability entries in an Organization.
-        
-        :param url: A string, URL of runZero console.
-        :param token: A string, Export API Key.
-        :param filter: A string, query to filter returned vulnerabilities(" " returns all).
-        :param fields: A string, comma separated string of fields to return(" " returns all).
-        :returns: a dict, JSON object of assets.
-        :raises: ConnectionError: if unable to successfully make GET request to console.
+        Take the vendor and product from a CPE 2.3 name (cpe:2.3:part:vendor:product:...).
+
+        :param cpe23: A string, CPE 2.3 name.
+        :returns: A tuple, normalised vendor and product, or None if the name has no product.
     '''
 
-    url = f"{url}/api/v1.0/export/org/vulnerabilities.json"
-    headers = {'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            print('Unable to retrieve users' + str(response))
-            exit()
-        content = response.content
-        data = json.loads(content)
-        return data
-    except ConnectionError as error:
-        content = "No Response"
-        raise error
+    cpe = (cpe23 or '').split(':')
+    if len(cpe) < 5 or cpe[3] in ('', '*', '-') or cpe[4] in ('', '*', '-'):
+        return None
+    return product_key(cpe[3], cpe[4])
+
+def index_assets(assets):
+    '''
+        Index the network environment ("net" tag) of each asset by asset ID.
+
+        :param assets: An iterable, runZero asset records with id and tags.
+        :returns: A dict, environment keyed by asset ID.
+    '''
+
+    return {asset.get('id'): (asset.get('tags') or {}).get('net', '') for asset in assets}
+
+def index_vulns(vulns):
+    '''
+        Count vulnerabilities per asset and product, taking the product from each
+        vulnerability's CPE 2.3 name.
+
+        :param vulns: An iterable, runZero vulnerability records with id and vulnerability_cpe23.
+        :returns: A dict, vulnerability count keyed by (asset ID, vendor, product).
+    '''
+
+    counts = {}
+    for vuln in vulns:
+        product = cpe_product_key(vuln.get('vulnerability_cpe23'))
+        if product is None:
+            continue
+        key = (vuln.get('id'),) + product
+        counts[key] = counts.get(key, 0) + 1
+    return counts
     
-def gen_report(assets, software, vulns):
+def gen_report(environments, vuln_counts, software):
     '''
+        Join streamed software records to the asset environment and vulnerability indexes
+        and roll them up by vendor, product, version and environment. Vulnerabilities are
+        matched on the software's own CPE, as display names ("Microsoft Corporation") rarely
+        equal CPE vendors ("microsoft"); names are only used for software without a CPE.
+
+        :param environments: A dict, environment keyed by asset ID (see index_assets).
+        :param vuln_counts: A dict, vulnerability count keyed by (asset ID, vendor, product) (see index_vulns).
+        :param software: An iterable, runZero software records.
+        :returns: A list, report rows sorted by environment, vendor, product and version.
     '''
-    report_fields = []
+
+    rows = {}
     for app in software:
-        id = app.get('software_id')
         asset_id = app.get('software_asset_id')
         vendor = app.get('software_vendor')
         product = app.get('software_product')
         version = app.get('software_version')
-        net_env = next(asset.get('tags', {}).get('net', '') for asset in assets if asset_id == asset.get('id'))
-        report_fields.append({'vendor': vendor,
-                              'product': product,
-                              'version': version,
-                              'envrionment': net_env}
-                             )
-    return report_fields
+        net_env = environments.get(asset_id, '')
+        product_cpe = cpe_product_key(app.get('software_cpe23')) or product_key(vendor, product)
+        vulnerabilities = vuln_counts.get((asset_id,) + product_cpe, 0)
+        row = rows.get((vendor, product, version, net_env))
+        if row is None:
+            row = rows[(vendor, product, version, net_env)] = {'vendor': vendor,
+                                                                'product': product,
+                                                                'version': version,
+                                                                'envrionment': net_env,
+                                                                'assets': 0,
+                                                                'vulnerable_assets': 0,
+                                                                'vulnerabilities': 0}
+        row['assets'] += 1
+        if vulnerabilities:
+            row['vulnerable_assets'] += 1
+            row['vulnerabilities'] += vulnerabilities
+    return [rows[key] for key in sorted(rows, key=lambda key: tuple(str(part or '') for part in (key[3], key[0], key[1], key[2])))]
 
 def output_format(format, file_name, data):
     '''
@@ -192,10 +210,11 @@ if __name__ == "__main__":
     token = args.token
     if token == None:
         token = getpass(prompt="Enter your Export API Key: ")
-    assets = get_assets(args.consoleURL, token)
-    software = get_software(args.consoleURL, token)
-    vulns = get_vulns(args.consoleURL, token)
-    report = gen_report(assets, software, vulns)
+    #Index assets and vulnerabilities once, then stream software through the indexes
+    environments = index_assets(stream_export(args.consoleURL, token, 'assets', fields='id,tags'))
+    vuln_counts = index_vulns(stream_export(args.consoleURL, token, 'vulnerabilities', fields='id,vulnerability_cpe23'))
+    software = stream_export(args.consoleURL, token, 'software', fields='software_asset_id,software_vendor,software_product,software_version,software_cpe23')
+    report = gen_report(environments, vuln_counts, software)
     if args.output is not None:
         timestamp = str(datetime.now(timezone.utc).strftime('%y-%m-%d%Z_%H-%M-%S'))
         file_name = f'{args.path}software_vuln_report{timestamp}'
@@ -1,18 +1,22 @@
 """ EXAMPLE PYTHON SCRIPT! NOT INTENDED FOR PRODUCTION USE! 
-    taskSearch.py, version 0.9.2
+    taskSearch.py, version 0.9.4
     This script, when provided one or more IPs as an argument or in a file, will return the first and last tasks that discovered an asset,
     with relevant attributes, as well as any other task with a scope that could potentially discover the asset. Optionally the script can
     search task data of possible discovery tasks to determine if a task ever discoverd the IP and IPs can be automatically applied as exclusions
     to recurring tasks."""
 
 import argparse
-import gzip
 import json
 import os
 import re
 import requests
-import subprocess
+import sqlite3
+import threading
+import time
+import zlib
 import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
 from getpass import getpass
 from requests.exceptions import ConnectionError
@@ -24,7 +28,11 @@ def parseArgs():
                         required=False)
     parser.add_argument('-iL', '--input-list', dest='targetFile', help='Text file with scan targets. This argument will take priority over the .env file', 
                         required=False, default=os.environ["TARGETS"])
-    parser.add_argument('-d', '--deep-search', dest='deep', help='With this option enabled the task data for possible matches is temporarily downloaded and searched for the IP address.', 
+    parser.add_argument('-d', '--deep-search', dest='deep', help='With this option enabled the task data for possible matches is downloaded once and indexed to search for the IP address.', 
+                        action='store_true', required=False)
+    parser.add_argument('--index', help='Path to the scan archive index used by deep search. Defaults to taskSearch_index.db under the save path.', 
+                        required=False)
+    parser.add_argument('--keep-archives', dest='keep', help='Keep downloaded scan archives under the save path after indexing them.', 
                         action='store_true', required=False)
     parser.add_argument('-e', '--exclude', dest='exclude', help='add IP(s) as an exclusion to recurring tasks; limited excludes from first and last seen tasks, extended adds possible tasks.', 
                         choices=['limited','extended'], required=False, default='')
@@ -32,10 +40,14 @@ def parseArgs():
                         required=False, default=os.environ["RUNZERO_BASE_URL"])
     parser.add_argument('-k', '--key', dest='token', help='Prompt for Organization API key (do not enter at command line). This argument will take priority over the .env file', 
                         nargs='?', const=None, required=False, default=os.environ["RUNZERO_ORG_TOKEN"])
-    parser.add_argument('-p', '--path', help='Path to write temporary scan file downloads. This argument will take priority over the .env file', 
+    parser.add_argument('-p', '--path', help='Path to write scan file downloads and the deep search index. This argument will take priority over the .env file', 
                         required=False, default=os.environ["SAVE_PATH"])
+    parser.add_argument('-w', '--workers', help='Number of targets to build report entries for concurrently.', 
+                        type=int, required=False, default=8)
+    parser.add_argument('--cache-ttl', dest='cacheTTL', help='Seconds a fetched task stays cached while building the report.', 
+                        type=int, required=False, default=600)
     parser.add_argument('-o', '--output', dest='output', help='output file format', choices=['txt', 'json', 'csv', 'excel', 'html'], required=False)
-    parser.add_argument('--version', action='version', version='%(prog)s 0.9.2')
+    parser.add_argument('--version', action='version', version='%(prog)s 0.9.4')
     return parser.parse_args()
 
 def assign_task_query(address):
@@ -130,77 +142,99 @@ def get_task(url, token, taskID):
     except ConnectionError as error:
         raise error
     
-def write_task_data(url, token, taskID, path):
+class ScanArchiveIndex:
     '''
-        Download and write scan data (.json.gz) for each task ID provided.
+        Persistent SQLite index of which IP addresses appear in which task's scan data.
+        Each task archive is downloaded and indexed once, decompressing it as it streams
+        in, so later deep searches for any address are index lookups.
 
-           :param url: A string, URL of the runZero console.
-           :param token: A string, Organization API key.
-           :param taskID: A string, ID of scan task to download.
-           :param path: A string, path to write files to.
-           :returns: None, this function returns no data but writes files to disk.
-           :raises: ConnectionError: if unable to successfully make GET request to console.
-           :raises: IOError: if unable to write file.
-    '''
-    
-    url = f"{url}/api/v1.0/org/tasks/{taskID}/data"
-    payload = ""
-    headers = {'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
-    try:
-        response = requests.get(url, headers=headers, data=payload, stream=True)
-        if not response.ok:
-            print('Unable to retrieve task data' + str(response))
-            exit()
-        with open( f"{path}scan_{taskID}.json.gz", 'wb') as f:
-            for chunk in response.iter_content(chunk_size=128):
-                f.write(chunk)
-        return
-    except ConnectionError as error:
-        raise error
-    except IOError as error:
-        raise error
-    
-def search_task_data(address, taskID, path):
-    '''
-        Search task data for any matches to address. 
-    
-        :param address: A string, IP address to search for.
-        :param taskID: A String, UUID of task to identify scan file to search.
-        :param path: A String, path to scan archive location.
+        :param filename: A string, path to the SQLite database file.
+        :param path: A string, directory to keep downloaded scan archives in, or None to discard them once indexed.
     '''
 
-    with gzip.open( f'{path}scan_{taskID}.json.gz', 'rt') as f:
-        content = f.read()
-        pattern = f'"{address}"'
-        instances = re.findall( pattern, content)
-        if len(instances) > 0:
-            return True
-        else:
-            return
+    #quoted IPv4 addresses, matching what the previous full text search looked for
+    ADDRESS = re.compile(rb'"((?:\d{1,3}\.){3}\d{1,3})"')
 
-def delete_task_data(taskID, path):
-    '''
-        Remove task data files created by writeTaskData funtion.
+    def __init__(self, filename, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.task_locks = {}
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS indexed_tasks (task_id TEXT PRIMARY KEY, indexed_at TEXT DEFAULT CURRENT_TIMESTAMP)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS task_ips (ip TEXT, task_id TEXT, PRIMARY KEY (ip, task_id)) WITHOUT ROWID')
+        self.db.commit()
 
-        :param taskID: A String, UUID of task to identify scan file to delete.
-        :param path: A String, path used in getData to create scan files.
-        :returns None: this function returns nothing but removes files from disk.
-        :raises: IOerror, if unable to delete file.
-    '''
+    def is_indexed(self, taskID):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM indexed_tasks WHERE task_id = ?', (taskID,)).fetchone() is not None
 
-    handle = f"scan_{taskID}.json.gz"
-    try:
-        dir_contents = subprocess.check_output(['ls', path]).splitlines()
-        for item in dir_contents:
-            archiveName = re.match("b'((scan_.*)\.(json\.gz))", str(item))
-            if archiveName is not None and archiveName.group(1) == handle:
-                    os.remove(path + handle)
-            else:
-                pass
-        return
-    except IOError as error:
-        raise error
+    def has_seen(self, address, taskID):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM task_ips WHERE ip = ? AND task_id = ?', (address, taskID)).fetchone() is not None
+
+    def index_task(self, url, token, taskID):
+        '''
+            Download a task's scan data once and record every address it contains.
+
+            :param url: A string, URL of the runZero console.
+            :param token: A string, Organization API key.
+            :param taskID: A string, UUID of the task to index.
+            :raises: ConnectionError: if unable to successfully make GET request to console.
+            :raises: IOError: if unable to write the archive to disk.
+        '''
+
+        #one download per task even when several targets need it at once
+        with self.lock:
+            task_lock = self.task_locks.setdefault(taskID, threading.Lock())
+        with task_lock:
+            if not self.is_indexed(taskID):
+                self.download_and_index(url, token, taskID)
+
+    def download_and_index(self, url, token, taskID):
+        url = f"{url}/api/v1.0/org/tasks/{taskID}/data"
+        headers = {'Accept': 'application/json',
+                   'Accept-Encoding': 'identity',
+                   'Authorization': f'Bearer {token}'}
+        addresses = set()
+        decompressor = zlib.decompressobj(wbits=31)
+        remainder = b''
+        archive = None
+        try:
+            with requests.get(url, headers=headers, stream=True) as response:
+                if not response.ok:
+                    print('Unable to retrieve task data' + str(response))
+                    exit()
+                if self.path is not None:
+                    archive = open(f"{self.path}scan_{taskID}.json.gz", 'wb')
+                for chunk in response.iter_content(chunk_size=1048576):
+                    if archive:
+                        archive.write(chunk)
+                    data = decompressor.decompress(chunk)
+                    #archives may hold several gzip members back to back
+                    while decompressor.unused_data:
+                        leftover = decompressor.unused_data
+                        decompressor = zlib.decompressobj(wbits=31)
+                        data += decompressor.decompress(leftover)
+                    lines = (remainder + data).split(b'\n')
+                    remainder = lines.pop()
+                    for line in lines:
+                        addresses.update(self.ADDRESS.findall(line))
+                addresses.update(self.ADDRESS.findall(remainder + decompressor.flush()))
+        except ConnectionError as error:
+            raise error
+        except IOError as error:
+            raise error
+        finally:
+            if archive:
+                archive.close()
+        with self.lock:
+            self.db.executemany('INSERT OR IGNORE INTO task_ips (ip, task_id) VALUES (?, ?)', 
+                                ((address.decode(), taskID) for address in addresses))
+            self.db.execute('INSERT OR REPLACE INTO indexed_tasks (task_id) VALUES (?)', (taskID,))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
     
 def auto_exclude(url, token, address, taskID):
     '''
@@ -254,13 +288,76 @@ def get_possible_tasks(url, token, query):
     except ConnectionError as error:
         raise error
     
-def build_report_entry(url, token, address, deepDiscovery, path, exclusion):
+class TaskCache:
+    '''
+        Request-scoped cache of console lookups shared by every target in a report run.
+        Entries expire after ttl seconds and the least recently used entry is evicted
+        once maxsize is reached. Concurrent requests for the same key wait on a single
+        fetch instead of each calling the console.
+
+        :param ttl: An integer, seconds an entry stays valid.
+        :param maxsize: An integer, maximum number of entries held.
+    '''
+
+    def __init__(self, ttl=600, maxsize=2048):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, fetch):
+        '''
+            Return the cached value for key, calling fetch to populate it when missing or expired.
+
+            :param key: A hashable, cache key.
+            :param fetch: A callable, returns the value for key.
+            :returns: the cached or freshly fetched value.
+        '''
+
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached and cached[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            pending = self.inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self.inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not owner:
+            return pending.result()
+        try:
+            value = fetch()
+        except BaseException as error:
+            pending.set_exception(error)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        pending.set_result(value)
+        return value
+    
+def build_report_entry(url, token, address, archiveIndex, exclusion, cache):
     '''
         Build a report of the assets and related tasks data based on IP address.
      
         :param url: A string, URL of the runZero console.
         :param token: A string, Organization API key.
         :param address: A string, IP address of asset.
+        :param archiveIndex: A ScanArchiveIndex, index of task scan data for deep search, or None to skip it.
+        :param exclusion: A string, limited | extended | empty to skip exclusions.
+        :param cache: A TaskCache, task lookups shared across all targets.
         :returns: A dict, asset and task attributes.
     '''
     
@@ -270,7 +367,7 @@ def build_report_entry(url, token, address, deepDiscovery, path, exclusion):
         entry[key] = value
     #First task discovery information
     if discovered['first_task_id'] != "NA":
-        firstTaskParams = get_task(url, token, discovered['first_task_id'])
+        firstTaskParams = cache.get(('task', discovered['first_task_id']), lambda: get_task(url, token, discovered['first_task_id']))
         entry['first_discovered_task_id'] = firstTaskParams['id']
         entry['first_discovered_task_url'] = f'{url}/tasks/search/completed?task={firstTaskParams["id"]}'
         entry['first_discovered_task_organization_id'] = firstTaskParams['organization_id']
@@ -288,7 +385,7 @@ def build_report_entry(url, token, address, deepDiscovery, path, exclusion):
             entry['first_discovery_excluded'] = 'not attempted'
     #Last task discovery information
     if discovered['last_task_id'] != "NA":
-        lastTaskParams = get_task(url, token, discovered['last_task_id'])
+        lastTaskParams = cache.get(('task', discovered['last_task_id']), lambda: get_task(url, token, discovered['last_task_id']))
         entry['last_discovered_task_id'] = lastTaskParams['id']
         entry['last_discovered_task_url'] = f'{url}/tasks/search/completed?task={lastTaskParams["id"]}'
         entry['last_discovered_task_organization_id'] = lastTaskParams['organization_id']
@@ -308,7 +405,8 @@ def build_report_entry(url, token, address, deepDiscovery, path, exclusion):
     if not query:
         exit()
     #Return all tasks whose scope could enumerate the target
-    possibleDiscoveryTasks = get_possible_tasks(url, token, query)
+    #one lookup per RFC1918 block, shared by every target in it
+    possibleDiscoveryTasks = cache.get(('possible', query), lambda: get_possible_tasks(url, token, query))
     possibleList = []
     for task in possibleDiscoveryTasks:
         #Condition to exclude first and last discovery task details from appearing in possible matches
@@ -324,11 +422,9 @@ def build_report_entry(url, token, address, deepDiscovery, path, exclusion):
             possible['task_site_name'] = task['site_name']
             possible['task_type'] = task['type']
             possible['recurring'] = task['recur']
-            if deepDiscovery:
-                write_task_data(url, token, task['id'], path)
-                instances = search_task_data(address, task['id'], path)
-                delete_task_data(task['id'], path)
-                if instances:
+            if archiveIndex:
+                archiveIndex.index_task(url, token, task['id'])
+                if archiveIndex.has_seen(address, task['id']):
                     possible['task_has_seen_ip'] = 'True'
                 else:
                     possible['task_has_seen_ip'] = 'False'
@@ -412,8 +508,13 @@ if __name__ == "__main__":
         token = getpass(prompt="Enter your Organization API Key: ")
     targets = target_list(args)
     #Asset query to report last task discovery
-    report = []
-    for address in targets:
-        entry = build_report_entry(args.consoleURL, token, address, args.deep, args.path, args.exclude)
-        report.append(entry)
+    archiveIndex = None
+    if args.deep:
+        archiveIndex = ScanArchiveIndex(args.index or f'{args.path}taskSearch_index.db', args.path if args.keep else None)
+    cache = TaskCache(args.cacheTTL)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        report = list(executor.map(lambda address: build_report_entry(args.consoleURL, token, address, archiveIndex, args.exclude, cache), targets))
+    print(f'Task cache: {cache.hits} hits, {cache.misses} console lookups.')
+    if archiveIndex:
+        archiveIndex.close()
     output_format(args.output, fileName, report)
\ No newline at end of file
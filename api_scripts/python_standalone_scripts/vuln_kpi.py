@@ -1,5 +1,5 @@
 """ EXAMPLE PYTHON SCRIPT! NOT INTENDED FOR PRODUCTION USE! 
-    vuln_kpi.py, version 3.3
+    vuln_kpi.py, version 3.5
     Proof of concept to illustrate use of runZero API to generate KPI reports. This script focuses on generating a report for 
     a provided time period that reports all assets discovered within the specified time as well as assets with vulnerabilies 
     discovered within the same time period. Report states what percentage of vulnerable assets are compared to the total asset 
@@ -10,6 +10,7 @@ import csv
 import json
 import os
 import requests
+import sqlite3
 from datetime import datetime, timezone
 from getpass import getpass
 from requests.exceptions import ConnectionError
@@ -25,12 +26,20 @@ def parseArgs():
     parser.add_argument('-p', '--path', help='Path to write file. This argument will override the .env file', 
                         required=False, default=os.environ["SAVE_PATH"])
     parser.add_argument('-o', '--output', dest='output', help='output file format', choices=['txt', 'json', 'csv'], required=False)
-    parser.add_argument('--version', action='version', version='%(prog)s 3.3')
+    parser.add_argument('-w', '--weights', help='Comma separated severity=weight table used for the weighted compliance metric.', 
+                        required=False, default='critical=3,high=2,medium=1')
+    parser.add_argument('-s', '--store', help='Path to the SQLite KPI history each run is appended to. Defaults to vuln_kpi_history.db under the save path.', 
+                        required=False)
+    parser.add_argument('-t', '--trend', help='Report trend, delta and moving average figures for this many of the most recent runs.', 
+                        type=int, required=False, default=0)
+    parser.add_argument('--window', help='Number of runs in the compliance moving average.', type=int, required=False, default=7)
+    parser.add_argument('--version', action='version', version='%(prog)s 3.5')
     return parser.parse_args()
 
-def get_assets(url, token, filter):
+def count_assets(url, token, filter):
     '''
-        Retrieve assets using supplied query filter from Console and tally the number of assets found.
+        Stream assets using supplied query filter from Console, returning only the asset ID,
+        and tally the number of assets found.
         
         :param url: A string, URI of runZero console.
         :param token: A string, Organization API Key.
@@ -39,142 +48,231 @@ def get_assets(url, token, filter):
         :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
 
-    url = f"{url}/api/v1.0/org/assets"
-    params = {'search': filter}
-    payload = ''
+    url = f"{url}/api/v1.0/export/org/assets.jsonl"
+    params = {'search': filter,
+              'fields': 'id'}
     headers = {'Accept': 'application/json',
                'Authorization': f'Bearer {token}'}
     try:
-        response = requests.get(url, headers=headers, params=params, data=payload)
-        if not response.ok:
-            print('Unable to retrieve assets' + str(response))
-            exit()
-        content = response.json()
-        #Returning length of asset list is equivalent to the number of assets matching the query
-        return len(content)
+        with requests.get(url, headers=headers, params=params, stream=True) as response:
+            if not response.ok:
+                print('Unable to retrieve assets' + str(response))
+                exit()
+            #Each non-empty line of the export is one asset matching the query
+            return sum(1 for line in response.iter_lines(chunk_size=65536) if line)
     except ConnectionError as error:
-        content = "No Response"
         raise error
 
-def get_vulns(url, token, filter):
+def count_vulns(url, token, filter, severities):
     '''
-        Retrieve vulnerabilities using supplied query filter from Console, deduplicate asset
-        entries, and tally unique asset count.
+        Stream vulnerabilities using supplied query filter from Console and tally the number of 
+        unique assets affected at each severity in a single pass.
         
            :param url: A string, URI of runZero console.
            :param token: A string, Organization API Key.
            :param filter: A string, query to filter returned vulnerabilities.
-           :returns: A JSON object, runZero vulnerability data.
+           :param severities: An iterable, severities (lower case) to tally.
+           :returns: A dict, number of unique assets per severity.
            :raises: ConnectionError: if unable to successfully make GET request to console.
-           :raises: TypeError: if dataset is not iterable.
            :raises: KeyError: if dictionary key does not exist.
     '''
 
-    url = f"{url}/api/v1.0/export/org/vulnerabilities.json"
-    params = {'search': filter}
-    payload = ""
+    url = f"{url}/api/v1.0/export/org/vulnerabilities.jsonl"
+    params = {'search': filter,
+              'fields': 'id, vulnerability_severity'}
     headers = {'Accept': 'application/json',
                'Authorization': f'Bearer {token}'}
+    assets = {severity: set() for severity in severities}
     try:
-        response = requests.get(url, headers=headers, params=params, data=payload)
-        if not response.ok:
-            print('Unable to retrieve vulnerabilities' + str(response))
-            exit()
-        content = response.json()
+        with requests.get(url, headers=headers, params=params, stream=True) as response:
+            if not response.ok:
+                print('Unable to retrieve vulnerabilities' + str(response))
+                exit()
+            for line in response.iter_lines(chunk_size=65536):
+                if not line:
+                    continue
+                item = json.loads(line)
+                severity = str(item.get('vulnerability_severity', '')).lower()
+                if severity in assets:
+                    assets[severity].add(item['id'])
     except ConnectionError as error:
-        content = "No Response"
-        raise error
-    #Take JSON data returned and deduplicate by unique asset ID
-    try:
-        asset_list = []
-        for item in content:
-            if item['id'] not in asset_list:
-                asset_list.append(item["id"])
-        #Length of deduplicated asset list is equivalent to unique assets that match the query
-        return len(asset_list)
-    except TypeError as error:
         raise error
     except KeyError as error:
         raise error
+    #Size of each set of asset IDs is the number of unique assets with that severity
+    return {severity: len(ids) for severity, ids in assets.items()}
+
+def parse_weights(weights):
+    '''
+        Parse the severity weight table.
+
+        :param weights: A string, comma separated severity=weight pairs e.g. critical=3,high=2,medium=1.
+        :returns: A dict, weight for each severity (lower case), in the order supplied.
+        :raises: ValueError: if a weight is not a number.
+    '''
+
+    table = {}
+    for pair in weights.split(','):
+        severity, weight = pair.split('=')
+        table[severity.strip().lower()] = float(weight)
+    return table
     
-def metrics(asset_counts):
+def metrics(total_title, total_assets, severity_counts, weights, time_range):
     '''
         Calculate criticality weighting and KPIs for asset report.
         
-        :param report: a dict object, report generated by this script.
-        :raises: KeyError: if dictionary key does not exist.
+        :param total_title: A string, title of the total asset count metric.
+        :param total_assets: An integer, number of assets discovered within the time range.
+        :param severity_counts: A dict, number of unique vulnerable assets per severity.
+        :param weights: A dict, weight applied to each severity.
+        :param time_range: A string, time range the report covers.
+        :returns: A list, report entries.
         :raises: ZeroDivisionError: if initial discovery query returns zero assets.
     '''
 
-    report = []
+    report = [{total_title: str(total_assets)}]
     try:
-        total_assets = 0
         weighted_comply = 0
         normal_average = 0
-        for metric, count in asset_counts.items():
-            if 'Discovered' in metric:
-                total_assets = count
-                report.append({metric: str(count)})
-            elif 'Critical' in metric:
-                percent_of_total = count / total_assets * 100
-                weighted_priority = count * 3 / total_assets * 100
-                compliance = 100 - percent_of_total
-                normal_average += count
-                weighted_comply += count * 3
-                report.append({metric: count,
-                              'percent_of_total': round(percent_of_total, 2),
-                              'percent_in_compliance': round(compliance, 2),
-                              'weight': '3',
-                              'weighted_total': round(weighted_priority, 2)})
-            elif 'High' in metric:
-                percent_of_total = count / total_assets * 100
-                weighted_priority = count * 2 / total_assets * 100
-                compliance = 100 - percent_of_total
-                normal_average += count
-                weighted_comply += count * 2
-                report.append({metric: count,
-                              'percent_of_total': round(percent_of_total, 2),
-                              'percent_in_compliance': round(compliance, 2),
-                              'weight': '2',
-                              'weighted_total': round(weighted_priority, 2)})
-            elif 'Medium' in metric:
-                percent_of_total = count / total_assets * 100
-                weighted_priority = percent_of_total
-                compliance = 100 - percent_of_total
-                normal_average += count
-                weighted_comply += count
-                report.append({metric: count,
-                              'percent_of_total': round(percent_of_total, 2),
-                              'percent_in_compliance': round(compliance, 2),
-                              'weight': '1',
-                              'weighted_total': round(weighted_priority, 2)})
-            else:
-                pass
+        for severity, weight in weights.items():
+            count = severity_counts.get(severity, 0)
+            percent_of_total = count / total_assets * 100
+            weighted_priority = count * weight / total_assets * 100
+            compliance = 100 - percent_of_total
+            normal_average += count
+            weighted_comply += count * weight
+            report.append({severity_title(severity, time_range): count,
+                          'percent_of_total': round(percent_of_total, 2),
+                          'percent_in_compliance': round(compliance, 2),
+                          'weight': f'{weight:g}',
+                          'weighted_total': round(weighted_priority, 2)})
         report.append({'Total Compliance KPI': str(round(100 - (weighted_comply / total_assets * 100), 2))})
         report.append({'vs normal average of all figures': str(round(100 - (normal_average / total_assets * 100), 2))})
         return report
-    except KeyError as error:
-        raise error
     except ZeroDivisionError as error:
+        report = [{total_title: str(total_assets)}]
         report.append({'Info':'Zero assets were discovered that match the initial query; nothing to process'})
         return report
+
+def severity_title(severity, time_range):
+    '''
+        Reported KPI metric title for a severity.
+
+        :param severity: A string, vulnerability severity.
+        :param time_range: A string, time range the report covers.
+        :returns: A string, metric title.
+    '''
+
+    return f'Systems within the Last {time_range} with {severity.capitalize()} Vulnerabilities'
+    
+class KPIStore:
+    '''
+        SQLite history of KPI report snapshots. Each snapshot also stores the running sum
+        of the compliance KPI, so moving averages and deltas over any window are computed
+        from the rows at either end of the window instead of re-reading the whole history.
+
+        :param filename: A string, path to the SQLite database file.
+    '''
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS snapshots (
+                               seq INTEGER PRIMARY KEY,
+                               taken_at TEXT,
+                               time_range TEXT,
+                               total_assets INTEGER,
+                               compliance_kpi REAL,
+                               normal_average REAL,
+                               compliance_sum REAL)''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS severity_counts (
+                               seq INTEGER,
+                               severity TEXT,
+                               count INTEGER,
+                               PRIMARY KEY (seq, severity)) WITHOUT ROWID''')
+        self.db.commit()
+
+    def append(self, taken_at, time_range, total_assets, severity_counts, compliance_kpi, normal_average):
+        '''
+            Record the results of a run.
+
+            :param taken_at: A string, UTC timestamp of the run.
+            :param time_range: A string, time range the report covers.
+            :param total_assets: An integer, number of assets discovered within the time range.
+            :param severity_counts: A dict, number of unique vulnerable assets per severity.
+            :param compliance_kpi: A float, Total Compliance KPI.
+            :param normal_average: A float, unweighted compliance figure.
+            :returns: An integer, sequence number of the new snapshot.
+        '''
+
+        last = self.db.execute('SELECT seq, compliance_sum FROM snapshots ORDER BY seq DESC LIMIT 1').fetchone()
+        seq, compliance_sum = (last[0] + 1, last[1] + compliance_kpi) if last else (1, compliance_kpi)
+        self.db.execute('INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?)', 
+                        (seq, taken_at, time_range, total_assets, compliance_kpi, normal_average, compliance_sum))
+        self.db.executemany('INSERT INTO severity_counts VALUES (?, ?, ?)', 
+                            ((seq, severity, count) for severity, count in severity_counts.items()))
+        self.db.commit()
+        return seq
+
+    def trend(self, limit=30, window=7):
+        '''
+            Build a trend report of the most recent snapshots.
+
+            :param limit: An integer, number of most recent snapshots to report.
+            :param window: An integer, number of snapshots in the compliance moving average.
+            :returns: A list, one dict per snapshot, oldest first, with deltas from the previous snapshot.
+        '''
+
+        last = self.db.execute('SELECT MAX(seq) FROM snapshots').fetchone()[0]
+        if last is None:
+            return []
+        #Only the reported rows plus one window of earlier rows are ever read
+        first = max(1, last - limit - window + 1)
+        rows = self.db.execute('''SELECT seq, taken_at, total_assets, compliance_kpi, normal_average, compliance_sum 
+                                  FROM snapshots WHERE seq >= ? ORDER BY seq''', (first,)).fetchall()
+        counts = {}
+        for seq, severity, count in self.db.execute('SELECT seq, severity, count FROM severity_counts WHERE seq >= ?', (first,)):
+            counts.setdefault(seq, {})[severity] = count
+        sums = {row[0]: row[5] for row in rows}
+        report = []
+        previous = None
+        for seq, taken_at, total_assets, compliance, normal_average, compliance_sum in rows:
+            if seq > last - limit:
+                start = seq - window
+                span = min(window, seq)
+                moving = (compliance_sum - sums.get(start, 0)) / span
+                entry = {'taken_at': taken_at,
+                         'total_assets': total_assets,
+                         'Total Compliance KPI': compliance,
+                         'compliance_delta': round(compliance - previous[3], 2) if previous else None,
+                         f'compliance_moving_average_{window}': round(moving, 2),
+                         'vs normal average of all figures': normal_average}
+                for severity, count in counts.get(seq, {}).items():
+                    entry[severity] = count
+                    if previous:
+                        entry[f'{severity}_delta'] = count - counts.get(previous[0], {}).get(severity, 0)
+                report.append(entry)
+            previous = (seq, taken_at, total_assets, compliance)
+        return report
+
+    def close(self):
+        self.db.close()
     
-def write_csv(file_name, contents, time_range):
+def write_csv(file_name, contents, time_range, weights):
     '''
         Write contents to output file. 
     
         :param filename: a string, name for file including.
         :param contents: json data, file contents.
+        :param time_range: A string, time range the report covers.
+        :param weights: A dict, weight applied to each severity.
         :raises: IOError: if unable to write to file.
     '''
 
     try:
         with open(f'{file_name}', 'w') as o:
-            field_names = [f'Systems Discovered within the Last {time_range}', 
-                          f'Systems within the Last {time_range} with Critical Vulnerabilities',
-                          f'Systems within the Last {time_range} with High Vulnerabilities', 
-                          f'Systems within the Last {time_range} with Medium Vulnerabilities', 
-                          'percent_of_total', 'percent_in_compliance', 'weight', 'weighted_total', 
+            field_names = [f'Systems Discovered within the Last {time_range}']
+            field_names += [severity_title(severity, time_range) for severity in weights]
+            field_names += ['percent_of_total', 'percent_in_compliance', 'weight', 'weighted_total', 
                           'Total Compliance KPI', 'vs normal average of all figures', 'Info']
             csv_writer = csv.DictWriter(o, field_names)
             csv_writer.writeheader()
@@ -209,23 +307,27 @@ def main():
     #Output report name; default uses UTC time
     timestamp = str(datetime.now(timezone.utc).strftime('%y-%m-%d%Z_%H-%M-%S'))
     file_name = f'{args.path}KPI_report_{timestamp}'
-    #KPIs variable is a list of dictionaries for each metric that will be iterated over and used to return total 
-    # number of matching assets. Format is 'title' (Reported KPI metric), 'query' (the query needed to filter the assets 
-    # according to KPI), and 'type' which is either 'asset' or 'vuln' according to the API endpoint that must be queried to obtain
-    #the desired information.
-    KPIs = [{'title': f'Systems Discovered within the Last {args.timeRange}', 'query': f'first_seen:<"{args.timeRange}"', 'type': 'asset'},
-            {'title': f'Systems within the Last {args.timeRange} with Critical Vulnerabilities', 'query': f'severity:critical AND first_detected_at:<"{args.timeRange}"', 'type': 'vuln'},
-            {'title': f'Systems within the Last {args.timeRange} with High Vulnerabilities', 'query': f'severity:high AND first_detected_at:<"{args.timeRange}"', 'type': 'vuln'},
-            {'title': f'Systems within the Last {args.timeRange} with Medium Vulnerabilities', 'query': f'severity:medium AND first_detected_at:<"{args.timeRange}"', 'type': 'vuln'}]
-    asset_counts = {}
-    for item in KPIs:
-        if item['type'] == 'vuln':
-            results = get_vulns(args.consoleURL, token, item['query'])
-        else:
-            results = get_assets(args.consoleURL, token, item['query'])
-        asset_counts[item['title']] = results
+    #Total assets discovered in the time range, and unique vulnerable assets per severity in the weight table.
+    #All severities are tallied from a single vulnerability export.
+    try:
+        weights = parse_weights(args.weights)
+    except ValueError:
+        print('Weights must be supplied as severity=number pairs e.g. critical=3,high=2,medium=1')
+        exit()
+    total_title = f'Systems Discovered within the Last {args.timeRange}'
+    total_assets = count_assets(args.consoleURL, token, f'first_seen:<"{args.timeRange}"')
+    severity_query = ' OR '.join(f'severity:{severity}' for severity in weights)
+    severity_counts = count_vulns(args.consoleURL, token, f'({severity_query}) AND first_detected_at:<"{args.timeRange}"', weights)
     #Generate report from asset counts
-    report = metrics(asset_counts)
+    report = metrics(total_title, total_assets, severity_counts, weights, args.timeRange)
+    #Append this run to the snapshot history and build the trend report from it
+    store = KPIStore(args.store or f'{args.path}vuln_kpi_history.db')
+    summary = {key: value for entry in report for key, value in entry.items()}
+    if 'Total Compliance KPI' in summary:
+        store.append(timestamp, args.timeRange, total_assets, severity_counts, 
+                     float(summary['Total Compliance KPI']), float(summary['vs normal average of all figures']))
+    trend = store.trend(args.trend, args.window) if args.trend else []
+    store.close()
     #Write resulting report to file
     if args.output == 'json':
         file_name = f'{file_name}.json'
@@ -238,11 +340,17 @@ def main():
         text_file = '\n'.join(string_list)
         write_file(file_name, text_file)
     elif args.output == 'csv':
-        fileName = f'{fileName}.csv'
-        write_csv(file_name, report, args.timeRange)  
+        file_name = f'{file_name}.csv'
+        write_csv(file_name, report, args.timeRange, weights)  
     else:
         for line in report:
             print(json.dumps(line, indent=4))
+    if trend:
+        if args.output == 'json':
+            write_file(f'{args.path}KPI_trend_{timestamp}.json', json.dumps(trend))
+        else:
+            for line in trend:
+                print(json.dumps(line, indent=4))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
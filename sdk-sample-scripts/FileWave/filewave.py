@@ -4,12 +4,14 @@
 # Docs: https://kb.filewave.com/books/application-programming-interface-api
 # Prerequisite: pip install runzero-sdk
 
+import argparse
 from datetime import datetime
 from ipaddress import ip_address
 import json
 import os
 import requests
 import runzero
+import time
 from runzero.client import AuthError
 from runzero.api import CustomAssets, Sites
 from runzero.types import (CustomAttribute,ImportAsset,IPv4Address,IPv6Address,NetworkInterface,ImportTask)
@@ -169,46 +171,95 @@ def reformat_response(raw_json):
     '''
     Function to reformat the API response by mapping the fields
     to the corresponding values for each asset in values.
+    Rows are grouped by Client_device_id in a single pass, keeping the row
+    with the most recent check-in and every MAC address reported for the device.
          
     :param raw_json: a dict, FileWave API response
     :returns: a list of dictionaries. 
     '''
     
-    # assign reported fields as keys to all reported value sets
-    mapped_keys = []
     keys = raw_json['fields']
+    # each distinct check-in timestamp is only parsed once
+    parsed_dates = {}
+    # device ID -> [most recent check-in, asset at most recent check-in, set of reported MACs]
+    devices = {}
     for values in raw_json['values']:
-        asset = {}
-        for key in keys:
-            position = keys.index(key)
-            asset[key] = values[position]
-        mapped_keys.append(asset)
-    # create a list of unique asset IDs
-    uniqIDs = set([asset['Client_device_id'] for asset in mapped_keys])
+        asset = dict(zip(keys, values))
+        checkin = asset['Client_last_check_in']
+        checkin_date = parsed_dates.get(checkin)
+        if checkin_date is None:
+            checkin_date = parsed_dates[checkin] = datetime.strptime(checkin, '%Y-%m-%dT%H:%M:%S.%fZ')
+        device = devices.get(asset['Client_device_id'])
+        if device is None:
+            devices[asset['Client_device_id']] = [checkin_date, asset, {asset['NetworkInterface_mac_address']}]
+            continue
+        device[2].add(asset['NetworkInterface_mac_address'])
+        if checkin_date > device[0]:
+            device[0] = checkin_date
+            device[1] = asset
     # formatted json will capture most recent asset info according to most recent check-in date
     # and contain a list of all reported MAC addresses instead of a single value
     formatted_json = []
-    # Use the unique IDs to find all assets with the same ID and create a list of check-in dates
-    # and create a list of reported MACS
-    for assetID in uniqIDs:
-        checkinDates = list(set([asset['Client_last_check_in'] for asset in mapped_keys if assetID == asset['Client_device_id']]))
-        checkinDates.sort(key=lambda date: datetime.strptime(date, '%Y-%m-%dT%H:%M:%S.%fZ'), reverse=True)
-        mostRecent = checkinDates[0]
-        macAddresses = list(set([asset['NetworkInterface_mac_address'] for asset in mapped_keys if assetID == asset['Client_device_id']]))
-        # sort reported timestamps to retrieve most recently reported asset information
-        for asset in mapped_keys:
-            if asset['Client_device_id'] == assetID and asset['Client_last_check_in'] == mostRecent:
-                # replace single value of reported MAC address with list of reported MAC address
-                asset['NetworkInterface_mac_address'] = macAddresses
-                if asset not in formatted_json:
-                    formatted_json.append(asset)
-    # Reformat OS field for MacOS to fit runZero expected format
-    for asset in formatted_json:
+    for checkin_date, asset, macs in devices.values():
+        asset['NetworkInterface_mac_address'] = sorted(macs, key=str)
+        # Reformat OS field for MacOS to fit runZero expected format
         if "macOS" in asset['OperatingSystem_name']:
             asset['OperatingSystem_name'] = 'macOS ' + asset['OperatingSystem_version']
+        formatted_json.append(asset)
     return formatted_json
 
+def synthetic_report(rows):
+    '''
+    Build a synthetic FileWave report for benchmarking. Each device reports two MAC
+    addresses at two check-in times, so every four rows collapse into one asset.
+
+    :param rows: an integer, number of report rows to generate.
+    :returns: a dict, report in the FileWave API response format.
+    '''
+
+    fields = ['Client_device_id', 'Client_device_name', 'Client_last_check_in', 'Client_current_ip_address',
+              'NetworkInterface_mac_address', 'OperatingSystem_name', 'OperatingSystem_version',
+              'Client_device_product_name', 'DesktopClient_device_manufacturer']
+    values = []
+    for row in range(rows):
+        device = row // 4
+        values.append([device,
+                       f'device-{device}',
+                       f'2024-0{1 + row % 2}-{1 + device % 28:02d}T12:00:00.000000Z',
+                       f'10.{device // 65536 % 256}.{device // 256 % 256}.{device % 256}',
+                       f'00:11:22:{device // 65536 % 256:02x}:{device // 256 % 256:02x}:{(device + row // 2 % 2) % 256:02x}',
+                       'macOS Sonoma' if device % 2 else 'Windows 11',
+                       '14.4',
+                       'Model',
+                       'Vendor'])
+    return {'fields': fields, 'values': values}
+
+def benchmark(rows=200000):
+    '''
+    Time reformat_response against a synthetic report and print the results.
+
+    :param rows: an integer, number of report rows to generate.
+    :returns: None
+    '''
+
+    report = synthetic_report(rows)
+    start = time.perf_counter()
+    formatted = reformat_response(report)
+    elapsed = time.perf_counter() - start
+    print(f'reformat_response: {rows} rows -> {len(formatted)} assets in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s)')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="runZero custom integration with FileWave.")
+    parser.add_argument('--benchmark', dest='benchmark', action='store_true', help='Time reformat_response on a synthetic report instead of syncing.')
+    parser.add_argument('--rows', dest='rows', type=int, default=200000, help='Number of synthetic report rows used by --benchmark.')
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    if args.benchmark:
+        benchmark(args.rows)
+        return
+
     with open('filewave_raw.json', 'r') as input:
         asset_json_raw = json.load(input)
 
@@ -9,8 +9,13 @@
 import logging
 import os
 import runzero
+import threading
+import time
 import uuid
-import xmltodict
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from xml.etree import ElementTree
 from ipaddress import ip_address
 from gvm.connections import (SSHConnection, TLSConnection, UnixSocketConnection)
 from gvm.errors import (GvmError, GvmClientError, GvmResponseError, GvmServerError)
@@ -38,95 +43,145 @@ GVM_USERNAME = os.environ['GVM_USERNAME']
 GVM_PASSWORD = os.environ['GVM_PASSWORD']
 GVM_SOCKET_PATH = os.environ['GVM_SOCKET_PATH']
 GVM_CONN_METHOD = os.environ['GVM_CONN_METHOD']
+# Report results are fetched in pages of GVM_PAGE_SIZE over GVM_WORKERS parallel connections
+GVM_PAGE_SIZE = int(os.environ.get('GVM_PAGE_SIZE', 1000))
+GVM_WORKERS = int(os.environ.get('GVM_WORKERS', 4))
 
 host_os_mapping = {'Linux Kernel': 'Linux'}
 
-def build_assets_from_json(hosts, vulns):
+class PhaseTimer:
+    '''
+    Accumulate wall clock time spent in each phase of the sync (fetch, parse, correlate, build, upload)
+    and report the totals to the log. Time spent by parallel workers is summed.
+    '''
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.totals[name] += time.perf_counter() - start
+
+    def report(self):
+        for name, elapsed in self.totals.items():
+            logger.info(f"Phase {name} took {elapsed:.2f}s.")
+        logger.info(f"All phases took {sum(self.totals.values()):.2f}s.")
+
+def group_vulns(vulns):
+    '''
+    Group vulnerabilities by asset ID and, for results without an asset ID, by host IP in a single pass.
+
+    :param vulns: a list, (asset ID, IP, Vulnerability) records from GVM reports.
+    :returns: a tuple, dicts of Vulnerability lists keyed by asset ID and by IP.
+    '''
+
+    by_asset = defaultdict(list)
+    by_ip = defaultdict(list)
+    for asset_id, ip, vuln in vulns:
+        if asset_id:
+            by_asset[asset_id].append(vuln)
+        elif ip:
+            by_ip[ip].append(vuln)
+    return by_asset, by_ip
+
+def build_assets_from_json(hosts, vulns, timer=None):
     '''
     Map asset attributes from API reponse and populate custom attributes and network interfaces.
 
-    :param json_input: a dict, API JSON response of asset data.
+    :param hosts: a list, API JSON response of asset data.
+    :param vulns: a list, (asset ID, IP, Vulnerability) records from GVM reports.
+    :param timer: a PhaseTimer, optional timer for the correlate and build phases.
     :returns: a list, asset data formatted for runZero import.  
     '''
 
-    assets = []
-    for host in hosts:
-        # assign known API attributes from the json dict that are always present
-        # if custom fields created in GVM align to asset fields in r0 SDK docs
-        # additional attributes can be added here following the pattern
-        
-        identifiers = host.get('identifiers', {}).get('identifier', [])
-        detail = host.get('host', {}).get('detail', [])
-        host_id = str(host.get('@id', uuid.uuid4()))
-        logger.info(f"Processing attributes for {host_id}.")
-        ip = host.get('name', '')
-        mac = None
-        os = ''
-        hostnames = []
-        cpe = ''
-        best_os_txt = ''
-        traceroute = ''
-        severity = host.get('host', {}).get('severity', {}).get('value', '')
-        ssh_keys = []
-        # Parse all of the fun XML turned JSON
-        if identifiers and type(identifiers) == list:
-            for item in identifiers:
-                if item['name'] == 'hostname':
-                    hostnames.append(item['value'])
-                if item['name'] == 'ssh-key':
-                    ssh_keys.append(item['value'])
-        if type(detail) == list:
-            for item in detail:
-                if item['name'] == 'best_os_cpe':
-                    cpe = item['value']
-                if item['name'] == 'best_os_txt':
-                    best_os_txt = os = item['value']
-                if item['name'] == 'traceroute':
-                    traceroute = item['value'] 
-        
-        if ssh_keys:
-            ssh_keys = ssh_keys[0]
-        else:
-            ssh_keys = ''
-
-        # create the network interfaces
-        logger.info(f"Building network interfaces for {host_id}")
-        network = build_network_interface(ips=[ip], mac=mac)
-        logger.info(f"Network interfaces for {host_id} built successfully.")
-        # map custom attributes
-
-        custom_attrs = {
-                        'bestOsTxt': best_os_txt,
-                        'os.cpe23': cpe,
-                        'traceroute': traceroute,
-                        'severity': severity,
-                        'sshKey': ssh_keys
-                        }
-
-        vuln_list = []
-        logger.info(f"Processing vulnerabilities for {host_id}")
-        for vuln in vulns:
-            if vuln['host']['asset']['@asset_id'] and vuln['host']['asset']['@asset_id'] == host_id:
-                vuln_list.append(build_vuln(vuln))
-            elif not vuln['host']['asset']['@asset_id'] and vuln['host']['#text'] and vuln['host']['#text'] == ip:
-                vuln_list.append(build_vuln(vuln))
-            else:
-                pass
-        logger.info(f"All vulnerabilities for {host_id} processed successfully.")
-
-        # Build assets for import
-        assets.append(
-            ImportAsset(
-                id=host_id,
-                hostnames=hostnames,
-                os=os,
-                networkInterfaces=[network],
-                customAttributes=custom_attrs,
-                vulnerabilities=vuln_list
-            )
-        )
-        logger.info(f"All attributes for {host_id} processed successfully.") 
-    return assets
+    timer = timer or PhaseTimer()
+    with timer.phase('correlate'):
+        by_asset, by_ip = group_vulns(vulns)
+    logger.info(f"Correlated {len(vulns)} vulnerabilities to {len(by_asset)} asset IDs and {len(by_ip)} IPs.")
+    with timer.phase('build'):
+        return [build_asset(host, by_asset, by_ip) for host in hosts]
+
+def build_asset(host, by_asset, by_ip):
+    '''
+    Map a single host and its grouped vulnerability results to an ImportAsset.
+
+    :param host: a dict, GVM asset data.
+    :param by_asset: a dict, Vulnerability lists keyed by asset ID.
+    :param by_ip: a dict, Vulnerability lists for results without an asset ID keyed by IP.
+    :returns: an ImportAsset, asset data formatted for runZero import.
+    '''
+
+    # assign known API attributes from the json dict that are always present
+    # if custom fields created in GVM align to asset fields in r0 SDK docs
+    # additional attributes can be added here following the pattern
+    
+    identifiers = host.get('identifiers', {}).get('identifier', [])
+    detail = host.get('host', {}).get('detail', [])
+    host_id = str(host.get('@id', uuid.uuid4()))
+    logger.info(f"Processing attributes for {host_id}.")
+    ip = host.get('name', '')
+    mac = None
+    os = ''
+    hostnames = []
+    cpe = ''
+    best_os_txt = ''
+    traceroute = ''
+    severity = host.get('host', {}).get('severity', {}).get('value', '')
+    ssh_keys = []
+    # Parse all of the fun XML turned JSON
+    if identifiers and type(identifiers) == list:
+        for item in identifiers:
+            if item['name'] == 'hostname':
+                hostnames.append(item['value'])
+            if item['name'] == 'ssh-key':
+                ssh_keys.append(item['value'])
+    if type(detail) == list:
+        for item in detail:
+            if item['name'] == 'best_os_cpe':
+                cpe = item['value']
+            if item['name'] == 'best_os_txt':
+                best_os_txt = os = item['value']
+            if item['name'] == 'traceroute':
+                traceroute = item['value'] 
+    
+    if ssh_keys:
+        ssh_keys = ssh_keys[0]
+    else:
+        ssh_keys = ''
+
+    # create the network interfaces
+    logger.info(f"Building network interfaces for {host_id}")
+    network = build_network_interface(ips=[ip], mac=mac)
+    logger.info(f"Network interfaces for {host_id} built successfully.")
+    # map custom attributes
+
+    custom_attrs = {
+                    'bestOsTxt': best_os_txt,
+                    'os.cpe23': cpe,
+                    'traceroute': traceroute,
+                    'severity': severity,
+                    'sshKey': ssh_keys
+                    }
+
+    vuln_list = by_asset.get(host_id, []) + by_ip.get(ip, [])
+    logger.info(f"Attached {len(vuln_list)} vulnerabilities to {host_id}.")
+    logger.info(f"All attributes for {host_id} processed successfully.") 
+
+    # Build asset for import
+    return ImportAsset(
+        id=host_id,
+        hostnames=hostnames,
+        os=os,
+        networkInterfaces=[network],
+        customAttributes=custom_attrs,
+        vulnerabilities=vuln_list
+    )
 
 def build_network_interface(ips, mac=None):
     ''' 
@@ -159,7 +214,9 @@ def build_vuln(vuln):
     vulnerability custom attributes
     '''
 
-    ref = vuln.get('nvt', {}).get('refs', {}).get('ref', [])
+    # empty elements parse to None and elements without attributes to plain strings
+    nvt = vuln.get('nvt') or {}
+    ref = (nvt.get('refs') or {}).get('ref') or []
     identifier = cve_id = ''
     if ref and type(ref) == list:
         for item in ref:
@@ -167,28 +224,35 @@ def build_vuln(vuln):
                 identifier = cve_id = item['@id']
     if ref and type(ref) == dict:
         if ref['@type'] == 'cve':
-            identifier = cve_id = item['@id']
+            identifier = cve_id = ref['@id']
     name = vuln.get('name')
     if identifier == '' or identifier == None:
         identifier = name
     description = vuln.get('description')
     if description:
         description = description[:1023]
-    service_address = vuln.get('host', {}).get('#text', '')
+    host = vuln.get('host') or {}
+    if type(host) != dict:
+        host = {'#text': host}
+    service_address = host.get('#text', '')
     if service_address:
-        service_address = IPv4Address(ip_address(service_address))
-    service = vuln.get('port').split('/')
+        try:
+            address = ip_address(service_address)
+            service_address = IPv4Address(address) if address.version == 4 else IPv6Address(address)
+        except ValueError:
+            service_address = ''
+    service = (vuln.get('port') or '').split('/')
     try:
         service_port = int(service[0])
     except:
         service_port = 0
-    service_transport = service[1]
+    service_transport = service[1] if len(service) > 1 else ''
     first_detected_timestamp = vuln.get('creation_time', '')
     #exploitability = detail.get('')
     #if not exploitability:
         #exploitability = detail.get('')
     #exploitable = True if float(exploitability) >= 5.0 else False
-    cvss2_base_score = vuln.get('nvt', {}).get('cvss_base', '')
+    cvss2_base_score = nvt.get('cvss_base', '')
     if cvss2_base_score:
         cvss2_base_score = float(cvss2_base_score)
     #cvss3_base_score = detail.get('')
@@ -197,6 +261,7 @@ def build_vuln(vuln):
     # risk_score = detail.get()
     # risk_rank = detail.get()
     severity_score = vuln.get('severity', '')
+    risk_rank = 0
     if severity_score:
         severity_score = float(severity_score)
         if severity_score >= 0.1 and severity_score <=3.9:
@@ -210,11 +275,14 @@ def build_vuln(vuln):
         else:
             risk_rank = 0
         
-    solution = vuln.get('solution', {}).get('@type', '') + ': ' + vuln.get('solution', {}).get('#text', '')
+    solution = vuln.get('solution') or {}
+    if type(solution) != dict:
+        solution = {'#text': solution}
+    solution = (solution.get('@type') or '') + ': ' + (solution.get('#text') or '')
     solution = solution[:1023]
 
     custom_attrs = {}
-    custom_attrs['vulnerabilityFamily'] = vuln.get('nvt', {}).get('family', '')
+    custom_attrs['vulnerabilityFamily'] = nvt.get('family', '')
     custom_attrs['threat'] = vuln.get('threat', '')
     # custom_attrs refs URLs
     if cve_id:
@@ -285,37 +353,200 @@ def import_data_to_runzero(assets):
     if import_task:
         print(f'task created! view status here: {RUNZERO_BASE_URL}/api/v1.0/tasks?task={import_task.id}')
 
-def socketConnect():
-    path = GVM_SOCKET_PATH
-    connection = UnixSocketConnection(path=path)
+class GmpPool:
+    '''
+    Authenticated GMP connections, one per thread, so report pages can be fetched in parallel.
+    Connections stay open for the whole sync and are closed together by close().
+    '''
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.local = threading.local()
+        self.stacks = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        gmp = getattr(self.local, 'gmp', None)
+        if gmp is None:
+            stack = ExitStack()
+            with self.lock:
+                self.stacks.append(stack)
+            gmp = stack.enter_context(Gmp(connection=self.connect()))
+            gmp.authenticate(GVM_USERNAME, GVM_PASSWORD)
+            self.local.gmp = gmp
+        return gmp
+
+    def close(self):
+        for stack in self.stacks:
+            stack.close()
+
+def element_to_dict(elem):
+    '''
+    Convert a single XML element to the same shape xmltodict would produce ('@' prefixed attributes,
+    '#text' for text alongside attributes or children, lists for repeated children).
 
+    :param elem: an Element, XML element.
+    :returns: a dict or string, converted element.
+    '''
+
+    node = {f'@{key}': value for key, value in elem.attrib.items()}
+    for child in elem:
+        value = element_to_dict(child)
+        if child.tag not in node:
+            node[child.tag] = value
+        elif type(node[child.tag]) == list:
+            node[child.tag].append(value)
+        else:
+            node[child.tag] = [node[child.tag], value]
+    text = (elem.text or '').strip()
+    if not node:
+        return text or None
+    if text:
+        node['#text'] = text
+    return node
+
+def iter_elements(xml, tag, parent, chunk_size=65536):
+    '''
+    Incrementally parse a GMP response and yield each matching element as a dict as soon as it is
+    complete, clearing it afterwards so the full element tree is never held in memory.
+
+    :param xml: A string, GMP XML response.
+    :param tag: A string, tag of the elements to yield.
+    :param parent: A string, tag of the direct parent of the elements to yield.
+    :param chunk_size: An integer, number of characters fed to the parser at a time.
+    :returns: a generator, dicts of matching elements.
+    '''
+
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    path = []
+    for start in range(0, len(xml), chunk_size):
+        parser.feed(xml[start:start + chunk_size])
+        for event, elem in parser.read_events():
+            if event == 'start':
+                path.append(elem.tag)
+                continue
+            path.pop()
+            if elem.tag == tag and path and path[-1] == parent:
+                yield element_to_dict(elem)
+                elem.clear()
+    parser.close()
+
+def parse_results(xml, known):
+    '''
+    Convert the results in a page of a GMP report straight into Vulnerability records. Only results
+    for a host returned by get_hosts are converted: by asset ID, or by IP when the result has no asset ID.
+
+    :param xml: A string, GMP get_report response.
+    :param known: a tuple, sets of host asset IDs and host IPs (see known_hosts).
+    :returns: a tuple, number of results in the page and a list of (asset ID, IP, Vulnerability) records.
+    '''
+
+    host_ids, host_ips = known
+    records = []
+    count = 0
+    for result in iter_elements(xml, 'result', 'results'):
+        count += 1
+        host = result.get('host') or {}
+        if type(host) != dict:
+            host = {'#text': host}
+        asset_id = (host.get('asset') or {}).get('@asset_id')
+        ip = host.get('#text')
+        matched = asset_id in host_ids if asset_id else ip in host_ips
+        if matched:
+            records.append((asset_id, ip, build_vuln(result)))
+    return count, records
+
+def known_hosts(hosts):
+    '''
+    Collect the asset IDs and IPs of the hosts returned by get_hosts.
+
+    :param hosts: a list, host dicts.
+    :returns: a tuple, set of asset IDs and set of IPs.
+    '''
+
+    return {host.get('@id') for host in hosts if host.get('@id')}, {host.get('name') for host in hosts if host.get('name')}
+
+def fetch_report_page(pool, report_id, first, timer, known):
+    '''
+    Fetch and parse a single page of results from a GMP report.
+
+    :param pool: a GmpPool, per thread GMP connections.
+    :param report_id: A string, UUID of the report.
+    :param first: An integer, index of the first result in the page (1 based).
+    :param timer: a PhaseTimer, timer for the fetch and parse phases.
+    :param known: a tuple, sets of host asset IDs and host IPs (see known_hosts).
+    :returns: a tuple, number of results in the page and a list of (asset ID, IP, Vulnerability) records.
+    '''
+
+    conn = pool.get()
+    with timer.phase('fetch'):
+        report = conn.get_report(report_id=report_id, filter_string=f'first={first} rows={GVM_PAGE_SIZE}', details=True)
+    with timer.phase('parse'):
+        return parse_results(report, known)
+
+def fetch_report(pool, executor, report_id, timer, known):
+    '''
+    Fetch all pages of a GMP report in parallel. Pages are requested in batches of one per worker
+    until a page comes back short.
+
+    :param pool: a GmpPool, per thread GMP connections.
+    :param executor: a ThreadPoolExecutor, workers fetching pages.
+    :param report_id: A string, UUID of the report.
+    :param timer: a PhaseTimer, timer for the fetch and parse phases.
+    :param known: a tuple, sets of host asset IDs and host IPs (see known_hosts).
+    :returns: a list, (asset ID, IP, Vulnerability) records.
+    '''
+
+    records = []
+    first = 1
+    while True:
+        starts = [first + page * GVM_PAGE_SIZE for page in range(GVM_WORKERS)]
+        pages = executor.map(lambda start: fetch_report_page(pool, report_id, start, timer, known), starts)
+        done = False
+        for count, page in pages:
+            records.extend(page)
+            done = done or count < GVM_PAGE_SIZE
+        if done:
+            return records
+        first = starts[-1] + GVM_PAGE_SIZE
+
+def sync_gvm(connect, timer):
+    '''
+    Retrieve hosts and the results of the latest report of each task from GVM.
+
+    :param connect: a callable, returns a new GVM connection.
+    :param timer: a PhaseTimer, timer for the fetch and parse phases.
+    :returns: a tuple, list of host dicts and list of (asset ID, IP, Vulnerability) records.
+    '''
+
+    pool = GmpPool(connect)
     try:
-        with Gmp(connection=connection) as conn:
-            conn.authenticate(GVM_USERNAME, GVM_PASSWORD)
-            # get the response message returned as a utf-8 encoded string
-            hosts = xmltodict.parse(conn.get_hosts(details=True))
-            hosts = hosts.get('get_assets_response', {}).get('asset', [])
-            if not hosts:
-                # add logging message here for zero hosts
-                logger.warning('No hosts returned from Greenbone API. Exiting...')
-                exit()
-            logger.info(f"Fetched {len(hosts)} hosts from Greenbone API.")
-            vulns = []
-            tasks = xmltodict.parse(conn.get_tasks(ignore_pagination=True))
-            tasks = tasks.get('get_tasks_response', {}).get('task', {})
-            logger.info(f"fetched {len(tasks)} tasks from Greenbone API.")
-            if tasks and type(tasks) == dict:
-                latest_reports = tasks.get('last_report', {}).get('report', {}).get('@id', '')
-            if tasks and type(tasks) == list:    
-                latest_reports = [task.get('last_report', {}).get('report', {}).get('@id', '') for task in tasks]
-            logger.info(f"Preparing to fetch vulnerabilities from {len(latest_reports)} reports.")
-            if latest_reports:
-                for id in latest_reports:
-                    report = xmltodict.parse(conn.get_report(report_id=id, ignore_pagination=True, details=True))
-                    vulnerabilities = report.get('get_reports_response', {}).get('report', {}).get('report', {}).get('results', {}).get('result', [])
-                    vulns.extend(vulnerabilities)
-            logger.info(f"Retrieved {len(vulns)} vulnerabilities from reports.")
-            return(hosts, vulns)
+        conn = pool.get()
+        # get the response message returned as a utf-8 encoded string
+        with timer.phase('fetch'):
+            hosts = conn.get_hosts(details=True)
+        with timer.phase('parse'):
+            hosts = list(iter_elements(hosts, 'asset', 'get_assets_response'))
+        if not hosts:
+            # add logging message here for zero hosts
+            logger.warning('No hosts returned from Greenbone API. Exiting...')
+            exit()
+        logger.info(f"Fetched {len(hosts)} hosts from Greenbone API.")
+        with timer.phase('fetch'):
+            tasks = conn.get_tasks(ignore_pagination=True)
+        with timer.phase('parse'):
+            tasks = list(iter_elements(tasks, 'task', 'get_tasks_response'))
+        logger.info(f"fetched {len(tasks)} tasks from Greenbone API.")
+        latest_reports = [((task.get('last_report') or {}).get('report') or {}).get('@id', '') for task in tasks]
+        latest_reports = [id for id in latest_reports if id]
+        logger.info(f"Preparing to fetch vulnerabilities from {len(latest_reports)} reports.")
+        known = known_hosts(hosts)
+        vulns = []
+        with ThreadPoolExecutor(max_workers=GVM_WORKERS) as executor:
+            for id in latest_reports:
+                vulns.extend(fetch_report(pool, executor, id, timer, known))
+        logger.info(f"Retrieved {len(vulns)} vulnerabilities from reports.")
+        return(hosts, vulns)
     except GvmError:
         logger.critical("Encountered a GVM error: ", GvmError, "Exiting...")
         exit()
@@ -328,8 +559,12 @@ def socketConnect():
     except GvmServerError:
         logger.critical("The GVM server encountered an error: ", GvmServerError, "Exiting...")
         exit()
+    finally:
+        pool.close()
+
+def socketConnect(timer):
+    return sync_gvm(lambda: UnixSocketConnection(path=GVM_SOCKET_PATH), timer)
 
-    
 def sshConnect():
     pass
 
@@ -338,8 +573,9 @@ def tlsConnect():
 
 def main():
     logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%a, %d %b %Y %H:%M:%S', filename=f'sync_gvm.log', level=logging.INFO)
+    timer = PhaseTimer()
     if GVM_CONN_METHOD.lower() == 'socket':
-        response = socketConnect()
+        response = socketConnect(timer)
     elif GVM_CONN_METHOD.lower() == 'ssh':
         assetXML = sshConnect()
     elif GVM_CONN_METHOD.lower() == 'tls':
@@ -352,10 +588,12 @@ def main():
     vuln_json = response[1]
 
     # Format asset list for import into runZero
-    import_assets = build_assets_from_json(asset_json, vuln_json)
+    import_assets = build_assets_from_json(asset_json, vuln_json, timer)
 
     # Import assets into runZero
-    import_data_to_runzero(assets=import_assets)
+    with timer.phase('upload'):
+        import_data_to_runzero(assets=import_assets)
+    timer.report()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -8,15 +8,20 @@
 import json
 import requests
 import os
-import uuid
+import re
+import sys
 from flatten_json import flatten
 from ipaddress import ip_address
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List
 import runzero
 from runzero.client import AuthError
 from runzero.api import CustomAssets, Sites
 from runzero.types import (ImportAsset,IPv4Address,IPv6Address,NetworkInterface,ImportTask)
 
+# sdk_sync.py holds the helpers shared by the sample scripts; it is looked up next to this script, then in sdk-sample-scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sdk_sync import FingerprintStore, fallback_id
+
 # Configure runZero variables
 RUNZERO_BASE_URL = os.environ['RUNZERO_BASE_URL']
 RUNZERO_CLIENT_ID = os.environ['RUNZERO_CLIENT_ID']
@@ -27,25 +32,37 @@ RUNZERO_SITE_ID = os.environ['RUNZERO_SITE_ID']
 KISMET_CUSTOM_SOURCE_ID = os.environ['KISMET_CUSTOM_SOURCE_ID']
 KISMET_IMPORT_TASK_NAME = os.environ['KISMET_IMPORT_TASK_NAME']
 
+# Fingerprints of uploaded assets are kept in RUNZERO_FINGERPRINT_PATH so only new or changed assets are uploaded;
+# every RUNZERO_FULL_SYNC_DAYS all assets are uploaded regardless
+RUNZERO_FINGERPRINT_PATH = os.environ.get('RUNZERO_FINGERPRINT_PATH', 'fingerprints.db')
+RUNZERO_FULL_SYNC_DAYS = float(os.environ.get('RUNZERO_FULL_SYNC_DAYS', 7))
+
 # Configure Integration API variables
 KISMET_URL = os.environ['KISMET_URL']
 KISMET_PORT = os.environ['KISMET_PORT']
 KISMET_PHY = os.environ['KISMET_PHY']
 KISMET_KEY = os.environ['KISMET_KEY']
 
-def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset]:
+# Kismet fields that change on every poll of an active device: timestamps other than first seen, packet and data
+# counters, signal and location readings and the per source seen-by records. They are not uploaded as custom
+# attributes, as they would change the fingerprint of every active device on every run (and only be current
+# in runZero until the next skipped upload anyway)
+KISMET_VOLATILE_FIELDS = re.compile(r'last_time|mod_time|packets|packet\.bin|datasize|signal|freq_khz_map|seenby|location|rrd|'
+                                    r'num_alerts|last_sequence|num_fragments|num_retries|beacons_sec|last_beaconed_ssid|last_probed_ssid')
+
+def build_assets_from_json(json_input: Iterable[Dict[str, Any]]) -> Iterator[ImportAsset]:
     '''
-    Map asset attributes from API reponse and populate custom attributes and network interfaces.
+    Map asset attributes from API reponse and populate custom attributes and network interfaces. Fields that
+    Kismet updates on every poll (see KISMET_VOLATILE_FIELDS) are left out of the custom attributes.
 
-    :param json_input: a dict, API JSON response of asset data.
-    :returns: a list, asset data formatted for runZero import.  
+    :param json_input: an iterable, API JSON response records of asset data.
+    :returns: a generator, asset data formatted for runZero import, built one asset at a time.  
     '''
 
-    assets: List[ImportAsset] = []
     for item in json_input:
         #Assign API attributes from the json dict that correspond to SDK
         item = flatten(item)
-        asset_id = item.get('id', str(uuid.uuid4()))
+        asset_id = item.get('kismet.device.base.key') or fallback_id()
         mac = item.get('kismet.device.base.macaddr', None)
         device_type = item.get('kismet.device.base.type')
         manuf = item.get('kismet.device.base.manuf')
@@ -58,6 +75,8 @@ def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset
         # handle any additional values and insert into custom_attrs
         custom_attrs: Dict[str] = {}
         for key, value in item.items():
+            if KISMET_VOLATILE_FIELDS.search(key):
+                continue
             if isinstance(value, dict):
                 for k, v in value.items():
                     custom_attrs[k] = str(v)[:1023]
@@ -65,18 +84,15 @@ def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset
                custom_attrs[key] = str(value)[:1023]
 
         # Build assets for import
-        assets.append(
-            ImportAsset(
-                id=asset_id,
-                networkInterfaces=[network],
-                deviceType=device_type,
-                manufacturer=manuf,
-                hostnames=[name],
-                firstSeenTS=first_seen,
-                customAttributes=custom_attrs,
-            )
+        yield ImportAsset(
+            id=asset_id,
+            networkInterfaces=[network],
+            deviceType=device_type,
+            manufacturer=manuf,
+            hostnames=[name],
+            firstSeenTS=first_seen,
+            customAttributes=custom_attrs,
         )
-    return assets
 
 def build_network_interface(ips: List[str], mac: str = None) -> NetworkInterface:
     ''' 
@@ -108,7 +124,7 @@ def import_data_to_runzero(assets: List[ImportAsset]):
     Import assets to specified runZero Organization and Site using the specified Custom Source ID and Name.
 
     :param assets: A list, list of assets formatted by the ImportAsset class from the runZero SDK.
-    :returns: None
+    :returns: An ImportTask, the created import task, or None if the upload did not happen.
     '''
     
     # create the runzero client
@@ -134,6 +150,7 @@ def import_data_to_runzero(assets: List[ImportAsset]):
 
     if import_task:
         print(f'task created! view status here: {RUNZERO_BASE_URL}/api/v1.0/tasks?task={import_task.id}')
+    return import_task
 
 def get_kismet_assets(cookie=KISMET_KEY, uri=KISMET_URL, port=KISMET_PORT, phy=KISMET_PHY):
     '''
@@ -168,8 +185,15 @@ def main():
     # Format asset list for import into runZero
     import_assets = build_assets_from_json(asset_json)
 
-    # Import assets into runZero
-    import_data_to_runzero(assets=import_assets)
+    # Import new or changed assets into runZero
+    store = FingerprintStore(RUNZERO_FINGERPRINT_PATH, RUNZERO_FULL_SYNC_DAYS, KISMET_CUSTOM_SOURCE_ID)
+    try:
+        changed_assets = list(store.filter(import_assets))
+        store.report()
+        if not changed_assets or import_data_to_runzero(assets=changed_assets):
+            store.commit()
+    finally:
+        store.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
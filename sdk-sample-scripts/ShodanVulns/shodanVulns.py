@@ -5,18 +5,24 @@
 # Prerequisite: pip install runzero-sdk
 
 
+import gzip
 import json
 import os
 import requests
 import runzero
+import sqlite3
+import threading
 import time
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flatten_json import flatten
 from ipaddress import ip_address
+from requests.exceptions import ConnectionError
 from runzero.client import AuthError
 from runzero.api import CustomAssets, Sites
 from runzero.types import (ImportAsset,ImportTask,IPv4Address,IPv6Address,NetworkInterface,Vulnerability)
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 # Configure runZero variables
 RUNZERO_BASE_URL = os.environ['RUNZERO_BASE_URL']
@@ -34,6 +40,16 @@ SHODAN_VULNS_IMPORT_TASK_NAME = os.environ['SHODAN_VULNS_IMPORT_TASK_NAME']
 NVD_API_URL = 'https://services.nvd.nist.gov/rest/json/cves/2.0?'
 NVD_HEADERS = {'Accept': 'application/json',
                'Content-Type': 'application/json'}
+# Optional NVD API key; raises the request budget from 5 to 50 requests per 30 seconds
+NVD_API_KEY = os.environ.get('NVD_API_KEY', '')
+NVD_RATE_LIMIT = 50 if NVD_API_KEY else 5
+NVD_WORKERS = int(os.environ.get('NVD_WORKERS', 4))
+# CVE details are cached on disk and reused until older than NVD_CACHE_TTL seconds
+NVD_CACHE_PATH = os.environ.get('NVD_CACHE_PATH', 'nvd_cache.db')
+NVD_CACHE_TTL = int(os.environ.get('NVD_CACHE_TTL', 604800))
+# Optional directory of NVD JSON 2.0 feed files; when set CVEs are resolved from a local index first
+NVD_FEED_PATH = os.environ.get('NVD_FEED_PATH', '')
+NVD_INDEX_PATH = os.environ.get('NVD_INDEX_PATH', 'nvd_index.db')
 
 def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset]:
     '''
@@ -85,11 +101,15 @@ def build_network_interface(ips: List[str], mac: str = None) -> NetworkInterface
     else:
         return NetworkInterface(macAddress=mac, ipv4Addresses=ip4s, ipv6Addresses=ip6s)
 
-def build_vuln(address, ports, detail):
+def summarize_cve(detail: Dict[str, Any]) -> Dict[str, Any]:
     '''
-    This function maps vulnerability information to runZero attribute fields and assigns all key, value pairs to
-    vulnerability custom attributes
+    Precompute the fields used to build a Vulnerability from an NVD CVE record so that each CVE is
+    flattened and parsed once, no matter how many assets report it.
+
+        :param detail: A dict, NVD API response or feed entry wrapped as {'vulnerabilities': [entry]}.
+        :returns: a dict, CVE summary with scores, exploitability, description and custom attributes.
     '''
+
     ranking_map = {'NONE': 0,
                    'LOW': 1,
                    'MEDIUM': 2,
@@ -98,50 +118,62 @@ def build_vuln(address, ports, detail):
 
     detail = flatten(detail)
     identifier = detail.get('vulnerabilities_0_cve_id')
-    cve_id = detail.get('vulnerabilities_0_cve_id')
     vuln_name = detail.get('vulnerabilities_0_cve_cisaVulnerabilityName')
     if vuln_name == '' or vuln_name == None:
         vuln_name = identifier
-    vuln_description = detail.get('vulnerabilities_0_cve_descriptions_0_value')[:1023]
-    service_address = IPv4Address(ip_address(address))
-    #develop better logic for assigning port to CVE
-    # likely a different function to parse CVE details and assign likely port from provided list
-    service_port = ports[0]
     exploitability = detail.get('vulnerabilities_0_cve_metrics_cvssMetricV31_0_exploitabilityScore')
     if not exploitability:
         exploitability = detail.get('vulnerabilities_0_cve_metrics_cvssMetricV2_0_exploitabilityScore')
-    exploitable = True if float(exploitability) >= 5.0 else False
-    #service_transport = detail.get()[:255]
     cvss2_base_score = detail.get('vulnerabilities_0_cve_metrics_cvssMetricV2_0_cvssData_baseScore')
-    if cvss2_base_score and cvss2_base_score != '':
-        cvss2_base_score = float(cvss2_base_score)
     cvss3_base_score = detail.get('vulnerabilities_0_cve_metrics_cvssMetricV31_0_cvssData_baseScore')
-    if cvss3_base_score and cvss3_base_score != '':
-        cvss3_base_score = float(cvss3_base_score)
-    # risk_score = detail.get()
-    # risk_rank = detail.get()
-    # severity_score = detail.get()
     severity_rank = detail.get('vulnerabilities_0_cve_metrics_cvssMetricV31_0_cvssData_baseSeverity')
-    if not severity_rank or severity_rank and severity_rank == '':
-        severity_rank = detail.get('vulnerabilities_0_cve_metrics_cvssMetricV2_0_cvssData_baseSeverity', 'NONE')
-    severity_rank = ranking_map[severity_rank]
-    solution = detail.get('vulnerabilities_0_cve_cisaRequiredAction', '')[:1023]
-    custom_attrs: Dict[str] = {}
+    if not severity_rank:
+        #CVSS v2 reports severity alongside, not inside, cvssData
+        severity_rank = detail.get('vulnerabilities_0_cve_metrics_cvssMetricV2_0_baseSeverity', 'NONE')
+    custom_attrs: Dict[str, str] = {}
     for key, value in detail.items():
         custom_attrs[key] = str(value)[:1023]
 
-    return Vulnerability(id=identifier,
-                         cve=cve_id,
-                         name=vuln_name,
-                         description=vuln_description,
+    return {'id': identifier,
+            'name': vuln_name,
+            'last_modified': detail.get('vulnerabilities_0_cve_lastModified', ''),
+            'description': (detail.get('vulnerabilities_0_cve_descriptions_0_value') or '')[:1023],
+            'exploitability': float(exploitability) if exploitability not in (None, '') else None,
+            'cvss2_base_score': float(cvss2_base_score) if cvss2_base_score not in (None, '') else None,
+            'cvss3_base_score': float(cvss3_base_score) if cvss3_base_score not in (None, '') else None,
+            'severity_rank': ranking_map.get(severity_rank, 0),
+            'solution': (detail.get('vulnerabilities_0_cve_cisaRequiredAction') or '')[:1023],
+            'custom_attributes': custom_attrs}
+
+def build_vuln(address, ports, detail):
+    '''
+    This function maps precomputed vulnerability information (see summarize_cve) to runZero attribute fields and
+    assigns all key, value pairs to vulnerability custom attributes
+    '''
+
+    service_address = IPv4Address(ip_address(address))
+    #develop better logic for assigning port to CVE
+    # likely a different function to parse CVE details and assign likely port from provided list
+    service_port = ports[0]
+    exploitability = detail['exploitability']
+    exploitable = True if exploitability is not None and exploitability >= 5.0 else False
+    #service_transport = detail.get()[:255]
+    # risk_score = detail.get()
+    # risk_rank = detail.get()
+    # severity_score = detail.get()
+
+    return Vulnerability(id=detail['id'],
+                         cve=detail['id'],
+                         name=detail['name'],
+                         description=detail['description'],
                          serviceAddress=service_address,
                          servicePort=service_port,
                          exploitable=exploitable,
-                         cvss2BaseScore=cvss2_base_score,
-                         cvss3BaseScore=cvss3_base_score,
-                         severityRank=severity_rank,
-                         solution=solution,
-                         customAttributes=custom_attrs
+                         cvss2BaseScore=detail['cvss2_base_score'],
+                         cvss3BaseScore=detail['cvss3_base_score'],
+                         severityRank=detail['severity_rank'],
+                         solution=detail['solution'],
+                         customAttributes=detail['custom_attributes']
                          )
 
 def import_data_to_runzero(assets: List[ImportAsset]):
@@ -209,8 +241,8 @@ def parse_assets(data):
 
     assets = []
     try:
-        asset = {}
         for item in data:
+            asset = {}
             item = flatten(item)
             asset['id'] = item.get('id')
             asset['address'] = item.get('foreign_attributes_@shodan.dev_0_host.ipStr', '')
@@ -221,66 +253,232 @@ def parse_assets(data):
     except TypeError as error:
         raise error
     
-def match_nvd(url, data, retries=3, delay=5, rate_limit=5, window=30):
+class CVECache:
+    '''
+    On-disk cache of NVD CVE details keyed by CVE ID. Entries older than ttl seconds are
+    treated as missing so they are fetched again.
+    '''
+
+    def __init__(self, filename: str, ttl: int):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS cves (cve_id TEXT PRIMARY KEY, fetched_at REAL, detail TEXT)')
+        self.db.commit()
+
+    def get(self, cve_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.db.execute('SELECT fetched_at, detail FROM cves WHERE cve_id = ?', (cve_id,)).fetchone()
+        if row and time.time() - row[0] < self.ttl:
+            return json.loads(row[1])
+        return None
+
+    def put(self, cve_id: str, detail: Dict[str, Any]):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO cves VALUES (?, ?, ?)', (cve_id, time.time(), json.dumps(detail)))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+class SlidingWindow:
     '''
-    Retrieve CVE details from NVD.
+    Thread safe limiter allowing at most rate_limit requests in any window seconds, matching
+    NVD's rolling request budget. The start time of every request in the current window is
+    kept, and a request waits until the oldest of them falls out of the window.
+    '''
+
+    def __init__(self, rate_limit: int, window: float):
+        self.rate_limit = rate_limit
+        self.window = window
+        self.requests = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.requests and now - self.requests[0] >= self.window:
+                    self.requests.popleft()
+                if len(self.requests) < self.rate_limit:
+                    self.requests.append(now)
+                    return
+                wait = self.window - (now - self.requests[0])
+            time.sleep(wait)
+
+class NVDIndex:
+    '''
+    Local mirror of the NVD JSON 2.0 data feeds (nvdcve-2.0-*.json.gz) keyed by CVE ID. Each
+    CVE is stored already summarized (see summarize_cve) so lookups need no parsing. Feed files
+    are only read again when their size or modification time changes, and a CVE is only
+    replaced by a record with a newer lastModified, so the modified and recent delta feeds can
+    be applied on top of the yearly feeds in any order.
+    '''
+
+    def __init__(self, filename: str):
+        self.db = sqlite3.connect(filename)
+        self.db.execute('CREATE TABLE IF NOT EXISTS cves (cve_id TEXT PRIMARY KEY, last_modified TEXT, summary TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS feeds (filename TEXT PRIMARY KEY, size INTEGER, mtime REAL, ingested_at REAL)')
+        self.db.commit()
+
+    def ingest(self, path: str) -> int:
+        '''
+        Ingest any new or changed feed files from a directory.
+
+            :param path: A string, directory containing NVD JSON 2.0 feed files.
+            :returns: an integer, number of CVE records read.
+        '''
+
+        total = 0
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(('.json', '.json.gz')):
+                continue
+            filename = os.path.join(path, name)
+            stat = os.stat(filename)
+            seen = self.db.execute('SELECT size, mtime FROM feeds WHERE filename = ?', (name,)).fetchone()
+            if seen and seen[0] == stat.st_size and seen[1] == stat.st_mtime:
+                continue
+            opener = gzip.open if name.endswith('.gz') else open
+            with opener(filename, 'rt', encoding='utf-8') as feed:
+                entries = json.load(feed).get('vulnerabilities', [])
+            rows = []
+            for entry in entries:
+                summary = summarize_cve({'vulnerabilities': [entry]})
+                rows.append((summary['id'], summary['last_modified'], json.dumps(summary)))
+            with self.db:
+                self.db.executemany('''INSERT INTO cves VALUES (?, ?, ?)
+                                       ON CONFLICT(cve_id) DO UPDATE SET last_modified = excluded.last_modified, summary = excluded.summary
+                                       WHERE excluded.last_modified > cves.last_modified''', rows)
+                self.db.execute('INSERT OR REPLACE INTO feeds VALUES (?, ?, ?, ?)', (name, stat.st_size, stat.st_mtime, time.time()))
+            print(f'Ingested {len(rows)} CVEs from {name}')
+            total += len(rows)
+        return total
+
+    def lookup(self, cve_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        '''
+        Retrieve summaries for a collection of CVE IDs in batches.
+
+            :param cve_ids: A list, CVE IDs.
+            :returns: a dict, CVE summaries keyed by CVE ID for the IDs found in the index.
+        '''
+
+        cve_ids = list(cve_ids)
+        found = {}
+        for start in range(0, len(cve_ids), 500):
+            batch = cve_ids[start:start + 500]
+            query = f"SELECT cve_id, summary FROM cves WHERE cve_id IN ({','.join('?' * len(batch))})"
+            for cve_id, summary in self.db.execute(query, batch):
+                found[cve_id] = json.loads(summary)
+        return found
+
+    def close(self):
+        self.db.close()
+
+def fetch_cve(url: str, cve: str, limiter: SlidingWindow, retries: int = 3, delay: int = 5) -> Optional[Dict[str, Any]]:
+    '''
+    Retrieve the details of a single CVE from NVD, waiting on the request limiter before every request.
+    An unknown CVE ID (HTTP 404) is returned as a response with no vulnerabilities.
+
+        :param url: A string, API URL of NVD.
+        :param cve: A string, CVE ID.
+        :param limiter: A SlidingWindow, shared NVD request budget.
+        :param retries: An integer, number of retry attempts for 403 and 429 errors.
+        :param delay: An integer, delay in seconds between retry attempts.
+        :returns: a dict, NVD CVE details, or None if they could not be retrieved this time.
+        :raises: ConnectionError: if unable to successfully make GET request to NVD API (handled per CVE by match_nvd).
+    '''
+
+    params = {'cveId': cve}
+    headers = dict(NVD_HEADERS)
+    if NVD_API_KEY:
+        headers['apiKey'] = NVD_API_KEY
+    for attempt in range(retries):
+        limiter.acquire()
+        response = requests.get(url, headers=headers, params=params)
+        if response.status_code == 200:
+            return json.loads(response.content)
+        if response.status_code == 404:
+            return {'vulnerabilities': []}
+        print(f"Failed to retrieve data for CVE {cve}: {response.content}")
+        if response.status_code in (403, 429) and attempt < retries - 1:
+            print(f"Retrying in {delay} seconds...")
+            time.sleep(delay)
+        else:
+            break
+    return None
+    
+def match_nvd(url, data, retries=3, delay=5, rate_limit=NVD_RATE_LIMIT, window=30, workers=NVD_WORKERS):
+    '''
+    Retrieve CVE details from NVD. CVE IDs are deduplicated across all assets and resolved
+    from the local feed index (when NVD_FEED_PATH is set), then the on-disk cache; only
+    missing or expired CVEs are fetched, concurrently, within the NVD request budget. CVEs that
+    NVD does not know are cached too, so they are not requested again until the cache TTL expires.
         
         :param url: A string, API URL of NVD.
         :param data: A Dict, containing the CVEs to retrieve details for.
-        :param retries: An integer, number of retry attempts for 403 errors.
+        :param retries: An integer, number of retry attempts for 403 and 429 errors.
         :param delay: An integer, delay in seconds between retry attempts.
         :param rate_limit: An integer, maximum number of requests in a rolling window.
         :param window: An integer, rolling window duration in seconds.
-        :returns: a dict, JSON object of assets.
-        :raises: ConnectionError: if unable to successfully make GET request to NVD API.
+        :param workers: An integer, number of concurrent NVD requests.
+        :returns: a list, assets with a summary (see summarize_cve) of each reported CVE.
     '''
-    vulns = []
-    request_times = []
 
+    unique_cves = {cve.upper() for asset in data for cve in asset['cves'] if cve}
+    details = {}
+    if NVD_FEED_PATH:
+        index = NVDIndex(NVD_INDEX_PATH)
+        try:
+            index.ingest(NVD_FEED_PATH)
+            details = index.lookup(unique_cves)
+        finally:
+            index.close()
+        print(f'{len(details)} of {len(unique_cves)} unique CVEs found in the local NVD index.')
+    cache = CVECache(NVD_CACHE_PATH, NVD_CACHE_TTL)
+    missing = []
+    cached = 0
+    for cve in unique_cves - details.keys():
+        detail = cache.get(cve)
+        if detail is None:
+            missing.append(cve)
+            continue
+        if detail.get('vulnerabilities'):
+            details[cve] = summarize_cve(detail)
+        cached += 1
+    print(f'{len(unique_cves)} unique CVEs, {cached} cached, {len(missing)} to fetch from NVD.')
+    limiter = SlidingWindow(rate_limit, window)
+    unresolved = 0
     try:
-        for asset in data:
-            record = {}
-            record['id'] = asset['id']
-            record['address'] = asset['address']
-            record['ports'] = asset['ports']
-            record['cve_details'] = []
-            for cve in asset['cves']:
-                params = {'cveId': cve.upper()}
-                headers = {'Accept': 'application/json'}
-
-                for attempt in range(retries):
-                    # Check the rate limit
-                    current_time = time.time()
-                    request_times = [t for t in request_times if current_time - t < window]
-                    if len(request_times) >= rate_limit:
-                        sleep_time = window - (current_time - request_times[0])
-                        print(f"Rate limit reached. Sleeping for {sleep_time:.2f} seconds.")
-                        time.sleep(sleep_time)
-                        request_times = request_times[1:]
-
-                    response = requests.get(url, headers=headers, params=params)
-                    request_times.append(time.time())
-
-                    if response.status_code == 200:
-                        cve_details = json.loads(response.content)
-                        record['cve_details'].append(cve_details)
-                        break
-                    elif response.status_code == 403:
-                        print(f"Failed to retrieve data for CVE {cve}: {response.content}")
-                        if attempt < retries - 1:
-                            print(f"Retrying in {delay} seconds...")
-                            time.sleep(delay)
-                        else:
-                            record['cve_details'].append({})
-                    else:
-                        print(f"Failed to retrieve data for CVE {cve}: {response.content}")
-                        record['cve_details'].append({})
-                        break
-            vulns.append(record)
-        return vulns
-    except ConnectionError as error:
-        content = "No Response"
-        raise error
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch_cve, url, cve, limiter, retries, delay): cve for cve in missing}
+            for future in as_completed(futures):
+                try:
+                    detail = future.result()
+                except ConnectionError as error:
+                    #one unreachable request must not abort the whole enrichment run
+                    print(f"No response from NVD for CVE {futures[future]}: {error}")
+                    detail = None
+                if detail is None:
+                    #request failed (e.g. still throttled); try again next run
+                    unresolved += 1
+                    continue
+                #unknown CVEs are cached as well, as an empty result
+                cache.put(futures[future], detail)
+                if detail.get('vulnerabilities'):
+                    details[futures[future]] = summarize_cve(detail)
+    finally:
+        cache.close()
+    if unresolved:
+        print(f'{unresolved} CVEs could not be retrieved from NVD and are left unresolved until the next run.')
+    vulns = []
+    for asset in data:
+        record = {}
+        record['id'] = asset['id']
+        record['address'] = asset['address']
+        record['ports'] = asset['ports']
+        record['cve_details'] = [details[cve.upper()] for cve in asset['cves'] if cve and cve.upper() in details]
+        vulns.append(record)
+    return vulns
 
 def main():
     assets = get_assets(RUNZERO_BASE_URL, RUNZERO_EXPORT_TOKEN)
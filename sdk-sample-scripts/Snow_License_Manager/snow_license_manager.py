@@ -8,14 +8,21 @@
 import json
 import os
 import requests
+import sys
 import runzero
-import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from ipaddress import ip_address
+from requests.adapters import HTTPAdapter
 from typing import Any, Dict, List
 from runzero.client import AuthError
 from runzero.api import CustomAssets, Sites
 from runzero.types import (ImportAsset,IPv4Address,IPv6Address,NetworkInterface,ImportTask,Software)
 
+# sdk_sync.py holds the helpers shared by the sample scripts; it is looked up next to this script, then in sdk-sample-scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sdk_sync import FingerprintStore, fallback_id
+
 # Configure runZero variables
 RUNZERO_BASE_URL = os.environ['RUNZERO_BASE_URL']
 RUNZERO_CLIENT_ID = os.environ['RUNZERO_CLIENT_ID']
@@ -26,11 +33,23 @@ RUNZERO_SITE_ID = os.environ['RUNZERO_SITE_ID']
 SNOW_CUSTOM_SOURCE_ID = os.environ['SNOW_CUSTOM_SOURCE_ID']
 SNOW_IMPORT_TASK_NAME = os.environ['SNOW_IMPORT_TASK_NAME']
 
+# Fingerprints of uploaded assets are kept in RUNZERO_FINGERPRINT_PATH so only new or changed assets are uploaded;
+# every RUNZERO_FULL_SYNC_DAYS all assets are uploaded regardless
+RUNZERO_FINGERPRINT_PATH = os.environ.get('RUNZERO_FINGERPRINT_PATH', 'fingerprints.db')
+RUNZERO_FULL_SYNC_DAYS = float(os.environ.get('RUNZERO_FULL_SYNC_DAYS', 7))
+
 # Configure Snow Software License Manager variables
 SNOW_BASE_URL = os.environ['SNOW_BASE_URL']
 SNOW_USERNAME = os.environ['SNOW_USERNAME']
 SNOW_PASSWORD = os.environ['SNOW_PASSWORD']
 SNOW_CUSTOMER_ID = os.environ['SNOW_CUSTOMER_ID']
+SNOW_WORKERS = int(os.environ.get('SNOW_WORKERS', 8))
+SNOW_APP_DETAILS = os.environ.get('SNOW_APP_DETAILS', 'false').lower() == 'true'
+
+# Pooled session shared by all requests to Snow Software License Manager
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_maxsize=SNOW_WORKERS))
+session.mount('http://', HTTPAdapter(pool_maxsize=SNOW_WORKERS))
 
 def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset]:
     '''
@@ -40,10 +59,14 @@ def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset
     :returns: a list, asset data formatted for runZero import.  
     '''
 
+    # Retrieve software information for all assets up front
+    applications_all = get_all_apps([str(entry.get('Body', {}).get('Id')) for entry in json_input])
+    if SNOW_APP_DETAILS:
+        get_all_app_details(applications_all)
     assets: List[ImportAsset] = []
     for entry in json_input:
         item = entry.get('Body', {})
-        asset_id = str(item.get('Id', uuid.uuid4))
+        asset_id = str(item['Id']) if item.get('Id') is not None else fallback_id()
         hostname = item.get('Name', '')
         vendor = item.get('Manufacturer', '')
         hw = item.get('Model', '')
@@ -72,7 +95,7 @@ def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset
         # Retrieve software information for asset
         # create software entries
         software = []
-        applications = get_apps(asset_id)
+        applications = applications_all.get(asset_id, [])
         for app in applications:
             software_entry = build_app(app)
             software.append(software_entry)
@@ -124,8 +147,7 @@ def build_app(software_entry):
     '''
     app = software_entry.get('Body', {})
     app_id = app.get('Id', None)
-    # if app_id:
-    #     software_details = get_app_details(app_id)
+    software_details = get_app_details(app_id) if app_id and SNOW_APP_DETAILS else {}
     #installed = app.get('InstallDate', '')
     product = app.get('FamilyName', '')
     vendor = app.get('ManufacturerName', '')
@@ -137,13 +159,12 @@ def build_app(software_entry):
                 custom_attrs[k] = str(v)[:1023]
         else:
             custom_attrs[key] = str(value)[:1023]
-    # if app_id:        
-    #     for key, value in software_details.items():
-    #         if isinstance(value, dict):
-    #             for k, v in value.items():
-    #                 custom_attrs[k] = str(v)[:1023]
-    #         else:
-    #             custom_attrs[key] = str(value)[:1023]
+    for key, value in software_details.items():
+        if isinstance(value, dict):
+            for k, v in value.items():
+                custom_attrs[k] = str(v)[:1023]
+        else:
+            custom_attrs[key] = str(value)[:1023]
 
     return Software(
         id=app_id,
@@ -158,7 +179,7 @@ def import_data_to_runzero(assets: List[ImportAsset]):
     Import assets to specified runZero Organization and Site using the specified Custom Source ID and Name.
 
     :param assets: A list, list of assets formatted by the ImportAsset class from the runZero SDK.
-    :returns: None
+    :returns: An ImportTask, the created import task, or None if the upload did not happen.
     '''
 
     # create the runzero client
@@ -184,54 +205,65 @@ def import_data_to_runzero(assets: List[ImportAsset]):
 
     if import_task:
         print(f'task created! view status here: {RUNZERO_BASE_URL}/api/v1.0/tasks?task={import_task.id}')
+    return import_task
 
-def get_computers(url=SNOW_BASE_URL, username=SNOW_USERNAME, password=SNOW_PASSWORD, id=SNOW_CUSTOMER_ID):
+def get_pages(endpoint, label, username=SNOW_USERNAME, password=SNOW_PASSWORD, workers=SNOW_WORKERS):
     '''
-    Return a list of computers from the Snow Software License Manager API
+    Return every item from a paginated Snow Software License Manager endpoint. The first page supplies
+    Count and PageSize; the remaining $skip offsets are then fetched concurrently over the pooled session.
 
-    :param url: a string, the base URL of the Snow Software License Manager console.
+    :param endpoint: a string, full URL of the paginated endpoint.
+    :param label: a string, description of the items used in progress and error messages.
     :param username: a string, username for Snow Software License Manager console basic auth.
     :param password: a string, password for Snow Software License Manager console basic auth.
-    :param id: a string, numerical customer id to return computers from (found under https://<console ip>/api/customers ID column).
-    :returns: a list, a list of dictionaries for each computer.
+    :param workers: an integer, number of pages to fetch concurrently.
+    :returns: a list, a list of dictionaries for each item.
     :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
-    items_returned = 0
-    total_items = 10000
-    assets_all = []
 
-    while True:
+    def get_page(skip):
         try:
-            url = f'{url}/api/customers/{id}/computers?'
             headers = {'Accept': 'application/json'}
             params = {'$inlinecount': 'allpages',
-                      '$skip': str(items_returned)}
-            response = requests.get(url, auth=requests.auth.HTTPBasicAuth(username, password), headers=headers, params=params)
+                      '$skip': str(skip)}
+            response = session.get(endpoint, auth=requests.auth.HTTPBasicAuth(username, password), headers=headers, params=params)
             if response.status_code != 200:
-                print(f'failed to retrieve assets at $skip={str(items_returned)}', f'status code: {response.status_code}')
+                print(f'failed to retrieve {label} at $skip={str(skip)}', f'status code: {response.status_code}')
                 exit()
-            else:
-                data = json.loads(response.content)
-                meta = data['Meta']
-                has_page_size = False
-                for item in meta:
-                    if item['Name'] == 'Count':
-                        total_items = item.get('Value')
-                    if item['Name'] == 'PageSize':
-                        has_page_size = True
-                        items_returned += item.get('Value')
-                computers = data['Body']
-                assets_all.extend(computers)
-                if not has_page_size: # The last page lacks the page size meta value
-                    break
-                print(f'{items_returned} computers of {total_items} returned from API')            
+            return json.loads(response.content)
         except ConnectionError as error:
             print("No Response from server.", error)
             exit()
 
-    return assets_all
+    data = get_page(0)
+    meta = {item['Name']: item.get('Value') for item in data['Meta']}
+    items_all = list(data['Body'])
+    page_size = meta.get('PageSize')
+    if not page_size: # The last page lacks the page size meta value
+        return items_all
+    total_items = meta.get('Count', len(items_all))
+    skips = range(page_size, total_items, page_size)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for page in executor.map(get_page, skips):
+            items_all.extend(page['Body'])
+    print(f'{len(items_all)} {label} of {total_items} returned from API')
+    return items_all
+
+def get_computers(url=SNOW_BASE_URL, username=SNOW_USERNAME, password=SNOW_PASSWORD, id=SNOW_CUSTOMER_ID):
+    '''
+    Return a list of computers from the Snow Software License Manager API
+
+    :param url: a string, the base URL of the Snow Software License Manager console.
+    :param username: a string, username for Snow Software License Manager console basic auth.
+    :param password: a string, password for Snow Software License Manager console basic auth.
+    :param id: a string, numerical customer id to return computers from (found under https://<console ip>/api/customers ID column).
+    :returns: a list, a list of dictionaries for each computer.
+    :raises: ConnectionError: if unable to successfully make GET request to console.
+    '''
+
+    return get_pages(f'{url}/api/customers/{id}/computers', 'computers', username, password)
 
-def get_apps(asset_id, url=SNOW_BASE_URL, username=SNOW_USERNAME, password=SNOW_PASSWORD, id=SNOW_CUSTOMER_ID):
+def get_apps(asset_id, url=SNOW_BASE_URL, username=SNOW_USERNAME, password=SNOW_PASSWORD, id=SNOW_CUSTOMER_ID, workers=SNOW_WORKERS):
     '''
     Return a list of installed software for a given computer ID.
 
@@ -240,47 +272,31 @@ def get_apps(asset_id, url=SNOW_BASE_URL, username=SNOW_USERNAME, password=SNOW_
     :param username: a string, username for Snow Software License Manager console basic auth.
     :param password: a string, password for Snow Software License Manager console basic auth.
     :param id: a string, numerical customer id to return computers from (found under https://<console ip>/api/customers ID column).
+    :param workers: an integer, number of pages to fetch concurrently.
     :returns: a list, a list of dictionaries for each application for the specified computer ID.
     :raises: ConnectionError: if unable to successfully make GET request to console.
     '''
-    items_returned = 0
-    total_items = 10000
-    applications_all = []
 
-    while True:
-        try:
-            url = f'{url}/api/customers/{id}/computers/{asset_id}/applications?'
-            headers = {'Accept': 'application/json'}
-            params = {'$inlinecount': 'allpages',
-                      '$skip': str(items_returned)}
-            response = requests.get(url, auth=requests.auth.HTTPBasicAuth(username, password), headers=headers, params=params)
-            if response.status_code != 200:
-                print(f'failed to retrieve application for {asset_id} at $skip={str(items_returned)}', f'status code: {response.status_code}')
-                exit()
-            else:
-                data = json.loads(response.content)
-                meta = data['Meta']
-                has_page_size = False
-                for item in meta:
-                    if item['Name'] == 'Count':
-                        total_items = item.get('Value')
-                    if item['Name'] == 'PageSize':
-                        has_page_size = True
-                        items_returned += item.get('Value')
-                applications = data['Body']
-                applications_all.extend(applications)
-                if not has_page_size: # The last page lacks the page size meta value
-                    break
-                print(f'{items_returned} applications of {total_items} returned from API')            
-        except ConnectionError as error:
-            print("No Response from server.", error)
-            exit()
+    return get_pages(f'{url}/api/customers/{id}/computers/{asset_id}/applications', f'applications for {asset_id}', username, password, workers)
+
+def get_all_apps(asset_ids, workers=SNOW_WORKERS):
+    '''
+    Return installed software for many computers, fetching several computers concurrently.
 
-    return applications_all
+    :param asset_ids: a list, computer IDs in Snow Software License Manager.
+    :param workers: an integer, number of computers to fetch concurrently.
+    :returns: a dict, lists of applications keyed by computer ID.
+    '''
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        #pages of a single computer are fetched serially as the pool is already saturated across computers
+        return dict(zip(asset_ids, executor.map(lambda asset_id: get_apps(asset_id, workers=1), asset_ids)))
 
+@lru_cache(maxsize=None)
 def get_app_details(app_id, url=SNOW_BASE_URL, username=SNOW_USERNAME, password=SNOW_PASSWORD, id=SNOW_CUSTOMER_ID):
     '''
-    Return a application details for a given application ID.
+    Return a application details for a given application ID. Results are memoized as the same
+    application ID is reported by many computers.
 
     :param app_id: a string, the computer ID in Snow Software License Manager for which to retrieve applications.
     :param url: a string, the base URL of the Snow Software License Manager console.
@@ -294,7 +310,7 @@ def get_app_details(app_id, url=SNOW_BASE_URL, username=SNOW_USERNAME, password=
     try:
         url = f'{url}/api/customers/{id}/applications/{app_id}'
         headers = {'Accept': 'application/json'}
-        response = requests.get(url, auth=requests.auth.HTTPBasicAuth(username, password), headers=headers)
+        response = session.get(url, auth=requests.auth.HTTPBasicAuth(username, password), headers=headers)
         if response.status_code != 200:
             print(f'failed to retrieve application details for {app_id}', f'status code: {response.status_code}')
             exit()
@@ -307,14 +323,36 @@ def get_app_details(app_id, url=SNOW_BASE_URL, username=SNOW_USERNAME, password=
 
     return details
 
+def get_all_app_details(applications, workers=SNOW_WORKERS):
+    '''
+    Fetch details for every distinct application ID concurrently, populating the get_app_details memo.
+
+    :param applications: a dict, lists of applications keyed by computer ID.
+    :param workers: an integer, number of applications to fetch concurrently.
+    :returns: None
+    '''
+
+    app_ids = {app.get('Body', {}).get('Id') for apps in applications.values() for app in apps}
+    app_ids.discard(None)
+    print(f'Retrieving details for {len(app_ids)} distinct applications')
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(get_app_details, app_ids))
+
 def main():
     assets = get_computers()
     
     # Format asset list for import into runZero
     import_assets = build_assets_from_json(assets)
 
-    # Import assets into runZero
-    import_data_to_runzero(assets=import_assets)
+    # Import new or changed assets into runZero
+    store = FingerprintStore(RUNZERO_FINGERPRINT_PATH, RUNZERO_FULL_SYNC_DAYS, SNOW_CUSTOM_SOURCE_ID)
+    try:
+        changed_assets = list(store.filter(import_assets))
+        store.report()
+        if not changed_assets or import_data_to_runzero(assets=changed_assets):
+            store.commit()
+    finally:
+        store.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -8,14 +8,18 @@
 import json
 import os
 import requests
+import sys
 import runzero
-import uuid
 from ipaddress import ip_address
 from flatten_json import flatten
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List
 from runzero.client import AuthError
 from runzero.api import CustomAssets, Sites
-from runzero.types import (ImportAsset,IPv4Address,IPv6Address,NetworkInterface,ImportTask)
+from runzero.types import (ImportAsset,IPv4Address,IPv6Address,NetworkInterface)
+
+# sdk_sync.py holds the helpers shared by the sample scripts; it is looked up next to this script, then in sdk-sample-scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sdk_sync import FingerprintStore, fallback_id, upload_chunks
 
 # Configure runZero variables
 RUNZERO_BASE_URL = os.environ['RUNZERO_BASE_URL']
@@ -27,26 +31,33 @@ RUNZERO_SITE_ID = os.environ['RUNZERO_SITE_ID']
 ZABBIX_CUSTOM_SOURCE_ID = os.environ['ZABBIX_CUSTOM_SOURCE_ID']
 ZABBIX_IMPORT_TASK_NAME = os.environ['ZABBIX_IMPORT_TASK_NAME']
 
+# Assets are uploaded in chunks of RUNZERO_UPLOAD_CHUNK_SIZE, each as its own import task, by RUNZERO_UPLOAD_WORKERS concurrent uploads
+RUNZERO_UPLOAD_CHUNK_SIZE = int(os.environ.get('RUNZERO_UPLOAD_CHUNK_SIZE', 1000))
+RUNZERO_UPLOAD_WORKERS = int(os.environ.get('RUNZERO_UPLOAD_WORKERS', 2))
+# Fingerprints of uploaded assets are kept in RUNZERO_FINGERPRINT_PATH so only new or changed assets are uploaded;
+# every RUNZERO_FULL_SYNC_DAYS all assets are uploaded regardless
+RUNZERO_FINGERPRINT_PATH = os.environ.get('RUNZERO_FINGERPRINT_PATH', 'fingerprints.db')
+RUNZERO_FULL_SYNC_DAYS = float(os.environ.get('RUNZERO_FULL_SYNC_DAYS', 7))
+
 # Configure Zabbix variables
 ZABBIX_API_URL = f"{os.environ['ZABBIX_BASE_URL']}/zabbix/api_jsonrpc.php"
 ZABBIX_API_KEY = os.environ['ZABBIX_API_KEY']
 
-def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset]:
+def build_assets_from_json(json_input: Iterable[Dict[str, Any]]) -> Iterator[ImportAsset]:
     '''
     Map asset attributes from API reponse and populate custom attributes and network interfaces.
 
-    :param json_input: a dict, API JSON response of asset data.
-    :returns: a list, asset data formatted for runZero import.  
+    :param json_input: an iterable, API JSON response records of asset data.
+    :returns: a generator, asset data formatted for runZero import, built one asset at a time.  
     '''
     
-    assets: List[ImportAsset] = []
     for item in json_input:
         # assign known API attributes from the json dict that are always present
         #If custom fields created in Zabbix align to asset fields in r0 SDK docs
         #additional attributes can be added here following the pattern
         item = flatten(item)
     
-        asset_id = item.get('hostid', str(uuid.uuid4()))
+        asset_id = item.get('hostid') or fallback_id()
         ip = item.get('interfaces_0_ip')
         mac = item.get('inventory_macaddress_a')
         os_name = item.get('inventory_os_short', '')
@@ -72,19 +83,16 @@ def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset
                custom_attrs[key] = str(value)[:1023]
 
         # Build assets for import
-        assets.append(
-            ImportAsset(
-                id=asset_id,
-                os=os_name,
-                networkInterfaces=[network],
-                hostnames=[name],
-                model=model,
-                deviceType=deviceType,
-                manufacturer=man,
-                customAttributes=custom_attrs,
-            )
+        yield ImportAsset(
+            id=asset_id,
+            os=os_name,
+            networkInterfaces=[network],
+            hostnames=[name],
+            model=model,
+            deviceType=deviceType,
+            manufacturer=man,
+            customAttributes=custom_attrs,
         )
-    return assets
 
 def build_network_interface(ips: List[str], mac: str = None) -> NetworkInterface:
     ''' 
@@ -112,12 +120,16 @@ def build_network_interface(ips: List[str], mac: str = None) -> NetworkInterface
         return NetworkInterface(macAddress=mac, ipv4Addresses=ip4s, ipv6Addresses=ip6s)
 
 
-def import_data_to_runzero(assets: List[ImportAsset]):
+def import_data_to_runzero(assets: Iterable[ImportAsset], chunk_size: int = RUNZERO_UPLOAD_CHUNK_SIZE, workers: int = RUNZERO_UPLOAD_WORKERS):
     '''
     Import assets to specified runZero Organization and Site using the specified Custom Source ID and Name.
+    Assets are consumed lazily and uploaded in chunks, each chunk as its own import task, by concurrent
+    workers so that uploading overlaps with fetching and building the remaining assets (see sdk_sync.upload_chunks).
 
-    :param assets: A list, list of assets formatted by the ImportAsset class from the runZero SDK.
-    :returns: None
+    :param assets: An iterable, assets formatted by the ImportAsset class from the runZero SDK.
+    :param chunk_size: An integer, maximum number of assets per import task.
+    :param workers: An integer, number of chunks uploaded concurrently.
+    :returns: An integer, number of assets uploaded, or None if unable to log in or find the site.
     '''
 
     # create the runzero client
@@ -139,11 +151,9 @@ def import_data_to_runzero(assets: List[ImportAsset]):
 
     # create the import manager to upload custom assets
     import_mgr = CustomAssets(client)
-    import_task = import_mgr.upload_assets(org_id=RUNZERO_ORG_ID, site_id=RUNZERO_SITE_ID, custom_integration_id=ZABBIX_CUSTOM_SOURCE_ID, assets=assets, task_info=ImportTask(name=ZABBIX_IMPORT_TASK_NAME))
-
-    if import_task:
-        print(f'task created! view status here: {RUNZERO_BASE_URL}/api/v1.0/tasks?task={import_task.id}')
 
+    return upload_chunks(import_mgr, assets, org_id=RUNZERO_ORG_ID, site_id=RUNZERO_SITE_ID, source_id=ZABBIX_CUSTOM_SOURCE_ID, task_name=ZABBIX_IMPORT_TASK_NAME,
+                         base_url=RUNZERO_BASE_URL, chunk_size=chunk_size, workers=workers)
 
 def get_assets(url=ZABBIX_API_URL, token=ZABBIX_API_KEY):
     '''
@@ -182,8 +192,15 @@ def main():
     hosts_json = hosts_json_raw["result"]
     # Format asset list for import into runZero
     import_assets = build_assets_from_json(hosts_json)
-    # Import assets into runZero
-    import_data_to_runzero(assets=import_assets)
+    # Import new or changed assets into runZero
+    store = FingerprintStore(RUNZERO_FINGERPRINT_PATH, RUNZERO_FULL_SYNC_DAYS, ZABBIX_CUSTOM_SOURCE_ID)
+    try:
+        uploaded = import_data_to_runzero(assets=store.filter(import_assets))
+        store.report()
+        if uploaded is not None:
+            store.commit()
+    finally:
+        store.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
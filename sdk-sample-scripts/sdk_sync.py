@@ -0,0 +1,199 @@
+# Helpers shared by the runZero custom integration sample scripts
+# Docs: https://www.runzero.com/docs/integrations-inbound/
+# Docs: https://pypi.org/project/runzero-sdk/
+# Prerequisite: pip install runzero-sdk
+#
+# Scripts in the sub directories of sdk-sample-scripts import this module from the parent directory; when a script
+# is copied elsewhere, copy sdk_sync.py alongside it.
+
+import hashlib
+import json
+import sqlite3
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from enum import Enum
+from itertools import islice
+from typing import Any, Iterable, Iterator, List
+from runzero.api import CustomAssets
+from runzero.types import ImportAsset, ImportTask
+
+def normalize(value: Any) -> Any:
+    '''
+    Reduce an ImportAsset, or any value nested in one, to plain JSON types. Lists are sorted so the
+    order interfaces, software or vulnerabilities are reported in does not change the fingerprint.
+
+    :param value: Any, value to normalize.
+    :returns: Any, JSON serializable value.
+    '''
+
+    if isinstance(value, Enum):
+        return normalize(value.value)
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, dict):
+        return {str(key): normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return sorted((normalize(item) for item in value), key=lambda item: json.dumps(item, sort_keys=True))
+    if hasattr(value, '__dict__'):
+        return normalize({key: item for key, item in vars(value).items() if not key.startswith('_')})
+    return str(value)
+
+def fingerprint_asset(asset: ImportAsset) -> str:
+    '''
+    Hash the normalized content of an ImportAsset.
+
+    :param asset: An ImportAsset, asset formatted for runZero import.
+    :returns: A string, hex encoded SHA-256 of the asset.
+    '''
+
+    return hashlib.sha256(json.dumps(normalize(asset), sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+# Random IDs handed out by fallback_id during this run
+FALLBACK_IDS = set()
+
+def fallback_id() -> str:
+    '''
+    Generate a random asset ID for a record that has no stable ID in the source. The ID is remembered
+    so that FingerprintStore uploads the asset without fingerprinting it.
+
+    :returns: A string, random UUID.
+    '''
+
+    asset_id = str(uuid.uuid4())
+    FALLBACK_IDS.add(asset_id)
+    return asset_id
+
+class FingerprintStore:
+    '''
+    Local store of the fingerprint last uploaded for each asset ID, kept per custom source so several
+    integrations can share one file, and used to upload only new or changed assets. Once every
+    full_sync_days all assets are uploaded regardless of their fingerprint, and fingerprints of assets
+    not seen during that full resync are pruned. Assets without a stable source ID (see fallback_id)
+    are always uploaded and never recorded.
+    '''
+
+    def __init__(self, filename: str, full_sync_days: float, source_id: str):
+        self.db = sqlite3.connect(filename)
+        self.source_id = source_id
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(fingerprints)')]
+        if columns and 'source_id' not in columns:
+            # store written before fingerprints were kept per custom source; start over with a full resync
+            self.db.execute('DROP TABLE fingerprints')
+            self.db.execute('DROP TABLE IF EXISTS meta')
+        self.db.execute('CREATE TABLE IF NOT EXISTS fingerprints (source_id TEXT, asset_id TEXT, fingerprint TEXT, synced_at REAL, PRIMARY KEY (source_id, asset_id))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (source_id TEXT, key TEXT, value TEXT, PRIMARY KEY (source_id, key))')
+        self.db.commit()
+        row = self.db.execute("SELECT value FROM meta WHERE source_id = ? AND key = 'last_full_sync'", (source_id,)).fetchone()
+        self.full_sync = row is None or time.time() - float(row[0]) >= full_sync_days * 86400
+        self.started = time.time()
+        self.pending = []
+        self.unchanged = self.new = self.changed = self.untracked = 0
+
+    def filter(self, assets: Iterable[ImportAsset]) -> Iterator[ImportAsset]:
+        '''
+        Yield only the assets that are new or changed since the last sync (or every asset during a full resync).
+
+        :param assets: An iterable, assets formatted by the ImportAsset class from the runZero SDK.
+        :returns: A generator, assets to upload.
+        '''
+
+        for asset in assets:
+            asset_id = str(asset.id)
+            if asset_id in FALLBACK_IDS:
+                # a new random ID every run, so it can never match a previous fingerprint
+                self.untracked += 1
+                yield asset
+                continue
+            fingerprint = fingerprint_asset(asset)
+            row = self.db.execute('SELECT fingerprint FROM fingerprints WHERE source_id = ? AND asset_id = ?', (self.source_id, asset_id)).fetchone()
+            if row is None:
+                self.new += 1
+            elif row[0] == fingerprint:
+                self.unchanged += 1
+                if not self.full_sync:
+                    continue
+            else:
+                self.changed += 1
+            self.pending.append((self.source_id, asset_id, fingerprint, time.time()))
+            yield asset
+
+    def commit(self):
+        '''
+        Record the fingerprints of the assets uploaded this run. Call only once the upload succeeded.
+        After a full resync, fingerprints of assets the source no longer reports are removed.
+        '''
+
+        self.db.executemany('INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)', self.pending)
+        if self.full_sync:
+            # every asset seen during a full resync was just recorded with synced_at after the run started
+            self.db.execute('DELETE FROM fingerprints WHERE source_id = ? AND synced_at < ?', (self.source_id, self.started))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, 'last_full_sync', ?)", (self.source_id, str(time.time())))
+        self.db.commit()
+        self.pending = []
+
+    def report(self):
+        total = self.unchanged + self.new + self.changed
+        ratio = self.unchanged / total if total else 0.0
+        mode = 'full resync, uploading all assets' if self.full_sync else f'uploading {self.new + self.changed} assets'
+        print(f'{self.unchanged} of {total} assets unchanged ({ratio:.1%} hit ratio), {self.new} new, {self.changed} changed; {mode}')
+        if self.untracked:
+            print(f'{self.untracked} assets without a stable source ID uploaded without fingerprinting')
+
+    def close(self):
+        self.db.close()
+
+def chunked(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    '''
+    Split an iterable into lists of at most size items without materializing the whole iterable.
+
+    :param iterable: An iterable, items to split.
+    :param size: An integer, maximum number of items per chunk.
+    :returns: A generator, lists of items.
+    '''
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def upload_chunks(import_mgr: CustomAssets, assets: Iterable[ImportAsset], org_id: str, site_id: str, source_id: str, task_name: str,
+                  base_url: str, chunk_size: int = 1000, workers: int = 2) -> int:
+    '''
+    Upload assets in chunks, each chunk as its own import task, by concurrent workers. Assets are consumed lazily
+    so that uploading overlaps with fetching and building the remaining assets, and at most workers chunks are
+    held in memory at a time.
+
+    :param import_mgr: A CustomAssets, runZero SDK import manager of a logged in client.
+    :param assets: An iterable, assets formatted by the ImportAsset class from the runZero SDK.
+    :param org_id: A string, UUID of the runZero Organization.
+    :param site_id: A string, UUID of the runZero Site.
+    :param source_id: A string, UUID of the Custom Integration Source.
+    :param task_name: A string, name of the import tasks, numbered per chunk.
+    :param base_url: A string, URL of the runZero console.
+    :param chunk_size: An integer, maximum number of assets per import task.
+    :param workers: An integer, number of chunks uploaded concurrently.
+    :returns: An integer, number of assets uploaded.
+    '''
+
+    def upload(index: int, chunk: List[ImportAsset]) -> int:
+        import_task = import_mgr.upload_assets(org_id=org_id, site_id=site_id, custom_integration_id=source_id, assets=chunk, task_info=ImportTask(name=f'{task_name} ({index})'))
+        if import_task:
+            print(f'task created! view status here: {base_url}/api/v1.0/tasks?task={import_task.id}')
+        return len(chunk)
+
+    uploaded = 0
+    index = 0
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index, chunk in enumerate(chunked(assets, chunk_size), start=1):
+            # wait for a free worker so at most workers chunks are held in memory while the next is built
+            if len(pending) >= workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                uploaded += sum(future.result() for future in done)
+            pending.add(executor.submit(upload, index, chunk))
+        uploaded += sum(future.result() for future in pending)
+    print(f'{uploaded} assets uploaded in {index} import tasks')
+    return uploaded
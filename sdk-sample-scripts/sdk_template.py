@@ -8,14 +8,14 @@
 import json
 import requests
 import os
-import uuid
 from flatten_json import flatten
 from ipaddress import ip_address
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List
 import runzero
 from runzero.client import AuthError
 from runzero.api import CustomAssets, Sites
-from runzero.types import (ImportAsset,IPv4Address,IPv6Address,NetworkInterface,ImportTask,Software,Vulnerability)
+from runzero.types import (ImportAsset,IPv4Address,IPv6Address,NetworkInterface,Software,Vulnerability)
+from sdk_sync import FingerprintStore, fallback_id, upload_chunks
 
 # Configure runZero variables
 # Script uses pipenv, but os.environ[] can be swapped out for a hardcoded value to make testing easier
@@ -28,13 +28,20 @@ RUNZERO_SITE_ID = os.environ['RUNZERO_SITE_ID']
 INTEGRATION_CUSTOM_SOURCE_ID = os.environ['INTEGRATION_CUSTOM_SOURCE_ID']
 INTEGRATION_IMPORT_TASK_NAME = os.environ['INTEGRATION_IMPORT_TASK_NAME']
 
+# Assets are uploaded in chunks of RUNZERO_UPLOAD_CHUNK_SIZE, each as its own import task, by RUNZERO_UPLOAD_WORKERS concurrent uploads
+RUNZERO_UPLOAD_CHUNK_SIZE = int(os.environ.get('RUNZERO_UPLOAD_CHUNK_SIZE', 1000))
+RUNZERO_UPLOAD_WORKERS = int(os.environ.get('RUNZERO_UPLOAD_WORKERS', 2))
+# Fingerprints of uploaded assets are kept in RUNZERO_FINGERPRINT_PATH so only new or changed assets are uploaded;
+# every RUNZERO_FULL_SYNC_DAYS all assets are uploaded regardless
+RUNZERO_FINGERPRINT_PATH = os.environ.get('RUNZERO_FINGERPRINT_PATH', 'fingerprints.db')
+RUNZERO_FULL_SYNC_DAYS = float(os.environ.get('RUNZERO_FULL_SYNC_DAYS', 7))
 
 # Configure Integration API variables (examples provided)
 # Script uses pipenv, but os.environ[] can be swapped out for a hardcoded value to make testing easier
 API_URL = f"{os.environ['API_BASE_URL']}/api/v1/foobar"
 API_KEY = os.environ['API_KEY']
 
-def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset]:
+def build_assets_from_json(json_input: Iterable[Dict[str, Any]]) -> Iterator[ImportAsset]:
     '''
     This is an example function to highlight how to handle converting data from an API into the ImportAsset format that
     is required for uploading to the runZero platform. This function assumes that the json has been converted into a list 
@@ -42,15 +49,14 @@ def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset
 
     Map asset attributes from API reponse and populate custom attributes and network interfaces.
 
-    :param json_input: a dict, API JSON response of asset data.
-    :returns: a list, asset data formatted for runZero import.  
+    :param json_input: an iterable, API JSON response records of asset data.
+    :returns: a generator, asset data formatted for runZero import, built one asset at a time.  
     '''
 
-    assets: List[ImportAsset] = []
     for item in json_input:
         #Assign API attributes from the json dict that correspond to SDK
         item = flatten(item)
-        asset_id = item.get('id', str(uuid.uuid4()))
+        asset_id = item.get('id') or fallback_id()
         mac = item.get('custom_api_mac', None)
         model = item.get('custom_api_model_name', '')
         device_type = item.get('custom_api_device', '')
@@ -81,19 +87,16 @@ def build_assets_from_json(json_input: List[Dict[str, Any]]) -> List[ImportAsset
             vulnerabilities.append(vulnerability)
 
         # Build assets for import
-        assets.append(
-            ImportAsset(
-                id=asset_id,
-                networkInterfaces=[network],
-                model=model,
-                deviceType=device_type,
-                manufacturer=manuf,
-                customAttributes=custom_attrs,
-                software=warez,
-                vulnerabilities=vulnerabilities
-            )
+        yield ImportAsset(
+            id=asset_id,
+            networkInterfaces=[network],
+            model=model,
+            deviceType=device_type,
+            manufacturer=manuf,
+            customAttributes=custom_attrs,
+            software=warez,
+            vulnerabilities=vulnerabilities
         )
-    return assets
 
 def build_network_interface(ips: List[str], mac: str = None) -> NetworkInterface:
     ''' 
@@ -183,12 +186,16 @@ def build_vuln(vuln_details):
                          solution=solution,
                          customAttributes=custom_attrs)
 
-def import_data_to_runzero(assets: List[ImportAsset]):
+def import_data_to_runzero(assets: Iterable[ImportAsset], chunk_size: int = RUNZERO_UPLOAD_CHUNK_SIZE, workers: int = RUNZERO_UPLOAD_WORKERS):
     '''
     Import assets to specified runZero Organization and Site using the specified Custom Source ID and Name.
+    Assets are consumed lazily and uploaded in chunks, each chunk as its own import task, by concurrent
+    workers so that uploading overlaps with fetching and building the remaining assets (see sdk_sync.upload_chunks).
 
-    :param assets: A list, list of assets formatted by the ImportAsset class from the runZero SDK.
-    :returns: None
+    :param assets: An iterable, assets formatted by the ImportAsset class from the runZero SDK.
+    :param chunk_size: An integer, maximum number of assets per import task.
+    :param workers: An integer, number of chunks uploaded concurrently.
+    :returns: An integer, number of assets uploaded, or None if unable to log in or find the site.
     '''
 
     # create the runzero client
@@ -210,10 +217,9 @@ def import_data_to_runzero(assets: List[ImportAsset]):
 
     # create the import manager to upload custom assets
     import_mgr = CustomAssets(client)
-    import_task = import_mgr.upload_assets(org_id=RUNZERO_ORG_ID, site_id=RUNZERO_SITE_ID, custom_integration_id=INTEGRATION_CUSTOM_SOURCE_ID, assets=assets, task_info=ImportTask(name=INTEGRATION_IMPORT_TASK_NAME))
 
-    if import_task:
-        print(f'task created! view status here: {RUNZERO_BASE_URL}/api/v1.0/tasks?task={import_task.id}')
+    return upload_chunks(import_mgr, assets, org_id=RUNZERO_ORG_ID, site_id=RUNZERO_SITE_ID, source_id=INTEGRATION_CUSTOM_SOURCE_ID, task_name=INTEGRATION_IMPORT_TASK_NAME,
+                         base_url=RUNZERO_BASE_URL, chunk_size=chunk_size, workers=workers)
 
 def get_assets(url=API_URL, token=API_KEY):
     '''
@@ -253,11 +259,19 @@ def main():
     json_raw = get_assets()
     parsed_json = parse_response(json_raw)
 
-    # Format asset list for import into runZero
+    # Format asset list for import into runZero; assets are built lazily as the upload consumes them, so
+    # if get_assets/parse_response yield records page by page, uploading overlaps with fetching
     import_assets = build_assets_from_json(parsed_json)
 
-    # Import assets into runZero
-    import_data_to_runzero(assets=import_assets)
+    # Import new or changed assets into runZero
+    store = FingerprintStore(RUNZERO_FINGERPRINT_PATH, RUNZERO_FULL_SYNC_DAYS, INTEGRATION_CUSTOM_SOURCE_ID)
+    try:
+        uploaded = import_data_to_runzero(assets=store.filter(import_assets))
+        store.report()
+        if uploaded is not None:
+            store.commit()
+    finally:
+        store.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file